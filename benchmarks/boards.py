@@ -0,0 +1,119 @@
+"""Generate synthetic boards to benchmark the simulator with
+
+`generate_board` writes an mxGraph document in the form the frontend saves
+boards in, so generated boards go through `build_sim` like real ones. A board
+is laid out as
+
+    Sources -> Process 1 -> ... -> Process N -> Decision 1 -> ... -> Exit
+                                                    |
+                                                  Exit
+
+Every Source creates entities at `arrival_rate` per second, with exponential
+delays, and feeds the first Process. Each Process delays entities for an
+exponential time averaging `service_time` seconds. Decisions follow the
+Processes in a chain of `decision_depth`; each sends an entity on with
+probability 1 - `leave_probability` and to an Exit of its own otherwise.
+
+With `resources`, the Processes take turns seizing, delaying and releasing
+each resource. Each resource's capacity is the smallest which keeps its
+utilization, the fraction of its capacity in use on average, at most
+`contention`, so a `contention` near 1 makes entities queue.
+"""
+
+import math
+
+DEFAULTS = {
+    'sources': 1,
+    'processes': 5,
+    'decision_depth': 1,
+    'arrival_rate': 1.0,
+    'service_time': 1.0,
+    'resources': 0,
+    'contention': 0.5,
+    'leave_probability': 0.1,
+}
+
+NODE = '<mxCell id="%s" value="%s" style="shape=%s;" vertex="1" parent="1"/>'
+WRAPPED = '<object label="%s" %s id="%s"><mxCell style="shape=%s;" ' \
+    'vertex="1" parent="1"/></object>'
+EDGE = '<mxCell id="%s" style="exitX=1;exitY=%s;" edge="1" parent="1" ' \
+    'source="%s" target="%s"/>'
+
+def resource_capacities(options):
+    """Return the capacity of each resource of a generated board."""
+    if not options['resources']:
+        return []
+
+    arrivals = options['sources'] * options['arrival_rate']
+    capacities = []
+    for number in range(options['resources']):
+        # Processes are assigned resources round-robin
+        users = len(range(number, options['processes'], options['resources']))
+        load = arrivals * options['service_time'] * users
+        capacities.append(max(1, int(math.ceil(load / options['contention']))))
+    return capacities
+
+def generate_board(**options):
+    """Return the XML of a synthetic board. Options not given take their
+    values from DEFAULTS."""
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown option(s): %s' % ', '.join(sorted(unknown)))
+    options = dict(DEFAULTS, **options)
+    if options['sources'] < 1 or options['processes'] < 1:
+        raise ValueError('Boards need at least one Source and one Process')
+    if options['resources'] and not 0 < options['contention'] <= 1:
+        raise ValueError('"contention" must be in (0, 1]')
+
+    cells = ['<mxCell id="0"/>', '<mxCell id="1" parent="0"/>']
+    edges = []
+
+    def connect(source, target, exit_y=0.5):
+        """Add an edge from `source` to `target`."""
+        edges.append(EDGE % ('e%d' % len(edges), exit_y, source, target))
+
+    arrival = 'type="delay" delayType="exponential" val="%r"' % \
+        options['arrival_rate']
+    for number in range(options['sources']):
+        cells.append(WRAPPED % ('Source %d' % number, arrival,
+                                's%d' % number, 'source'))
+        connect('s%d' % number, 'p0')
+
+    rate = 1.0 / options['service_time']
+    for number in range(options['processes']):
+        attributes = 'nodeType="process" type="delay" ' \
+            'delayType="exponential" val="%r"' % rate
+        if options['resources']:
+            attributes = 'nodeType="process" type="siezeDelayRelease" ' \
+                'delayType="exponential" val="%r" resource="r%d"' % (
+                    rate, number % options['resources'])
+        cells.append(WRAPPED % ('Process %d' % number, attributes,
+                                'p%d' % number, 'process'))
+        if number + 1 < options['processes']:
+            connect('p%d' % number, 'p%d' % (number + 1))
+
+    connect('p%d' % (options['processes'] - 1),
+            'd0' if options['decision_depth'] else 'exit')
+    for number in range(options['decision_depth']):
+        decision = 'd%d' % number
+        cells.append(WRAPPED % (
+            'Decision %d' % number,
+            'decision="%r"' % options['leave_probability'],
+            decision, 'decision'))
+        cells.append(NODE % ('x%d' % number, 'Exit', 'exit'))
+        # The top edge is taken with probability 1 - `leave_probability`
+        successor = 'd%d' % (number + 1)
+        if number + 1 == options['decision_depth']:
+            successor = 'exit'
+        connect(decision, successor, 0)
+        connect(decision, 'x%d' % number, 1)
+    cells.append(NODE % ('exit', 'Exit', 'exit'))
+
+    for number, capacity in enumerate(resource_capacities(options)):
+        cells.append(WRAPPED % (
+            'Resource', 'nodeType="resource" Name="r%d" Count="%d"' % (
+                number, capacity),
+            'r%d' % number, 'resource'))
+
+    return '<mxGraphModel><root>%s</root></mxGraphModel>' % \
+        ''.join(cells + edges)
@@ -0,0 +1,187 @@
+"""Benchmark building, running and analyzing synthetic boards
+
+Run `python -m benchmarks.harness` to run every case in CASES, reporting for
+each the wall time of `build_sim` and of `Simulation.run`, the time spent in
+each of their phases (see simulator.metrics; 'analyze' is
+`analyze_simulation` or its equivalent), the events processed per second and
+the peak memory allocated, measured with tracemalloc in a separate run.
+Times are the fastest of `--repeat` runs.
+
+Results are printed as JSON, and saved with `--output FILE`. Given
+`--baseline FILE`, results saved earlier on the same machine, each case is
+compared with it, and the harness exits with status 1 if any time or peak
+grew, or any rate fell, by more than `--tolerance` (a fraction, default 0.2).
+`--case NAME` runs only the named cases, and `--engine` picks the engine:
+with the default, 'auto', boards without resources run on the vector engine,
+so `--engine simpy` is needed to measure `analyze_simulation` on every case.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import simpy
+from simulator import Simulation
+from simulator.build_sim import build_sim
+from simulator.metrics import Metrics
+from benchmarks.boards import generate_board
+
+# Name: (generate_board options, run parameters)
+CASES = {
+    'small': ({}, {'horizon': 10000}),
+    'long-line': ({'processes': 100}, {'horizon': 1000}),
+    'deep-decisions': (
+        {'decision_depth': 100, 'leave_probability': 0.01},
+        {'horizon': 2000}),
+    'many-sources': ({'sources': 20}, {'horizon': 1000}),
+    'busy': ({'arrival_rate': 20.0}, {'horizon': 1000}),
+    'contended': (
+        {'resources': 3, 'contention': 0.95, 'arrival_rate': 2.0},
+        {'horizon': 2000}),
+    'summary': (
+        {'resources': 2, 'arrival_rate': 5.0},
+        {'horizon': 2000, 'statistics': 'summary'}),
+}
+
+# (section, key, whether larger values are better) of each result compared
+# with the baseline
+COMPARED = [
+    ('build', 'seconds', False),
+    ('build', 'peak_bytes', False),
+    ('run', 'seconds', False),
+    ('run', 'peak_bytes', False),
+    ('run', 'events_per_second', True),
+]
+
+def measure(function, repeat):
+    """Call `function(metrics)` `repeat` times with fresh Metrics, returning
+    the Metrics and wall seconds of the fastest call."""
+    fastest = None
+    for _ in range(repeat):
+        metrics = Metrics()
+        started = time.monotonic()
+        function(metrics)
+        seconds = time.monotonic() - started
+        if fastest is None or seconds < fastest[1]:
+            fastest = (metrics, seconds)
+    return fastest
+
+def peak_memory(function):
+    """Return the most memory `function(metrics)` had allocated at once."""
+    tracemalloc.start()
+    try:
+        function(Metrics())
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_case(options, params, repeat=3, memory=True):
+    """Benchmark the board generated with `options`, run with `params`."""
+    xml = generate_board(**options)
+    sim_ir = build_sim(xml)
+
+    def build(metrics):
+        """Build the board."""
+        build_sim(xml, metrics)
+
+    def simulate(metrics):
+        """Run the board."""
+        Simulation(sim_ir, params, processes=1, metrics=metrics).run()
+
+    result = {'options': options, 'params': params, 'nodes': len(sim_ir)}
+    # The simulator prints each board it runs, which would be timed too
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for section, function in [('build', build), ('run', simulate)]:
+                metrics, seconds = measure(function, repeat)
+                result[section] = dict(metrics.to_dict(), seconds=seconds)
+                if memory:
+                    result[section]['peak_bytes'] = peak_memory(function)
+    return result
+
+def run_benchmarks(names=None, engine='auto', repeat=3, memory=True):
+    """Run the named cases (by default all of them) and return their results
+    along with a description of the environment they ran in."""
+    cases = {}
+    for name in sorted(names or CASES):
+        options, params = CASES[name]
+        cases[name] = run_case(options, dict(params, engine=engine), repeat,
+                               memory)
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'simpy': getattr(simpy, '__version__', None),
+            'machine': platform.machine(),
+            'engine': engine,
+        },
+        'cases': cases,
+    }
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare results with a baseline, returning a line describing each
+    value compared and the lines of the values which regressed."""
+    report = []
+    regressions = []
+    for name, case in sorted(results['cases'].items()):
+        if name not in baseline['cases']:
+            continue
+        for section, key, larger_is_better in COMPARED:
+            before = baseline['cases'][name].get(section, {}).get(key)
+            after = case.get(section, {}).get(key)
+            if not before or after is None:
+                continue
+            ratio = after / float(before)
+            line = '%s %s.%s: %.4g -> %.4g (x%.2f)' % (
+                name, section, key, before, after, ratio)
+            report.append(line)
+            if larger_is_better:
+                regressed = ratio < 1 - tolerance
+            else:
+                regressed = ratio > 1 + tolerance
+            if regressed:
+                regressions.append(line)
+    return report, regressions
+
+def main(argv=None):
+    """Run the benchmarks from the command line, returning the exit status."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help='run only this case (may be repeated)')
+    parser.add_argument('--engine', default='auto',
+                        help='engine run parameter (default: auto)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs to take the fastest of (default: 3)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip measuring peak memory')
+    parser.add_argument('--output', help='save the results to this file')
+    parser.add_argument('--baseline', help='compare with results saved here')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which a value may regress')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.case, args.engine, args.repeat,
+                             not args.no_memory)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        report, regressions = compare(results, baseline, args.tolerance)
+        print('\n'.join(report), file=sys.stderr)
+        if regressions:
+            print('Regressed by more than %d%%:\n%s' % (
+                args.tolerance * 100, '\n'.join(regressions)), file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Test the synthetic boards and the benchmark harness."""
+
+import unittest
+from simulator import Simulation
+from simulator.build_sim import build_sim
+from simulator.ir import PROCESS, DECISION, EXIT
+from .boards import generate_board
+from .harness import run_case, compare
+
+class BenchmarksTestCase(unittest.TestCase):
+    """Tests for the benchmark suite."""
+
+    def test_boards_build(self):
+        """Should generate boards of the requested shape."""
+        sim_ir = build_sim(generate_board(
+            sources=3, processes=4, decision_depth=2, resources=2))
+        assert len(sim_ir.nodes_of_type(PROCESS)) == 4
+        assert len(sim_ir.nodes_of_type(DECISION)) == 2
+        assert len(sim_ir.nodes_of_type(EXIT)) == 3
+        assert sim_ir.resource_names == ['r0', 'r1']
+
+        with self.assertRaises(ValueError):
+            generate_board(nodes=10)
+
+    def test_contention(self):
+        """Should size resources to keep their utilization below the
+        contention asked for."""
+        sim_ir = build_sim(generate_board(resources=1, contention=0.8,
+                                      arrival_rate=2.0))
+        statistics = Simulation(sim_ir, {
+            'horizon': 2000, 'statistics': 'summary'}).run_replication()
+        utilization = statistics['resources']['r0']['utilization']
+        assert 0.6 < utilization < 0.85
+
+    def test_regressions_are_reported(self):
+        """Should report values which got worse than the baseline allows."""
+        case = run_case({}, {'horizon': 100}, repeat=1, memory=False)
+        assert case['run']['counts']['entities'] > 0
+        assert 'parse' in case['build']['phases']
+
+        baseline = {'cases': {'small': case}}
+        slower = dict(case, run=dict(case['run'],
+                                     seconds=case['run']['seconds'] * 2))
+        report, regressions = compare({'cases': {'small': slower}}, baseline)
+        assert len(report) >= 3
+        assert len(regressions) == 1 and 'run.seconds' in regressions[0]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+"""Named counters shared by every process using the simulations database."""
+
+def increment_counter(conn, name, amount=1):
+    """Add `amount` to the counter `name`, creating it if needed.
+
+    Does not commit, so the caller can make it part of a larger transaction.
+    """
+    conn.execute('INSERT OR IGNORE INTO counters(name, value) VALUES (?, 0)',
+                 (name,))
+    conn.execute('UPDATE counters SET value = value + ? WHERE name = ?',
+                 (amount, name))
+
+def get_counters(conn, names):
+    """Return the value of each counter in `names`, defaulting to 0."""
+    values = dict.fromkeys(names, 0)
+    placeholders = ', '.join('?' * len(names))
+    for name, value in conn.execute(
+            'SELECT name, value FROM counters WHERE name IN (%s)' % (
+                placeholders,), list(names)):
+        values[name] = value
+    return values
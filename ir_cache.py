@@ -0,0 +1,89 @@
+"""Cache compiled simulations so boards which run again skip the compiler.
+
+The same board is often submitted many times, with different run parameters
+or numbers of replications. The IR compiled from it (see simulator.ir) is
+stored keyed by a hash of the board's XML, so repeat submissions go straight
+to execution without being parsed and validated again.
+
+Only the `max_entries` most recently used entries are kept. Hits and misses
+are counted in the `counters` table.
+"""
+
+import time
+from counters import increment_counter
+from simulator.build_sim import build_sim
+from simulator.ir import SimulationIR, ir_key
+
+HITS = 'ir_cache_hits'
+MISSES = 'ir_cache_misses'
+
+DEFAULT_MAX_ENTRIES = 1024
+
+class IRCache(object):
+    """Cache of compiled simulations stored in SQLite."""
+    def __init__(self, conn, max_entries=DEFAULT_MAX_ENTRIES):
+        self.conn = conn
+        self.max_entries = max_entries
+
+    def get(self, key):
+        """Return the cached IR for `key`, or None on a miss."""
+        record = self.conn.execute(
+            'SELECT ir FROM ir_cache WHERE key = ?', (key,)).fetchone()
+        sim_ir = None
+        if record is not None:
+            sim_ir = SimulationIR.from_json(record[0])
+
+        if sim_ir is None:
+            increment_counter(self.conn, MISSES)
+            return None
+
+        self.conn.execute(
+            'UPDATE ir_cache SET last_used_at = ? WHERE key = ?',
+            (time.time(), key))
+        increment_counter(self.conn, HITS)
+        return sim_ir
+
+    def put(self, key, sim_ir):
+        """Store the IR for `key`, evicting the least recently used entries
+        beyond `max_entries`.
+
+        The table never holds more than `max_entries` + 1 rows, so counting
+        them is cheap, and the oldest are read off the index on
+        `last_used_at` rather than by sorting the table.
+        """
+        self.conn.execute('''
+                          INSERT OR REPLACE INTO ir_cache(key, ir, last_used_at)
+                          VALUES (?, ?, ?)''',
+                          (key, sim_ir.to_json(), time.time()))
+        count = self.conn.execute(
+            'SELECT COUNT(*) FROM ir_cache').fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute('''
+                              DELETE FROM ir_cache WHERE key IN (
+                                  SELECT key FROM ir_cache
+                                  ORDER BY last_used_at, rowid
+                                  LIMIT ?)''',
+                              (count - self.max_entries,))
+
+    def build(self, xml_string, metrics=None):
+        """Return the IR for a board, compiling it with `build_sim` and
+        caching the result on a miss. Compiling is timed by `metrics`, if
+        given.
+
+        Boards which fail to build raise SimBuildError and aren't cached.
+        """
+        key = ir_key(xml_string)
+        sim_ir = self.get(key)
+        if sim_ir is None:
+            sim_ir = build_sim(xml_string, metrics)
+            self.put(key, sim_ir)
+        return sim_ir
+
+def load_ir_cache(conn, config):
+    """Create the IR cache described by the `[Cache]` section of the config,
+    or return None if it is disabled."""
+    max_entries = config.getint(
+        'Cache', 'ir_max_entries', fallback=DEFAULT_MAX_ENTRIES)
+    if max_entries <= 0:
+        return None
+    return IRCache(conn, max_entries)
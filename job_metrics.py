@@ -0,0 +1,210 @@
+"""Store how long each job took and what it did.
+
+Each finished job gets a row in the `job_metrics` table holding the time
+spent in each of its phases and its counts (see simulator.metrics). Once its
+result has been posted to the callback url, the time the post took and when
+it succeeded are added. Rows are kept for `RETENTION` seconds after their
+job finished.
+
+Totals across jobs are kept in the `counters` table as jobs finish, so
+`prometheus_metrics` can report them in the Prometheus text format without
+reading the jobs themselves: the number of jobs completed and failed, and
+histograms of job runtimes and of the latency from a job finishing to its
+result being delivered. Each histogram bucket is a counter of the values
+which fell into it, summed into cumulative buckets as they're reported.
+"""
+
+import json
+import time
+from counters import increment_counter, get_counters
+from ir_cache import HITS as IR_CACHE_HITS, MISSES as IR_CACHE_MISSES
+from result_cache import HITS as RESULT_CACHE_HITS, \
+    MISSES as RESULT_CACHE_MISSES
+
+COMPLETED = 'jobs_completed'
+FAILED = 'jobs_failed'
+
+# Seconds the metrics of each job are kept for (one week)
+RETENTION = 7 * 24 * 60 * 60
+
+# Upper bounds, in seconds, of the buckets of each histogram
+HISTOGRAMS = {
+    'job_runtime_seconds': [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300],
+    'delivery_latency_seconds': [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300,
+                                 3600],
+}
+
+# Counters reported as they are, by the name they're reported under
+COUNTERS = [
+    (COMPLETED, 'sim_jobs_completed_total',
+     'Simulations which ran and produced statistics.'),
+    (FAILED, 'sim_jobs_failed_total',
+     'Simulations which could not be built or run.'),
+    (RESULT_CACHE_HITS, 'sim_result_cache_hits_total',
+     'Simulations served from the result cache.'),
+    (RESULT_CACHE_MISSES, 'sim_result_cache_misses_total',
+     'Simulations not found in the result cache.'),
+    (IR_CACHE_HITS, 'sim_ir_cache_hits_total',
+     'Boards which did not need compiling again.'),
+    (IR_CACHE_MISSES, 'sim_ir_cache_misses_total',
+     'Boards which had to be compiled.'),
+]
+
+HISTOGRAM_HELP = {
+    'job_runtime_seconds':
+        'Seconds from starting a job to storing its result.',
+    'delivery_latency_seconds':
+        'Seconds from a job finishing to its result being delivered.',
+}
+
+def bucket_name(histogram, bound):
+    """Return the name of the counter of a histogram's bucket."""
+    return '%s_bucket:%s' % (histogram, bound)
+
+def observe(conn, histogram, value):
+    """Add `value` to the histogram of that name.
+
+    Does not commit.
+    """
+    bound = '+Inf'
+    for upper in HISTOGRAMS[histogram]:
+        if value <= upper:
+            bound = upper
+            break
+    increment_counter(conn, bucket_name(histogram, bound))
+    increment_counter(conn, '%s_sum' % histogram, value)
+    increment_counter(conn, '%s_count' % histogram)
+
+def record_job(conn, job_id, user_id, succeeded, runtime, metrics,
+               retention=RETENTION):
+    """Store the Metrics of a job which ran for `runtime` seconds, and
+    delete those of jobs which finished over `retention` seconds ago. The
+    totals across jobs are kept regardless.
+
+    Does not commit, so the caller can make it part of a larger transaction.
+    """
+    now = time.time()
+    conn.execute('DELETE FROM job_metrics WHERE finished_at < ?',
+                 (now - retention,))
+    conn.execute('''
+                 INSERT OR REPLACE INTO job_metrics(
+                     job_id, user_id, status, finished_at, runtime, metrics)
+                 VALUES (?, ?, ?, ?, ?, ?)''',
+                 (job_id, user_id, 'completed' if succeeded else 'failed',
+                  now, runtime, json.dumps(metrics.to_dict())))
+    increment_counter(conn, COMPLETED if succeeded else FAILED)
+    observe(conn, 'job_runtime_seconds', runtime)
+
+def record_delivery(conn, job_id, seconds):
+    """Note that a job's result was delivered, by a post taking `seconds`.
+
+    Does not commit.
+    """
+    now = time.time()
+    cursor = conn.execute('''
+                          UPDATE job_metrics
+                          SET delivered_at = ?, delivery_seconds = ?
+                          WHERE job_id = ?''', (now, seconds, job_id))
+    if cursor.rowcount:
+        finished_at = conn.execute(
+            'SELECT finished_at FROM job_metrics WHERE job_id = ?',
+            (job_id,)).fetchone()[0]
+        observe(conn, 'delivery_latency_seconds', now - finished_at)
+
+def get_job_metrics(conn, job_id):
+    """Return the stored metrics of a job as a dict, or None."""
+    record = conn.execute('''
+                          SELECT status, finished_at, runtime, metrics,
+                                 delivered_at, delivery_seconds
+                          FROM job_metrics
+                          WHERE job_id = ?''', (job_id,)).fetchone()
+    if record is None:
+        return None
+
+    status, finished_at, runtime, metrics, delivered_at, delivery = record
+    job = json.loads(metrics)
+    job.update({
+        'status': status,
+        'finished_at': finished_at,
+        'runtime': runtime,
+        'delivered_at': delivered_at,
+        'delivery_seconds': delivery,
+    })
+    return job
+
+def queue_statistics(conn):
+    """Return the number of queued and running simulations, and the age in
+    seconds of the oldest queued simulation (0 if there is none).
+
+    Each is answered from the index on (status, created_at) without reading
+    the simulations themselves.
+    """
+    counts = dict(conn.execute('''
+                               SELECT status, COUNT(*)
+                               FROM simulations
+                               WHERE status IN ('queued', 'running')
+                               GROUP BY status''').fetchall())
+    oldest_age = conn.execute('''
+                              SELECT strftime('%s', 'now') -
+                                     strftime('%s', created_at)
+                              FROM simulations
+                              WHERE status = 'queued'
+                              ORDER BY created_at
+                              LIMIT 1''').fetchone()
+    return {
+        'queued': counts.get('queued', 0),
+        'running': counts.get('running', 0),
+        'oldest_age': oldest_age[0] if oldest_age is not None else 0,
+    }
+
+def format_value(value):
+    """Format a sample value as Prometheus expects."""
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+def prometheus_metrics(conn):
+    """Return the state of the queue and the totals of every job so far in
+    the Prometheus text format."""
+    queue = queue_statistics(conn)
+    lines = []
+
+    def sample(name, metric_type, description, value):
+        """Add a metric with a single sample."""
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        lines.append('%s %s' % (name, format_value(value)))
+
+    sample('sim_queue_depth', 'gauge', 'Simulations waiting to be run.',
+           queue['queued'])
+    sample('sim_jobs_running', 'gauge', 'Simulations being run.',
+           queue['running'])
+    sample('sim_oldest_job_age_seconds', 'gauge',
+           'Seconds the oldest queued simulation has waited.',
+           queue['oldest_age'])
+
+    names = [counter for counter, _, _ in COUNTERS]
+    for histogram, bounds in sorted(HISTOGRAMS.items()):
+        names.extend(bucket_name(histogram, bound)
+                     for bound in bounds + ['+Inf'])
+        names.extend(['%s_sum' % histogram, '%s_count' % histogram])
+    counters = get_counters(conn, names)
+
+    for counter, name, description in COUNTERS:
+        sample(name, 'counter', description, counters[counter])
+
+    for histogram, bounds in sorted(HISTOGRAMS.items()):
+        name = 'sim_%s' % histogram
+        lines.append('# HELP %s %s' % (name, HISTOGRAM_HELP[histogram]))
+        lines.append('# TYPE %s histogram' % name)
+        cumulative = 0
+        for bound in bounds + ['+Inf']:
+            cumulative += counters[bucket_name(histogram, bound)]
+            lines.append('%s_bucket{le="%s"} %s' % (
+                name, bound, format_value(cumulative)))
+        lines.append('%s_sum %s' % (
+            name, format_value(counters['%s_sum' % histogram])))
+        lines.append('%s_count %s' % (
+            name, format_value(counters['%s_count' % histogram])))
+
+    return '\n'.join(lines) + '\n'
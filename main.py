@@ -1,18 +1,73 @@
 """Simulation server"""
 
 import json
-import sqlite3
+import os
+import threading
 from sim_worker import run_oldest_sim
+from setup_db import DB_PATH, connect_db
+from result_cache import ResultCache
+from job_metrics import prometheus_metrics
 from flask import Flask, request, Response
 
 app = Flask(__name__)
+app.config['DATABASE'] = DB_PATH
+
+INSERT_SIMULATION = '''
+    INSERT INTO simulations(simulation, user_id, board_name, params)
+    VALUES (?, ?, ?, ?)'''
+
+# Connections are reused across requests. uWSGI forks its processes after
+# importing this module, so each connection is tied to the process (and
+# thread) which opened it.
+_connections = threading.local()
+
+def get_db():
+    """Return this process's connection to the simulations database."""
+    key = (os.getpid(), app.config['DATABASE'])
+    if getattr(_connections, 'key', None) != key:
+        conn = connect_db(app.config['DATABASE'])
+        # Commits in WAL mode no longer wait on an fsync; the WAL is synced at
+        # checkpoints instead, so many small inserts share each sync. The
+        # database stays consistent if the process crashes.
+        conn.execute('PRAGMA synchronous = NORMAL')
+        _connections.conn = conn
+        _connections.key = key
+    return _connections.conn
+
+def validate_submission(submission):
+    """Return an error message if a submitted simulation is malformed."""
+    if not isinstance(submission, dict):
+        return 'Each simulation must be a JSON object'
+    if 'simulation' not in submission:
+        return 'Request body must contain the key "simulation"'
+    if 'user_id' not in submission:
+        return 'Request body must contain the key "user_id"'
+    if 'params' in submission and not isinstance(submission['params'], dict):
+        return 'The key "params" must hold an object of run parameters'
+    return None
+
+def submission_row(submission):
+    """Return the values inserted into `simulations` for a submission."""
+    params = None
+    if 'params' in submission:
+        params = json.dumps(submission['params'])
+    return (
+        submission['simulation'],
+        submission['user_id'],
+        submission.get('board_name'),
+        params)
+
+def store_submissions(submissions):
+    """Insert submitted simulations in a single transaction."""
+    conn = get_db()
+    with conn:
+        conn.executemany(
+            INSERT_SIMULATION,
+            [submission_row(submission) for submission in submissions])
 
 @app.route('/', methods=['POST'])
 def store_simulation():
     """Run a simulation and send the results back."""
-    conn = sqlite3.connect('simulations.db')
-    cursor = conn.cursor()
-
     print(request.url)
 
     # Test content-type
@@ -21,33 +76,59 @@ def store_simulation():
 
     # Test body content
     json_body = request.get_json()
-    if 'simulation' not in json_body:
-        return 'Request body must contain the key "simulation"', 400
-    if 'user_id' not in json_body:
-        return 'Request body must contain the key "user_id"', 400
-
-    if 'board_name' in json_body:
-        sql = """
-            INSERT INTO simulations(simulation, user_id, board_name)
-            VALUES (?, ?, ?)"""
-        cursor.execute(sql, (
-            json_body['simulation'],
-            json_body['user_id'],
-            json_body['board_name']))
-    else:
-        sql = '''
-            INSERT INTO simulations(simulation, user_id)
-            VALUES (?, ?)'''
-        cursor.execute(sql, (
-            json_body['simulation'],
-            json_body['user_id']))
-    conn.commit()
-    conn.close()
+    error_message = validate_submission(json_body)
+    if error_message is not None:
+        return error_message, 400
+
+    store_submissions([json_body])
 
     response_content = {
         'message': 'Simulation received'}
     return Response(json.dumps(response_content), mimetype='application/json')
 
+@app.route('/bulk', methods=['POST'])
+def store_simulations():
+    """Queue many simulations at once.
+
+    The body is a JSON array of objects, each with the same keys accepted by
+    `store_simulation`. Either every simulation is queued or, if any is
+    malformed, none are.
+    """
+    # Test content-type
+    if request.content_type != 'application/json':
+        return 'Request must have Content-Type of application/json', 400
+
+    # Test body content
+    json_body = request.get_json()
+    if not isinstance(json_body, list):
+        return 'Request body must be a JSON array of simulations', 400
+    for index, submission in enumerate(json_body):
+        error_message = validate_submission(submission)
+        if error_message is not None:
+            return 'Simulation %d: %s' % (index, error_message), 400
+
+    store_submissions(json_body)
+
+    response_content = {
+        'message': 'Simulations received',
+        'count': len(json_body)}
+    return Response(json.dumps(response_content), mimetype='application/json')
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    """Report hits, misses and the size of the simulation result cache."""
+    stats = ResultCache(get_db()).stats()
+    return Response(json.dumps(stats), mimetype='application/json')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Report the queue and the workers' throughput to Prometheus.
+
+    Every value comes from an indexed lookup or the `counters` table, so the
+    endpoint can be scraped every few seconds however long the queue is.
+    """
+    return Response(prometheus_metrics(get_db()),
+                    mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8443)
-
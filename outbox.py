@@ -0,0 +1,249 @@
+"""Durably store simulation results and deliver them to the callback url.
+
+Workers write each result into the `outbox` table in the same transaction
+which removes the finished simulation from the queue, so results survive an
+unreachable callback url or a crash. A dedicated sender (`run_sender`) then
+posts them over a pooled keep-alive session, retrying failures with
+exponential backoff.
+
+With `[Outbox] batch` enabled, results for the same url are coalesced and
+posted together as a JSON array (or NDJSON) once `batch_size` of them are
+due or the oldest has waited `batch_window` seconds. The response must be a
+JSON array holding a status for each result, in order. Each status is an HTTP
+status code or an object with a `status` key. Results are retried
+individually.
+"""
+
+import time
+import requests
+from job_metrics import record_delivery
+from requests.adapters import HTTPAdapter
+
+HEADERS = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+BATCH_HEADERS = {
+    'json': {'Content-type': 'application/json',
+             'Accept': 'application/json'},
+    'ndjson': {'Content-type': 'application/x-ndjson',
+               'Accept': 'application/json'},
+}
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 300.0
+DEFAULT_FETCH_LIMIT = 100
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_WINDOW = 0.5
+DEFAULT_BATCH_FORMAT = 'json'
+
+def enqueue_result(conn, url, payload, job_id=None):
+    """Store a JSON-encoded result for delivery to `url`. Given the `job_id`
+    of the simulation it came from, its delivery is recorded in
+    `job_metrics`.
+
+    Does not commit, so the caller can make it part of a larger transaction.
+    """
+    conn.execute('''
+                 INSERT INTO outbox(url, payload, next_attempt_at, job_id)
+                 VALUES (?, ?, ?, ?)''', (url, payload, time.time(), job_id))
+
+def create_session(pool_size=10):
+    """Create a session which keeps connections to the callback url alive."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HEADERS)
+    session.verify = False
+    return session
+
+def get_due_results(conn, limit):
+    """Return up to `limit` results ready to be sent, as tuples of
+    (id, url, payload, attempts, next_attempt_at, job_id)."""
+    return conn.execute('''
+                        SELECT id, url, payload, attempts, next_attempt_at,
+                               job_id
+                        FROM outbox
+                        WHERE status = 'pending' AND next_attempt_at <= ?
+                        ORDER BY next_attempt_at, id
+                        LIMIT ?''', (time.time(), limit)).fetchall()
+
+def backoff_delay(attempts, backoff, max_backoff):
+    """Seconds to wait before the next attempt after `attempts` failures."""
+    return min(max_backoff, backoff * 2 ** (attempts - 1))
+
+def mark_delivered(conn, result_id, job_id=None, seconds=None):
+    """Remove a result which has been delivered, recording the delivery of
+    the job `job_id`, if given, by a post taking `seconds`."""
+    conn.execute('DELETE FROM outbox WHERE id = ?', (result_id,))
+    if job_id is not None:
+        record_delivery(conn, job_id, seconds)
+
+def mark_failed(conn, result_id, attempts, error, settings):
+    """Schedule a retry of a failed delivery, or give up on it."""
+    if attempts >= settings['max_attempts']:
+        conn.execute('''
+                     UPDATE outbox
+                     SET status = 'failed', attempts = ?, last_error = ?
+                     WHERE id = ?''', (attempts, error, result_id))
+    else:
+        delay = backoff_delay(
+            attempts, settings['backoff'], settings['max_backoff'])
+        conn.execute('''
+                     UPDATE outbox
+                     SET attempts = ?, last_error = ?, next_attempt_at = ?
+                     WHERE id = ?''',
+                     (attempts, error, time.time() + delay, result_id))
+
+def post_result(session, url, payload, settings):
+    """Post one result, returning None on success or an error message."""
+    try:
+        response = session.post(
+            url,
+            data=payload,
+            timeout=(settings['connect_timeout'], settings['read_timeout']))
+    except requests.RequestException as error:
+        return str(error)
+
+    if not 200 <= response.status_code < 300:
+        return 'HTTP %d' % response.status_code
+    return None
+
+def deliver_due_results(conn, session, settings):
+    """Try to deliver every result which is due, returning how many were."""
+    delivered = 0
+    for result_id, url, payload, attempts, _, job_id in get_due_results(
+            conn, settings['fetch_limit']):
+        started = time.monotonic()
+        error = post_result(session, url, payload, settings)
+        if error is None:
+            mark_delivered(
+                conn, result_id, job_id, time.monotonic() - started)
+            delivered += 1
+        else:
+            print('failed to deliver result %d: %s' % (result_id, error))
+            mark_failed(conn, result_id, attempts + 1, error, settings)
+        conn.commit()
+    return delivered
+
+def parse_batch_response(response, count):
+    """Return an error message (or None) for each of `count` batched results."""
+    if not 200 <= response.status_code < 300:
+        return ['HTTP %d' % response.status_code] * count
+
+    try:
+        statuses = response.json()
+    except ValueError:
+        statuses = None
+    if not isinstance(statuses, list) or len(statuses) != count:
+        return ['Malformed batch response'] * count
+
+    errors = []
+    for status in statuses:
+        if isinstance(status, dict):
+            status = status.get('status')
+        if isinstance(status, int) and 200 <= status < 300:
+            errors.append(None)
+        else:
+            errors.append('Batch item status %s' % status)
+    return errors
+
+def post_batch(session, url, payloads, settings):
+    """Post several results in one request, returning an error message (or
+    None) for each of them."""
+    if settings['batch_format'] == 'ndjson':
+        data = '\n'.join(payloads) + '\n'
+    else:
+        # Payloads are already JSON, so the array is built without decoding them
+        data = '[' + ','.join(payloads) + ']'
+
+    try:
+        response = session.post(
+            url,
+            data=data,
+            headers=BATCH_HEADERS[settings['batch_format']],
+            timeout=(settings['connect_timeout'], settings['read_timeout']))
+    except requests.RequestException as error:
+        return [str(error)] * len(payloads)
+
+    return parse_batch_response(response, len(payloads))
+
+def deliver_due_batches(conn, session, settings):
+    """Deliver due results in batches per url, returning how many were.
+
+    A partial batch is held back until its oldest result has waited
+    `batch_window` seconds, giving other results a chance to join it.
+    """
+    batches = {}
+    for row in get_due_results(conn, settings['fetch_limit']):
+        batches.setdefault(row[1], []).append(row)
+
+    window_closes_before = time.time() - settings['batch_window']
+    delivered = 0
+    for url, rows in batches.items():
+        for start in range(0, len(rows), settings['batch_size']):
+            batch = rows[start:start + settings['batch_size']]
+            oldest = min(row[4] for row in batch)
+            if (len(batch) < settings['batch_size'] and
+                    oldest > window_closes_before):
+                continue
+
+            started = time.monotonic()
+            errors = post_batch(
+                session, url, [row[2] for row in batch], settings)
+            seconds = time.monotonic() - started
+            for row, error in zip(batch, errors):
+                if error is None:
+                    mark_delivered(conn, row[0], row[5], seconds)
+                    delivered += 1
+                else:
+                    print('failed to deliver result %d: %s' % (row[0], error))
+                    mark_failed(conn, row[0], row[3] + 1, error, settings)
+            conn.commit()
+    return delivered
+
+def load_settings(config):
+    """Read delivery settings from the `[Outbox]` section of the config."""
+    return {
+        'connect_timeout': config.getfloat(
+            'Outbox', 'connect_timeout', fallback=DEFAULT_CONNECT_TIMEOUT),
+        'read_timeout': config.getfloat(
+            'Outbox', 'read_timeout', fallback=DEFAULT_READ_TIMEOUT),
+        'max_attempts': config.getint(
+            'Outbox', 'max_attempts', fallback=DEFAULT_MAX_ATTEMPTS),
+        'backoff': config.getfloat(
+            'Outbox', 'backoff', fallback=DEFAULT_BACKOFF),
+        'max_backoff': config.getfloat(
+            'Outbox', 'max_backoff', fallback=DEFAULT_MAX_BACKOFF),
+        'fetch_limit': config.getint(
+            'Outbox', 'fetch_limit', fallback=DEFAULT_FETCH_LIMIT),
+        'poll_interval': config.getfloat(
+            'Outbox', 'poll_interval', fallback=DEFAULT_POLL_INTERVAL),
+        'batch': config.getboolean('Outbox', 'batch', fallback=False),
+        'batch_size': config.getint(
+            'Outbox', 'batch_size', fallback=DEFAULT_BATCH_SIZE),
+        'batch_window': config.getfloat(
+            'Outbox', 'batch_window', fallback=DEFAULT_BATCH_WINDOW),
+        'batch_format': config.get(
+            'Outbox', 'batch_format', fallback=DEFAULT_BATCH_FORMAT),
+    }
+
+def run_sender(conn, config, shutdown):
+    """Deliver results from the outbox until `shutdown` is requested."""
+    settings = load_settings(config)
+    session = create_session()
+
+    deliver = deliver_due_results
+    poll_interval = settings['poll_interval']
+    if settings['batch']:
+        deliver = deliver_due_batches
+        poll_interval = min(poll_interval, settings['batch_window'])
+
+    try:
+        while not shutdown.requested():
+            if not deliver(conn, session, settings):
+                shutdown.wait(poll_interval)
+    finally:
+        session.close()
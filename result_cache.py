@@ -0,0 +1,137 @@
+"""Cache simulation results so identical submissions skip the simulator.
+
+Results are keyed by a hash of the compiled simulation (its IR, see
+simulator.ir) together with the run parameters. Hashing the IR rather than
+the raw XML means resubmitting a board which was only moved around or
+reformatted still hits the cache.
+
+Entries older than `max_age` seconds are never served, and the least recently
+used entries are evicted once the cache holds more than `max_size` bytes.
+Hits and misses are counted in the `counters` table, along with the cache's
+total size, which is updated in the same transaction as the entries so it
+never has to be summed.
+"""
+
+import hashlib
+import json
+import time
+from counters import increment_counter, get_counters
+
+HITS = 'result_cache_hits'
+MISSES = 'result_cache_misses'
+SIZE = 'result_cache_size'
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+def cache_key(sim_ir, params):
+    """Return a stable hash of a compiled simulation and its run parameters."""
+    normalized = json.dumps(
+        [sim_ir.to_dict(), params],
+        sort_keys=True,
+        separators=(',', ':'))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class ResultCache(object):
+    """Cache of JSON-encoded simulation statistics stored in SQLite."""
+    def __init__(self, conn, max_size=DEFAULT_MAX_SIZE,
+                 max_age=DEFAULT_MAX_AGE):
+        self.conn = conn
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def get(self, key):
+        """Return the cached statistics for `key`, or None on a miss."""
+        now = time.time()
+        record = self.conn.execute('''
+                                   SELECT statistics FROM result_cache
+                                   WHERE key = ? AND created_at > ?''',
+                                   (key, now - self.max_age)).fetchone()
+
+        if record is None:
+            increment_counter(self.conn, MISSES)
+            return None
+
+        self.conn.execute(
+            'UPDATE result_cache SET last_used_at = ? WHERE key = ?',
+            (now, key))
+        increment_counter(self.conn, HITS)
+        return json.loads(record[0])
+
+    def put(self, key, statistics):
+        """Store statistics for `key`, evicting old entries as needed."""
+        encoded = json.dumps(statistics)
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            replaced = self.conn.execute(
+                'SELECT size FROM result_cache WHERE key = ?',
+                (key,)).fetchone()
+            self.conn.execute('''
+                              INSERT OR REPLACE INTO result_cache(
+                                  key, statistics, size, created_at,
+                                  last_used_at)
+                              VALUES (?, ?, ?, ?, ?)''',
+                              (key, encoded, len(encoded), now, now))
+            increment_counter(self.conn, SIZE, len(encoded) - (
+                replaced[0] if replaced is not None else 0))
+            self.evict(now)
+            self.conn.execute('COMMIT')
+        except:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def evict(self, now=None):
+        """Remove expired entries, then least recently used ones until the
+        cache fits in `max_size` bytes. Both are found through indexes.
+
+        Does not commit, so `put` can make it part of its transaction.
+        """
+        if now is None:
+            now = time.time()
+        expired = now - self.max_age
+        freed = self.conn.execute('''
+                                  SELECT COALESCE(SUM(size), 0)
+                                  FROM result_cache
+                                  WHERE created_at <= ?''',
+                                  (expired,)).fetchone()[0]
+        self.conn.execute('DELETE FROM result_cache WHERE created_at <= ?',
+                          (expired,))
+
+        size = get_counters(self.conn, [SIZE])[SIZE] - freed
+        evicted = []
+        if size > self.max_size:
+            for key, entry_size in self.conn.execute('''
+                    SELECT key, size FROM result_cache
+                    ORDER BY last_used_at, rowid'''):
+                if size <= self.max_size:
+                    break
+                evicted.append((key,))
+                size -= entry_size
+                freed += entry_size
+            self.conn.executemany(
+                'DELETE FROM result_cache WHERE key = ?', evicted)
+        if freed:
+            increment_counter(self.conn, SIZE, -freed)
+
+    def stats(self):
+        """Return hit and miss counts along with the cache's current size."""
+        counters = get_counters(self.conn, [HITS, MISSES, SIZE])
+        entries = self.conn.execute(
+            'SELECT COUNT(*) FROM result_cache').fetchone()[0]
+        return {
+            'hits': counters[HITS],
+            'misses': counters[MISSES],
+            'entries': entries,
+            'size': counters[SIZE],
+        }
+
+def load_cache(conn, config):
+    """Create the cache described by the `[Cache]` section of the config, or
+    return None if caching is disabled."""
+    if not config.getboolean('Cache', 'enabled', fallback=True):
+        return None
+    return ResultCache(
+        conn,
+        max_size=config.getint('Cache', 'max_size', fallback=DEFAULT_MAX_SIZE),
+        max_age=config.getfloat('Cache', 'max_age', fallback=DEFAULT_MAX_AGE))
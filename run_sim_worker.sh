@@ -1,7 +1,12 @@
 #!/bin/env bash
+# Keep a warm worker running. It drains the queue continuously and only polls
+# while the queue is empty. SIGTERM is forwarded so the worker can finish its
+# current simulation before exiting.
+trap 'kill -TERM "$worker" 2>/dev/null; wait "$worker"; exit 0' TERM INT
 while [ true ]; do
- # run every n second (unit: second)
+ python sim_worker.py --daemon &
+ worker=$!
+ wait "$worker"
+ # Restart after a short pause if the worker ever exits on its own
  sleep 5
- # echo "Invoking sim_worker"
- python sim_worker.py
-done
\ No newline at end of file
+done
@@ -2,22 +2,206 @@
 
 import sqlite3
 
-def init_db():
+DB_PATH = 'simulations.db'
+
+# Milliseconds a connection waits on a locked database before giving up.
+BUSY_TIMEOUT = 5000
+
+# Columns added to `simulations` after its first release. Databases created by
+# older versions are upgraded in place by `init_db`.
+SIMULATION_COLUMNS = [
+    ('status', "TEXT DEFAULT 'queued' NOT NULL"),
+    ('claimed_by', 'TEXT'),
+    ('lease_expires_at', 'REAL'),
+    ('params', 'TEXT'),
+]
+
+# Columns added to `outbox` after its first release
+OUTBOX_COLUMNS = [
+    ('job_id', 'INTEGER'),
+]
+
+def connect_db(path=DB_PATH, autocommit=False):
+    """Open a connection to the simulations database.
+
+    Connections wait up to BUSY_TIMEOUT milliseconds for a competing writer
+    instead of failing immediately. With `autocommit` set, transactions must be
+    opened explicitly with BEGIN.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT / 1000.0)
+    conn.execute('PRAGMA busy_timeout = %d' % BUSY_TIMEOUT)
+    if autocommit:
+        conn.isolation_level = None
+    return conn
+
+def init_db(path=DB_PATH):
     """Initialize the simulations database
 
     Fields:
         simulation TEXT
-        callback_url TEXT
+        user_id TEXT
+        board_name TEXT
+        status TEXT
+            'queued' until a worker claims it, then 'running'
+        claimed_by TEXT
+            Identifier of the worker currently running the simulation
+        lease_expires_at REAL
+            Unix time after which a 'running' simulation is considered
+            abandoned and goes back on the queue
+        params TEXT
+            JSON-encoded run parameters, e.g. the simulation's horizon
+
+    Outbox fields:
+        url TEXT
+            Where the result is to be posted
+        payload TEXT
+            JSON-encoded result of a finished simulation
+        status TEXT
+            'pending' until delivered, or 'failed' once retries are exhausted
+        attempts INTEGER
+            Number of failed delivery attempts so far
+        next_attempt_at REAL
+            Unix time before which the result won't be retried
+        last_error TEXT
+            Why the last delivery attempt failed
+        job_id INTEGER
+            Id of the simulation whose result this is, if its delivery is to
+            be recorded in `job_metrics`
+
+    Result cache fields:
+        key TEXT
+            Hash of a compiled simulation and its run parameters
+        statistics TEXT
+            JSON-encoded statistics from running that simulation
+        size INTEGER
+            Length of `statistics`
+        created_at REAL / last_used_at REAL
+            Unix times used to expire and evict entries
+
+    IR cache fields:
+        key TEXT
+            Hash of a simulation's XML
+        ir TEXT
+            JSON-encoded simulation compiled from that XML
+        last_used_at REAL
+            Unix time used to evict entries
+
+    Counters fields:
+        name TEXT
+        value REAL
+
+    Job metrics fields:
+        job_id INTEGER
+            Id the simulation had in `simulations`
+        user_id TEXT
+        status TEXT
+            'completed', or 'failed' if the simulation couldn't be run
+        finished_at REAL
+            Unix time the job finished
+        runtime REAL
+            Seconds from starting the job to storing its result
+        metrics TEXT
+            JSON-encoded seconds spent in each phase and counts of entities
+            and events (see simulator.metrics)
+        delivered_at REAL / delivery_seconds REAL
+            Unix time the result was posted, and how long the post took
+
+    The database uses write-ahead logging so the server can keep accepting
+    simulations while workers read and claim them. Simulations are dequeued
+    through an index on (status, created_at).
     """
-    conn = sqlite3.connect('simulations.db')
+    conn = connect_db(path)
     cursor = conn.cursor()
 
+    # WAL mode is persistent, so every later connection inherits it.
+    cursor.execute('PRAGMA journal_mode = WAL')
+
     cursor.execute('''CREATE TABLE IF NOT EXISTS simulations(
         id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
         simulation TEXT NOT NULL,
         user_id TEXT NOT NULL,
-        board_name TEXT)''')
+        board_name TEXT,
+        status TEXT DEFAULT 'queued' NOT NULL,
+        claimed_by TEXT,
+        lease_expires_at REAL,
+        params TEXT)''')
+
+    cursor.execute('PRAGMA table_info(simulations)')
+    existing_columns = [row[1] for row in cursor.fetchall()]
+    for column, definition in SIMULATION_COLUMNS:
+        if column not in existing_columns:
+            cursor.execute('ALTER TABLE simulations ADD COLUMN %s %s' % (
+                column, definition))
+
+    # Rows are ordered by (status, created_at, id) in this index, so claiming
+    # the oldest queued simulation is a single O(log n) search.
+    cursor.execute('''CREATE INDEX IF NOT EXISTS simulations_status_created_at
+        ON simulations(status, created_at)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS outbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        url TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT DEFAULT 'pending' NOT NULL,
+        attempts INTEGER DEFAULT 0 NOT NULL,
+        next_attempt_at REAL DEFAULT 0 NOT NULL,
+        last_error TEXT,
+        job_id INTEGER)''')
+
+    cursor.execute('PRAGMA table_info(outbox)')
+    existing_columns = [row[1] for row in cursor.fetchall()]
+    for column, definition in OUTBOX_COLUMNS:
+        if column not in existing_columns:
+            cursor.execute('ALTER TABLE outbox ADD COLUMN %s %s' % (
+                column, definition))
+
+    cursor.execute('''CREATE INDEX IF NOT EXISTS outbox_status_next_attempt_at
+        ON outbox(status, next_attempt_at)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS result_cache(
+        key TEXT PRIMARY KEY NOT NULL,
+        statistics TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL)''')
+
+    cursor.execute('''CREATE INDEX IF NOT EXISTS result_cache_created_at
+        ON result_cache(created_at)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS result_cache_last_used_at
+        ON result_cache(last_used_at)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS ir_cache(
+        key TEXT PRIMARY KEY NOT NULL,
+        ir TEXT NOT NULL,
+        last_used_at REAL NOT NULL)''')
+
+    cursor.execute('''CREATE INDEX IF NOT EXISTS ir_cache_last_used_at
+        ON ir_cache(last_used_at)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS counters(
+        name TEXT PRIMARY KEY NOT NULL,
+        value REAL NOT NULL)''')
+
+    # The result cache keeps a running total of its size, which databases
+    # created before it did start from.
+    cursor.execute('''INSERT OR IGNORE INTO counters(name, value)
+        SELECT 'result_cache_size', COALESCE(SUM(size), 0)
+        FROM result_cache''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS job_metrics(
+        job_id INTEGER PRIMARY KEY NOT NULL,
+        user_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        finished_at REAL NOT NULL,
+        runtime REAL NOT NULL,
+        metrics TEXT NOT NULL,
+        delivered_at REAL,
+        delivery_seconds REAL)''')
+
+    cursor.execute('''CREATE INDEX IF NOT EXISTS job_metrics_finished_at
+        ON job_metrics(finished_at)''')
 
     conn.commit()
 
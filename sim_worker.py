@@ -1,76 +1,441 @@
-"""Run the oldest simulation in the db and respond."""
+"""Run the oldest simulation in the db and respond.
+
+Run `python sim_worker.py` to process a single simulation, or
+`python sim_worker.py --daemon` to keep a pool of warm workers draining the
+queue. `--processes N` sets the size of the pool (default: `[Worker] processes`
+from config.ini, or the number of cores). The pool also runs a sender which
+delivers results from the outbox; `python sim_worker.py --sender` runs just
+the sender.
+"""
 
 import sqlite3
 import json
 import configparser
-import requests
-from simulator import Simulation
+import functools
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from simulator import Simulation, run_params
 from simulator.build_sim import build_sim
 from simulator.errors import SimBuildError
+from simulator.metrics import Metrics
+from setup_db import DB_PATH, connect_db
+from result_cache import cache_key, load_cache
+from ir_cache import load_ir_cache
+from job_metrics import record_job
+from outbox import (enqueue_result, run_sender, create_session,
+                    deliver_due_results, load_settings)
 
-def run_oldest_sim():
-    """Run the oldest simulation we have received and respond with the results."""
-    conn = sqlite3.connect('simulations.db')
-    cursor = conn.cursor()
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_LEASE_SECONDS = 60.0
 
+def load_config(path='config.ini'):
+    """Read the worker's configuration file."""
     config = configparser.ConfigParser()
-    config.read('config.ini')
-
-    cursor.execute('''
-                   SELECT id, simulation, user_id, board_name
-                   FROM simulations
-                   ORDER BY created_at DESC
-                   LIMIT 1''')
-
-    record = cursor.fetchone()
-    if record is not None:
-        sim_id = record[0]
-        simulation = record[1]
-        user_id = record[2]
-        board_name = record[3]
-
-        error_message = None
+    config.read(path)
+    return config
+
+def get_worker_id():
+    """Identify this worker process in the `claimed_by` column."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+def claim_next_sim(conn, worker_id, lease_seconds):
+    """Atomically claim the next queued simulation for `worker_id`.
+
+    Simulations are claimed first-in, first-out. The claim is made inside a
+    write transaction so no two workers can claim the same simulation.
+    Simulations whose lease has expired, because the worker running them died,
+    are put back on the queue first.
+
+    Returns (id, simulation, user_id, board_name, params) or None if the queue
+    is empty.
+    """
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('''
+                     UPDATE simulations
+                     SET status = 'queued', claimed_by = NULL,
+                         lease_expires_at = NULL
+                     WHERE status = 'running' AND lease_expires_at < ?''',
+                     (now,))
+        record = conn.execute('''
+                              SELECT id, simulation, user_id, board_name,
+                                     params
+                              FROM simulations
+                              WHERE status = 'queued'
+                              ORDER BY created_at, id
+                              LIMIT 1''').fetchone()
+        if record is not None:
+            conn.execute('''
+                         UPDATE simulations
+                         SET status = 'running', claimed_by = ?,
+                             lease_expires_at = ?
+                         WHERE id = ?''',
+                         (worker_id, now + lease_seconds, record[0]))
+        conn.execute('COMMIT')
+    except:
+        conn.execute('ROLLBACK')
+        raise
+
+    return record
+
+def renew_lease(conn, sim_id, worker_id, lease_seconds):
+    """Extend the lease on a simulation this worker still holds."""
+    conn.execute('''
+                 UPDATE simulations
+                 SET lease_expires_at = ?
+                 WHERE id = ? AND claimed_by = ?''',
+                 (time.time() + lease_seconds, sim_id, worker_id))
+
+def complete_sim(conn, sim_id, worker_id, url, payload, job=None):
+    """Swap a finished simulation for its result in the outbox.
+
+    Both happen in one transaction, so a result is never lost and never
+    stored twice. Nothing is stored if this worker no longer holds the
+    simulation, since whoever claimed it after us will store the result.
+
+    `job`, if given, holds the arguments of `record_job` after the id, which
+    store the job's metrics alongside its result.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.execute(
+            'DELETE FROM simulations WHERE id = ? AND claimed_by = ?',
+            (sim_id, worker_id))
+        if cursor.rowcount == 1:
+            enqueue_result(conn, url, payload, sim_id)
+            if job is not None:
+                record_job(conn, sim_id, *job)
+        conn.execute('COMMIT')
+    except:
+        conn.execute('ROLLBACK')
+        raise
+
+class LeaseKeeper(object):
+    """Renew a claimed simulation's lease in the background while it runs.
+
+    Leases can then be short, so a crashed worker's simulation is requeued
+    quickly, without long simulations being claimed a second time.
+    """
+    def __init__(self, db_path, sim_id, worker_id, lease_seconds):
+        self.db_path = db_path
+        self.sim_id = sim_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        """Renew the lease every third of its length until stopped."""
+        conn = connect_db(self.db_path, autocommit=True)
         try:
-            nodes, edges, resources = build_sim(simulation)
-        except SimBuildError as error:
-            error_message = error.message
-        except:
-            error_message = 'Something went wrong when building your Simulation'
-
-        url = config['Respond']['url']
-        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
-
-        if error_message is None:
-            sim = Simulation(nodes, edges, resources)
-            statistics = sim.run()
-
-            response_data = {
-                'data': {
-                    'statistics': statistics,
-                    'user_id': user_id
-                }}
-
-            if board_name is not None:
-                response_data['data']['board_name'] = board_name
-
-            requests.post(
-                url,
-                headers=headers,
-                data=json.dumps(response_data),
-                verify=False)
-            # print(response_data)
-            print('all okay')
+            while not self.stopped.wait(self.lease_seconds / 3):
+                try:
+                    renew_lease(
+                        conn, self.sim_id, self.worker_id, self.lease_seconds)
+                except sqlite3.Error as error:
+                    print('failed to renew lease: %s' % error)
+        finally:
+            conn.close()
+
+def run_sim(simulation, params=None, cache=None, ir_cache=None,
+            on_estimate=None, metrics=None, processes=None):
+    """Build and run a simulation, returning (statistics, error_message).
+
+    If a `cache` is given, results for an identical simulation and run
+    parameters are served from it without running the simulator. If an
+    `ir_cache` is given, a board which has been built before isn't compiled
+    again. If `on_estimate` is given, it is called with the simulation's
+    estimated statistics (see simulator.markov) before the simulation runs;
+    the estimate is only a preview, so if it can't be made or delivered the
+    simulation runs regardless. The time spent in each phase, and the counts
+    of the run, are added to `metrics` (see simulator.metrics), if given.
+    Replications are spread across `processes` processes (by default one per
+    core).
+    """
+    if metrics is None:
+        metrics = Metrics()
+    try:
+        if ir_cache is not None:
+            sim_ir = ir_cache.build(simulation, metrics)
         else:
-            requests.post(
-                url,
-                headers=headers,
-                data=json.dumps({'error': {'message': error_message}}),
-                verify=False)
-            print('error')
+            sim_ir = build_sim(simulation, metrics)
+        params = run_params(params)
+    except SimBuildError as error:
+        return None, error.message
+    except:
+        return None, 'Something went wrong when building your Simulation'
+
+    if cache is not None:
+        key = cache_key(sim_ir, params)
+        statistics = cache.get(key)
+        if statistics is not None:
+            return statistics, None
+
+    if on_estimate is not None and params['statistics'] != 'estimate':
+        # The preview isn't part of the job, so isn't timed with it
+        try:
+            on_estimate(Simulation(
+                sim_ir, dict(params, statistics='estimate')).run())
+        except SimBuildError:
+            # The full run reports what's wrong with the simulation
+            pass
+        except Exception as error:
+            print('failed to send estimate: %s' % error)
+
+    try:
+        sim = Simulation(sim_ir, params, processes, metrics=metrics)
+        statistics = sim.run()
+    except SimBuildError as error:
+        # Delays are compiled, and their arguments checked, as the nodes
+        # are built at the start of the run.
+        return None, error.message
+    except Exception:
+        # A warm worker must survive a bad simulation rather than exit and
+        # retry the same job forever.
+        return None, 'Something went wrong when running your Simulation'
+
+    if cache is not None:
+        cache.put(key, statistics)
+    return statistics, None
+
+def build_response(statistics, error_message, user_id, board_name,
+                   estimate=False, metrics=None):
+    """Encode the results of a simulation for the callback url. Estimated
+    statistics, sent ahead of the results, are marked as such, and the
+    job's `metrics`, if given, are sent alongside the statistics."""
+    if error_message is not None:
+        print('error')
+        return json.dumps({'error': {'message': error_message}})
+
+    response_data = {
+        'data': {
+            'statistics': statistics,
+            'user_id': user_id
+        }}
+
+    if board_name is not None:
+        response_data['data']['board_name'] = board_name
+    if estimate:
+        response_data['data']['estimate'] = True
+    if metrics is not None:
+        response_data['data']['metrics'] = metrics.to_dict()
+
+    print('all okay')
+    return json.dumps(response_data)
+
+def send_estimate(conn, url, user_id, board_name, estimate):
+    """Deliver a simulation's estimated statistics ahead of its results."""
+    enqueue_result(conn, url, build_response(
+        estimate, None, user_id, board_name, estimate=True))
+
+def run_oldest_sim(conn=None, config=None, worker_id=None, db_path=DB_PATH,
+                   processes=None):
+    """Run the oldest simulation we have received and store its results in
+    the outbox for delivery. Its replications are spread across `processes`
+    processes (by default one per core).
+
+    Returns True if a simulation was run, False if the queue was empty.
+    """
+    owns_conn = conn is None
+    if owns_conn:
+        conn = connect_db(db_path, autocommit=True)
+    if config is None:
+        config = load_config()
+    if worker_id is None:
+        worker_id = get_worker_id()
+
+    lease_seconds = config.getfloat(
+        'Worker', 'lease_seconds', fallback=DEFAULT_LEASE_SECONDS)
+    send_estimates = config.getboolean(
+        'Respond', 'send_estimates', fallback=False)
+
+    try:
+        record = claim_next_sim(conn, worker_id, lease_seconds)
+        if record is not None:
+            sim_id, simulation, user_id, board_name, params = record
+            if params is not None:
+                params = json.loads(params)
+
+            on_estimate = functools.partial(
+                send_estimate, conn, config['Respond']['url'], user_id,
+                board_name) if send_estimates else None
+
+            # Everything up to storing the result is timed, on a clock
+            # unaffected by changes to the system time
+            started = time.monotonic()
+            metrics = Metrics()
+            with LeaseKeeper(db_path, sim_id, worker_id, lease_seconds):
+                statistics, error_message = run_sim(
+                    simulation, params, load_cache(conn, config),
+                    load_ir_cache(conn, config), on_estimate, metrics,
+                    processes)
+            # The payload can't include the time taken to encode it, which
+            # is only stored
+            with metrics.phase('serialize'):
+                payload = build_response(
+                    statistics, error_message, user_id, board_name,
+                    metrics=metrics)
+            complete_sim(
+                conn, sim_id, worker_id, config['Respond']['url'], payload,
+                (user_id, error_message is None, time.monotonic() - started,
+                 metrics))
+    finally:
+        if owns_conn:
+            conn.close()
+
+    return record is not None
+
+class Shutdown(object):
+    """Record a request to stop so the current job can finish first."""
+    def __init__(self):
+        self.event = threading.Event()
+
+    def install(self):
+        """Handle SIGTERM and SIGINT by requesting a shutdown."""
+        signal.signal(signal.SIGTERM, self.request)
+        signal.signal(signal.SIGINT, self.request)
+
+    def request(self, signum=None, frame=None):
+        """Ask the worker to stop after its current job."""
+        self.event.set()
+
+    def requested(self):
+        """Has a shutdown been requested?"""
+        return self.event.is_set()
+
+    def wait(self, timeout):
+        """Sleep for up to `timeout` seconds, waking early on shutdown."""
+        return self.event.wait(timeout)
+
+def run_worker(config=None, shutdown=None, db_path=DB_PATH, processes=None):
+    """Drain the simulations table until asked to stop, spreading each job's
+    replications across `processes` processes (by default one per core).
+
+    Simulations are run back-to-back while the queue has work. The worker only
+    sleeps, for `[Worker] poll_interval` seconds, once the queue is empty. A
+    shutdown request is only honoured between jobs so an in-flight simulation
+    is always completed and removed from the queue.
+    """
+    if config is None:
+        config = load_config()
+    if shutdown is None:
+        shutdown = Shutdown()
+        shutdown.install()
+
+    poll_interval = config.getfloat(
+        'Worker', 'poll_interval', fallback=DEFAULT_POLL_INTERVAL)
+    worker_id = get_worker_id()
+
+    conn = connect_db(db_path, autocommit=True)
+    try:
+        while not shutdown.requested():
+            try:
+                ran_sim = run_oldest_sim(
+                    conn, config, worker_id, db_path, processes)
+            except sqlite3.Error as error:
+                print('database error: %s' % error)
+                ran_sim = False
+
+            if not ran_sim:
+                shutdown.wait(poll_interval)
+    finally:
+        conn.close()
+
+def run_result_sender(config=None, shutdown=None, db_path=DB_PATH):
+    """Deliver results from the outbox until asked to stop."""
+    if config is None:
+        config = load_config()
+    if shutdown is None:
+        shutdown = Shutdown()
+        shutdown.install()
+
+    conn = connect_db(db_path)
+    try:
+        run_sender(conn, config, shutdown)
+    finally:
+        conn.close()
+
+def deliver_outbox(config=None, db_path=DB_PATH):
+    """Make a single attempt at delivering every result which is due."""
+    if config is None:
+        config = load_config()
+
+    conn = connect_db(db_path)
+    session = create_session()
+    try:
+        deliver_due_results(conn, session, load_settings(config))
+    finally:
+        session.close()
+        conn.close()
+
+def run_pool(processes=None, config=None):
+    """Run `processes` workers and a result sender, restarting any which die.
+
+    Each worker claims simulations atomically, so they never run the same
+    simulation twice, and spreads each job's replications across its share
+    of the cores rather than starting a process per core of its own. SIGTERM
+    is forwarded to every child, and the pool exits once they have all
+    finished what they were doing.
+    """
+    if config is None:
+        config = load_config()
+    if processes is None:
+        processes = config.getint(
+            'Worker', 'processes', fallback=multiprocessing.cpu_count())
+
+    shutdown = Shutdown()
+    shutdown.install()
+
+    share = max(1, multiprocessing.cpu_count() // processes)
+    targets = [functools.partial(run_worker, processes=share)] * processes + \
+        [run_result_sender]
+
+    def start_child(target):
+        """Start a single child process."""
+        child = multiprocessing.Process(target=target, args=(config,))
+        child.start()
+        return child
+
+    children = [start_child(target) for target in targets]
+    while not shutdown.wait(1):
+        for index, child in enumerate(children):
+            if not child.is_alive():
+                print('process %d exited with %s, restarting' % (
+                    child.pid, child.exitcode))
+                children[index] = start_child(targets[index])
+
+    for child in children:
+        if child.is_alive():
+            os.kill(child.pid, signal.SIGTERM)
+    for child in children:
+        child.join()
 
-        cursor.execute('DELETE FROM simulations WHERE id = ?', (str(sim_id),))
-        conn.commit()
-    conn.close()
+def parse_processes(argv):
+    """Return the value of a `--processes N` argument, if one was given."""
+    if '--processes' in argv:
+        return int(argv[argv.index('--processes') + 1])
+    return None
 
 if __name__ == '__main__':
-    run_oldest_sim()
+    if '--daemon' in sys.argv[1:]:
+        run_pool(parse_processes(sys.argv[1:]))
+    elif '--sender' in sys.argv[1:]:
+        run_result_sender()
+    else:
+        run_oldest_sim()
+        deliver_outbox()
@@ -1,296 +1,517 @@
 """Create and run a new simulation"""
 
+import math
+import multiprocessing
+import os
 import simpy
 # import logging
 # import numpy as np
 from .nodes import Source, Process, Exit, Decision
-from .graph import add_node, add_edge
-
-class Basic(object):
-    """Simple class to pass through the simulation (as instance)."""
-    def __init__(self, entity_id):
-        self.statistics = {}
-        self.id = entity_id
-        self.resources = {}
-
-    def get_name(self):
-        """Return the instance's name."""
-        return self.name
-
-    def record_statistic(self, event, record):
-        """Record a stat."""
-        if event not in self.statistics:
-            self.statistics[event] = [record]
-        else:
-            self.statistics[event].append(record)
-
-    def get_statistics(self):
-        """Get all statistics for this node."""
-        return self.statistics
-
-    def hold_resource(self, resource, request):
-        self.resources[resource] = request
-
-    def release_resource(self, resource):
-        resource.release(self.resources[resource])
-        del self.resources[resource]
+from .graph import Graph
+from .errors import SimBuildError
+from .summary import summarize
+from .random_streams import RandomStreams
+from .accumulators import SummaryCollector
+from .entity import Entity, EntityPool
+from .trace import TraceWriter
+from .heap_engine import run_heap
+from .vector_engine import run_vector, is_vectorizable
+from .markov import estimate
+from .monitors import ResourceMonitor, resource_statistics
+from .metrics import Metrics, CountingEnvironment
+from .ir import SOURCE, EXIT, PROCESS, DECISION, SEIZE, DELAY, RELEASE
+
+# Run parameters a job may set, and their defaults.
+DEFAULT_PARAMS = {
+    # Length of the simulation in seconds (one 8 hour day)
+    'horizon': 60 * 60 * 8,
+    # Number of independent runs whose results are combined
+    'replications': 1,
+    # Seed from which every random number in the run is derived
+    'seed': 0,
+    # 'full' reports every lifespan and stay; 'summary' folds them into
+    # running summaries as entities leave, using constant memory; 'estimate'
+    # computes expected counts and means without running the simulation
+    'statistics': 'full',
+    # 'simpy' runs each node as simpy processes; 'heap' runs the same graph
+    # on a minimal event heap, faster and with the same results; 'vector'
+    # moves entities through boards without resources in NumPy arrays.
+    # 'auto' picks 'vector' where it can, and 'simpy' otherwise.
+    'engine': 'auto',
+}
+
+STATISTICS_MODES = ['full', 'summary', 'estimate']
+
+# Resource statistics which are compared across replications
+RESOURCE_STATISTICS = ['utilization', 'average_queue', 'max_queue',
+                       'mean_wait']
+
+ENGINES = ['auto', 'simpy', 'heap', 'vector']
+
+MAX_REPLICATIONS = 1000
+
+# Longest horizon a job may ask for, in seconds (one year)
+MAX_HORIZON = 60 * 60 * 24 * 365
+
+def run_params(params=None):
+    """Fill in defaults for a job's run parameters and check their values."""
+    if params is None:
+        params = {}
+    if not isinstance(params, dict):
+        raise SimBuildError('Run parameters must be an object.')
+
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise SimBuildError('Unknown run parameter(s): %s' % \
+                            ', '.join(sorted(unknown)))
+
+    resolved = dict(DEFAULT_PARAMS)
+    resolved.update(params)
+
+    try:
+        resolved['horizon'] = float(resolved['horizon'])
+    except (TypeError, ValueError) as error:
+        raise SimBuildError(
+            'Run parameter "horizon" must be a number.') from error
+    if not math.isfinite(resolved['horizon']) or resolved['horizon'] <= 0:
+        raise SimBuildError('Run parameter "horizon" must be positive.')
+    if resolved['horizon'] > MAX_HORIZON:
+        raise SimBuildError('Run parameter "horizon" must be at most %d.' % \
+                            MAX_HORIZON)
+
+    replications = resolved['replications']
+    if (not isinstance(replications, int) or isinstance(replications, bool) or
+            not 1 <= replications <= MAX_REPLICATIONS):
+        raise SimBuildError('Run parameter "replications" must be an integer '
+                            'from 1 to %d.' % MAX_REPLICATIONS)
+
+    seed = resolved['seed']
+    if not isinstance(seed, int) or isinstance(seed, bool) or seed < 0:
+        raise SimBuildError('Run parameter "seed" must be a non-negative '
+                            'integer.')
+
+    if resolved['statistics'] not in STATISTICS_MODES:
+        raise SimBuildError('Run parameter "statistics" must be one of: %s.' % \
+                            ', '.join(STATISTICS_MODES))
+
+    if resolved['engine'] not in ENGINES:
+        raise SimBuildError('Run parameter "engine" must be one of: %s.' % \
+                            ', '.join(ENGINES))
+
+    return resolved
+
+def check_runnable(sim_ir):
+    """Raise SimBuildError for the first node whose configuration is too
+    incomplete to run."""
+    for number, node_id in enumerate(sim_ir.ids):
+        node_type = sim_ir.types[number]
+        if node_type != EXIT and not sim_ir.successors[number]:
+            raise SimBuildError(
+                'Node %s has no node to send entities to.' % node_id,
+                node_id=node_id)
+
+        if node_type == DECISION and sim_ir.probabilities[number] is None:
+            raise SimBuildError(
+                'Decision %s has no probability.' % node_id,
+                node_type='decision', node_id=node_id)
+
+        if (node_type == PROCESS and sim_ir.actions[number] & (SEIZE | RELEASE)
+                and sim_ir.resources[number] is None):
+            raise SimBuildError(
+                'Process %s uses a resource which doesn\'t exist.' % node_id,
+                node_type='process', node_id=node_id)
+
+def run_replication(args):
+    """Run one replication of a simulation in a pool process and summarize it.
+
+    Returns the summary and the replication's Metrics.
+    """
+    sim, index = args
+    metrics = Metrics()
+    statistics = sim.run_replication(index, metrics)
+    with metrics.phase('analyze'):
+        summary = sim.summarize_replication(statistics)
+    return summary, metrics
 
 class Simulation(object):
-    """Representation of a runnable simulation."""
-    def __init__(self, nodes, edges, resources):
-        self.graph = {
-            'nodes': nodes,
-            'edges': edges,
-            'resources': resources,
-        }
-        self.nodes = []
+    """Representation of a runnable simulation.
+
+    With more than one replication, replications are spread across
+    `processes` processes (by default one per core) and their results are
+    combined by `analyze_replications`.
+
+    Every random number is drawn from streams derived from the `seed` run
+    parameter: one family per replication and one stream per node within it.
+    Results are therefore reproducible, and independent of where or
+    alongside what each replication runs.
+
+    The simulation is given as the SimulationIR returned by `build_sim`.
+
+    Given a `trace` directory, every event of replication N is also written
+    to a columnar trace in `<trace>/replication-N` (see simulator.trace).
+
+    The `engine` run parameter picks how each replication is executed: with
+    simpy (`run_simpy`), on the event heap of simulator.heap_engine, or, for
+    boards without resources, with the arrays of simulator.vector_engine.
+
+    The time spent in each phase of the run, and the number of entities
+    created and events processed, are added to `metrics` (see
+    simulator.metrics).
+    """
+    def __init__(self, sim_ir, params=None, processes=None, trace=None,
+                 metrics=None):
+        self.sim_ir = sim_ir
+        self.params = run_params(params)
+        self.streams = RandomStreams(self.params['seed'])
+        self.processes = processes
+        self.trace = trace
+        self.metrics = metrics if metrics is not None else Metrics()
 
     def run(self):
         """Run the simulation and respond with statistics about the run."""
-        for node_id in self.graph['nodes']:
-            print(node_id, self.graph['nodes'][node_id])
-        for _ in range(1):
-            self.nodes = []
-            env = simpy.Environment()
-            basic_args = {'name': 'Basic'}
-
-            # Build array of simpy Resource objects for use later
-            resources = {}
-            for resource_id in self.graph['resources']:
-                resource_name = self.graph['resources'][resource_id]['name']
-                resource_count = 1
-                try:
-                    resource_count = int(self.graph['resources'][resource_id]['count'])
-                except ValueError:
-                    # Use default value of 1
-                    pass
-
-                resources[resource_name] = simpy.Resource(env, capacity=resource_count)
-
-            sources = []
-            exits = []
-
-            for node_id in self.graph['nodes']:
-                node = None
-                node_type = self.graph['nodes'][node_id]['type']
-                # TODO: generalize the way configuration is passed into the node
-                # constructors. Use kwargs and a config (dict) parameter?.
-                if node_type == 'source':
-                    node = Source(
-                        env,
-                        node_id,
-                        Basic,
-                        basic_args,
-                        self.graph['nodes'][node_id]['outbound_edges'][0],
-                        self.graph['nodes'][node_id]['metadata']['delay'])
-                    sources.append(node)
-                elif node_type == 'exit':
-                    node = Exit(
-                        env,
-                        node_id)
-                    exits.append(node)
-                elif node_type == 'decision':
-                    # get branches for this current decision
-                    branches = {}
-                    edges = []
-                    for edge_id in self.graph['edges']:
-                        branch = self.graph['edges'][edge_id]
-                        branch_id = branch['source']
-                        if branch_id == node_id:
-                            edges.append(edge_id)
-
-                    if len(edges) == 2:
-                        branches['up'] = edges[0]
-                        branches['down'] = edges[1]
-
-                    # Get the metadata to grab the probability value
-                    metadata = self.graph['nodes'][node_id]['metadata']
-                    # probability value is float type
-                    probability = float(metadata['args']['probability'])
-                    node = Decision(env, node_id, branches, probability)
-                elif node_type == 'process':
-                    process_type = self.graph['nodes'][node_id] \
-                        ['metadata']['processType']
-                    delay = self.graph['nodes'][node_id]['metadata']['delay']
-
-                    # Set defaults
-                    will_delay = False
-                    will_seize = False
-                    will_release = False
-                    to_be_seized = None
-                    to_be_released = None
-
-                    # Override defaults
-                    if process_type == 'delay':
-                        will_delay = True
-                    elif process_type == 'sieze':
-                        will_seize = True
-                    elif process_type == 'release':
-                        will_release = True
-                    elif process_type == 'siezeDelay':
-                        will_seize = True
-                        will_delay = True
-                    elif process_type == 'siezeDelayRelease':
-                        will_delay = True
-                        will_release = True
-                        will_seize = True
-
-                    # If we're seizing or releasing we need to know about the
-                    # resource specified for this process.
-                    if will_seize or will_release:
-                        process_resource_name = delay['args']['resource']
-                        if will_seize:
-                            to_be_seized = resources[process_resource_name]
-                        if will_release:
-                            to_be_released = resources[process_resource_name]
-
-                    node = Process(
-                        env,
-                        node_id,
-                        self.graph['nodes'][node_id]['outbound_edges'][0],
-                        will_seize=will_seize,
-                        will_delay=will_delay,
-                        will_release=will_release,
-                        delay=delay,
-                        to_be_seized=to_be_seized,
-                        to_be_released=to_be_released)
-
-                add_node(node_id, node)
-                self.nodes.append(node)
-
-            for edge_id in self.graph['edges']:
-                add_edge(edge_id, self.graph['edges'][edge_id])
-
+        nodes = self.sim_ir.describe()
+        for node_id in nodes:
+            print(node_id, nodes[node_id])
+
+        if self.params['statistics'] == 'estimate':
+            check_runnable(self.sim_ir)
+            with self.metrics.phase('estimate'):
+                return estimate(self.sim_ir, self.params['horizon'])
+
+        replications = self.params['replications']
+        if replications == 1:
+            return self.run_replication()
+
+        processes = self.processes or multiprocessing.cpu_count()
+        processes = min(processes, replications)
+        args = [(self, index) for index in range(replications)]
+        if processes == 1:
+            results = [run_replication(arg) for arg in args]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(run_replication, args)
+            finally:
+                pool.close()
+                pool.join()
+
+        summaries = []
+        for summary, metrics in results:
+            summaries.append(summary)
+            self.metrics.merge(metrics)
+        with self.metrics.phase('analyze'):
+            return self.analyze_replications(summaries, nodes)
+
+    def run_replication(self, index=0, metrics=None):
+        """Run the simulation once and return statistics about the run,
+        adding to `metrics` (by default the simulation's)."""
+        if metrics is None:
+            metrics = self.metrics
+        sim_ir = self.sim_ir
+        check_runnable(sim_ir)
+        streams = self.streams.spawn('replication', index)
+        horizon = self.params['horizon']
+        monitors = [ResourceMonitor(capacity) for capacity in sim_ir.capacities]
+
+        engine = self.params['engine']
+        if engine == 'auto':
+            engine = 'simpy'
+            if is_vectorizable(sim_ir) and self.trace is None:
+                engine = 'vector'
+
+        if engine == 'vector':
+            if not is_vectorizable(sim_ir):
+                raise SimBuildError('The vector engine can\'t run boards '
+                                    'which seize or release resources.')
+            if self.trace is not None:
+                raise SimBuildError('The vector engine can\'t trace runs.')
+            statistics = run_vector(sim_ir, streams, horizon,
+                                    self.params['statistics'], metrics)
+            statistics['resources'] = resource_statistics(
+                sim_ir, monitors, horizon)
+            return statistics
+
+        # Entities are only needed until their statistics are collected, so
+        # in summary mode they are recycled as they leave
+        collector = None
+        new_entity = Entity
+        if self.params['statistics'] == 'summary':
+            new_entity = EntityPool()
+            collector = SummaryCollector(
+                sim_ir.describe(), sim_ir.ids, new_entity)
+        collect = collector.add if collector is not None else None
+
+        trace = None
+        if self.trace is not None:
+            trace = TraceWriter(
+                os.path.join(self.trace, 'replication-%d' % index), sim_ir.ids)
+
+        if engine == 'heap':
+            run = run_heap
+        else:
+            run = self.run_simpy
+
+        try:
+            departed_entities = run(
+                sim_ir, streams, horizon, new_entity, collect,
+                trace.record if trace is not None else None, monitors,
+                metrics)
+        finally:
+            if trace is not None:
+                trace.close()
+
+        with metrics.phase('analyze'):
+            if collector is not None:
+                statistics = collector.statistics()
+            else:
+                statistics = self.analyze_simulation(
+                    departed_entities, sim_ir.describe())
+            statistics['resources'] = resource_statistics(
+                sim_ir, monitors, horizon)
+        return statistics
+
+    def run_simpy(self, sim_ir, streams, horizon, new_entity, collect=None,
+                  trace=None, monitors=None, metrics=None):
+        """Run one replication with each node as simpy processes, taking the
+        same arguments as `heap_engine.run_heap`, and return the entities
+        which departed."""
+        if metrics is None:
+            metrics = Metrics()
+        with metrics.phase('build'):
+            env, sources, exits = self.build_simpy(
+                sim_ir, streams, new_entity, collect, trace, monitors)
             for source in sources:
                 env.process(source.run())
 
-            days_to_run = 1
-            hours_in_a_day = 8
-            seconds_in_a_day = 60 * 60 * hours_in_a_day
-            simulation_duration = days_to_run * seconds_in_a_day
-            env.run(until=simulation_duration)
-
-            # for node in self.nodes:
-                # if node.get_node_id() not in self.node_statistics:
-                    # self.node_statistics[node.get_node_id()] = {
-                        # 'node_type': node.get_node_type(),
-                        # 'statistics': [node.get_statistics()]}
-                # else:
-                    # self.node_statistics[node.get_node_id()]['statistics'].append(
-                            # node.get_statistics())
-
-            departed_entities = []
-            for exit in exits:
-                departed_entities.extend(exit.get_departed_entities())
-
-        # TODO: Generate actual statistics
-        # TODO: The return value of this method should be those newly
-        # generated statistics
-        return self.analyze_simulation(departed_entities, self.graph['nodes'])
+        with metrics.phase('run'):
+            env.run(until=horizon)
+        # Each Source counts the entities it created before the last
+        metrics.count('entities',
+                      sum(source.created_count + 1 for source in sources))
+        metrics.count('events', env.processed_events())
+        metrics.count('processes', env.processes)
+
+        departed_entities = []
+        for exit in exits:
+            departed_entities.extend(exit.get_departed_entities())
+        return departed_entities
+
+    def build_simpy(self, sim_ir, streams, new_entity, collect=None, trace=None,
+                    monitors=None):
+        """Build the simpy nodes of one replication, returning the
+        environment they run in, the Sources and the Exits."""
+        graph = Graph()
+        env = CountingEnvironment()
+        entity_args = {}
+
+        # Build array of simpy Resource objects for use later
+        resources = [simpy.Resource(env, capacity=capacity)
+                     for capacity in sim_ir.capacities]
+
+        sources = []
+        exits = []
+
+        for number, node_id in enumerate(sim_ir.ids):
+            node_type = sim_ir.types[number]
+            successors = [sim_ir.ids[successor]
+                          for successor in sim_ir.successors[number]]
+
+            if node_type == SOURCE:
+                node = Source(
+                    env,
+                    graph,
+                    node_id,
+                    new_entity,
+                    entity_args,
+                    successors[0],
+                    sim_ir.delays[number],
+                    streams.stream(node_id))
+                sources.append(node)
+            elif node_type == EXIT:
+                node = Exit(env, node_id, collect)
+                exits.append(node)
+            elif node_type == DECISION:
+                branches = {'up': successors[0], 'down': successors[1]}
+                node = Decision(env, graph, node_id, branches,
+                                sim_ir.probabilities[number],
+                                streams.stream(node_id))
+            elif node_type == PROCESS:
+                actions = sim_ir.actions[number]
+                resource = None
+                monitor = None
+                if actions & (SEIZE | RELEASE):
+                    resource = resources[sim_ir.resources[number]]
+                    if monitors is not None:
+                        monitor = monitors[sim_ir.resources[number]]
+
+                node = Process(
+                    env,
+                    graph,
+                    node_id,
+                    successors[0],
+                    will_seize=bool(actions & SEIZE),
+                    will_delay=bool(actions & DELAY),
+                    will_release=bool(actions & RELEASE),
+                    delay=sim_ir.delays[number],
+                    to_be_seized=resource if actions & SEIZE else None,
+                    to_be_released=resource if actions & RELEASE else None,
+                    monitor=monitor,
+                    rng=streams.stream(node_id))
+
+            node.number = number
+            node.trace = trace
+            graph.add_node(node_id, node)
+
+        # Resolve routing up front so moving an entity is a single call
+        for node in graph.get_nodes().values():
+            node.link()
+
+        return env, sources, exits
+
+    def summarize_replication(self, statistics):
+        """Reduce the statistics of one replication to the per-node and
+        per-entity values which are compared across replications.
+
+        Accepts the statistics of either statistics mode.
+        """
+        nodes = {}
+        for node_id, node_stats in statistics['nodes'].items():
+            summary = {'visited_count': node_stats.get('visited_count', 0)}
+            if 'stay_durations' in node_stats:
+                lengths = [stay['length']
+                           for stay in node_stats['stay_durations']]
+                summary['stay_length'] = sum(lengths) / float(len(lengths))
+            elif 'stay_length' in node_stats:
+                summary['stay_length'] = node_stats['stay_length']['mean']
+            nodes[node_id] = summary
+
+        resources = {}
+        for name, resource_stats in statistics.get('resources', {}).items():
+            resources[name] = dict(
+                (key, resource_stats[key]) for key in RESOURCE_STATISTICS)
+
+        if 'count' in statistics['entities']:
+            entities = {'count': statistics['entities']['count']}
+            if 'lifespan' in statistics['entities']:
+                entities['lifespan'] = \
+                    statistics['entities']['lifespan']['mean']
+            return {'nodes': nodes, 'entities': entities,
+                    'resources': resources}
+
+        lifespans = [lifespan['length'] for lifespan
+                     in statistics['entities'].get('lifespans', [])]
+        entities = {'count': len(lifespans)}
+        if lifespans:
+            entities['lifespan'] = sum(lifespans) / float(len(lifespans))
+
+        return {'nodes': nodes, 'entities': entities, 'resources': resources}
+
+    def analyze_replications(self, summaries, raw_nodes):
+        """Combine replications into the mean, standard deviation and 95%
+        confidence interval of each statistic.
+
+        Visit counts are averaged over every replication, counting nodes an
+        entity never reached as 0. Stay lengths and lifespans are the mean
+        for each replication, averaged over the replications where they were
+        observed, and likewise each resource's statistics.
+        """
+        node_ids = set()
+        for summary in summaries:
+            node_ids.update(summary['nodes'])
+
+        node_stats = {}
+        for node_id in node_ids:
+            visits = [summary['nodes'].get(node_id, {})
+                      for summary in summaries]
+            node_stats[node_id] = {
+                'label': raw_nodes[node_id]['label'],
+                'type': raw_nodes[node_id]['type'],
+                'visited_count': summarize(
+                    [visit.get('visited_count', 0) for visit in visits]),
+            }
+            stay_lengths = [visit['stay_length'] for visit in visits
+                            if 'stay_length' in visit]
+            if stay_lengths:
+                node_stats[node_id]['stay_length'] = summarize(stay_lengths)
+
+        entity_stats = {
+            'count': summarize(
+                [summary['entities']['count'] for summary in summaries]),
+        }
+        lifespans = [summary['entities']['lifespan'] for summary in summaries
+                     if 'lifespan' in summary['entities']]
+        if lifespans:
+            entity_stats['lifespan'] = summarize(lifespans)
+
+        resource_stats = {}
+        for name in summaries[0]['resources']:
+            resource_stats[name] = {}
+            for key in RESOURCE_STATISTICS:
+                values = [summary['resources'][name][key]
+                          for summary in summaries]
+                resource_stats[name][key] = summarize(
+                    [value for value in values if value is not None])
+
+        return {
+            'replications': len(summaries),
+            'nodes': node_stats,
+            'entities': entity_stats,
+            'resources': resource_stats,
+        }
 
     def analyze_simulation(self, entities, raw_nodes):
         node_stats = {}
         entity_stats = {}
+        ids = self.sim_ir.ids
 
         print(raw_nodes)
 
-        for entity in entities:
-            stats = entity.get_statistics()
-
-            # ===
-            # Keep a record of how many times each node has been visited
-            # Source nodes
-            if stats['created_by'][0] not in node_stats:
-                node_id = stats['created_by'][0]
+        def count_visit(node_id):
+            """Keep a record of how many times each node has been visited"""
+            if node_id not in node_stats:
                 node_stats[node_id] = {
                     'label': raw_nodes[node_id]['label'],
-                    'type': raw_nodes[node_id]['type']}
-
-            if 'visited_count' not in node_stats[stats['created_by'][0]]:
-                node_id = stats['created_by'][0]
-                node_stats[node_id]['visited_count'] = 1
+                    'type': raw_nodes[node_id]['type'],
+                    'visited_count': 1}
             else:
-                node_id = stats['created_by'][0]
                 node_stats[node_id]['visited_count'] += 1
 
-            # Exit nodes
-            if stats['departed_through'][0] not in node_stats:
-                node_id = stats['departed_through'][0]
-                node_stats[node_id] = {
-                    'label': raw_nodes[node_id]['label'],
-                    'type': raw_nodes[node_id]['type']}
-
-            if 'visited_count' not in node_stats[stats['departed_through'][0]]:
-                node_id = stats['departed_through'][0]
-                node_stats[node_id]['visited_count'] = 1
-            else:
-                node_id = stats['departed_through'][0]
-                node_stats[node_id]['visited_count'] += 1
-
-            # All other nodes
-            for visited_node_id in stats['visited']:
-                if visited_node_id not in node_stats:
-                    node_stats[visited_node_id] = {
-                        'label': raw_nodes[visited_node_id]['label'],
-                        'type': raw_nodes[visited_node_id]['type']}
-
-                if 'visited_count' not in node_stats[visited_node_id]:
-                    node_stats[visited_node_id]['visited_count'] = 1
-                else:
-                    node_stats[visited_node_id]['visited_count'] += 1
+        lifespans = []
+        for entity in entities:
+            # ===
+            # Source nodes, Exit nodes, then all other nodes
+            count_visit(entity.created_by)
+            count_visit(entity.departed_through)
+            for number in entity.visited:
+                count_visit(ids[number])
 
             # ===
             # Determine how long this entity has been alive
-            if 'lifespans' not in entity_stats:
-                entity_stats['lifespans'] = [{
-                    'created_at': stats['created_at'][0],
-                    'departed_at': stats['departed_at'][0],
-                    'length': stats['departed_at'][0] - stats['created_at'][0]
-                }]
-            else:
-                entity_stats['lifespans'].append({
-                    'created_at': stats['created_at'][0],
-                    'departed_at': stats['departed_at'][0],
-                    'length': stats['departed_at'][0] - stats['created_at'][0]
-                })
+            lifespans.append({
+                'created_at': entity.created_at,
+                'departed_at': entity.departed_at,
+                'length': entity.departed_at - entity.created_at
+            })
 
             # ===
             # Determine how long this entity stayed at each process
-            if 'process_visits' in stats:
-                for process_visit in stats['process_visits']:
-                    visited_id = process_visit['node_id']
-                    if visited_id not in node_stats:
-                        node_stats[visited_id] = {
-                            'label': raw_nodes[visited_id]['label']
-                        }
-
-                    if 'stay_durations' not in node_stats[visited_id]:
-                        node_stats[visited_id]['stay_durations'] = [{
-                            'from': process_visit['arrived_at'],
-                            'to': process_visit['departed_at'],
-                            'length': process_visit['departed_at'] - \
-                                process_visit['arrived_at']
-                        }]
-                    else:
-                        node_stats[visited_id]['stay_durations'].append({
-                            'from': process_visit['arrived_at'],
-                            'to': process_visit['departed_at'],
-                            'length': process_visit['departed_at'] - \
-                                process_visit['arrived_at']
-                        })
-
-        # print('')
-        # print('==============================')
-
-        # print('')
-        # print('nodes')
-        # for node_stat_id in node_stats:
-            # print(node_stat_id, [node_stats[node_stat_id]])
-
-        # print('')
-        # print('entities')
-        # for entity_stat_id in entity_stats:
-            # print(entity_stat_id, [entity_stats[entity_stat_id]])
+            for number, arrived_at, departed_at in entity.iter_stays():
+                visited_id = ids[number]
+                if visited_id not in node_stats:
+                    node_stats[visited_id] = {
+                        'label': raw_nodes[visited_id]['label']
+                    }
+
+                if 'stay_durations' not in node_stats[visited_id]:
+                    node_stats[visited_id]['stay_durations'] = []
+                node_stats[visited_id]['stay_durations'].append({
+                    'from': arrived_at,
+                    'to': departed_at,
+                    'length': departed_at - arrived_at
+                })
+
+        if lifespans:
+            entity_stats['lifespans'] = lifespans
 
         return {
             'nodes': node_stats,
@@ -0,0 +1,237 @@
+"""Summarize statistics in constant memory as a simulation runs
+
+In the 'summary' statistics mode each entity is folded into these
+accumulators as it departs and then discarded. A run's memory is then bounded
+by the size of the board rather than by how many entities pass through it.
+"""
+
+import math
+import numpy as np
+
+class P2Quantile(object):
+    """Estimate a quantile of a stream of values without storing them.
+
+    Uses the P-squared algorithm of Jain and Chlamtac (1985), which tracks
+    five markers whose heights approximate the minimum, the q/2, q and
+    (1 + q)/2 quantiles, where q is `fraction`, and the maximum. Until a
+    sixth value arrives the quantile is computed exactly.
+    """
+    def __init__(self, fraction):
+        self.fraction = fraction
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        # Desired positions of the middle markers after the first five
+        # values, and how far they move with each value after that
+        self.initial = [0, 2 * fraction, 4 * fraction, 2 + 2 * fraction, 4]
+        self.increments = [0, fraction / 2.0, fraction, (1 + fraction) / 2.0,
+                           1]
+        self.count = 0
+
+    def add(self, value):
+        """Fold a value into the estimate."""
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # Find the cell the value falls in, stretching the extremes if needed
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        elif value < heights[1]:
+            cell = 0
+        elif value < heights[2]:
+            cell = 1
+        elif value < heights[3]:
+            cell = 2
+        else:
+            cell = 3
+
+        positions = self.positions
+        for marker in range(cell + 1, 5):
+            positions[marker] += 1
+        self.count += 1
+
+        # Move the middle markers towards their desired positions
+        for marker in (1, 2, 3):
+            offset = (self.initial[marker] +
+                      self.count * self.increments[marker] - positions[marker])
+            if ((offset >= 1 and positions[marker + 1] - positions[marker] > 1)
+                    or (offset <= -1 and
+                        positions[marker - 1] - positions[marker] < -1)):
+                step = 1 if offset > 0 else -1
+                height = self.parabolic(marker, step)
+                if not heights[marker - 1] < height < heights[marker + 1]:
+                    height = self.linear(marker, step)
+                heights[marker] = height
+                positions[marker] += step
+
+    def parabolic(self, marker, step):
+        """Piecewise-parabolic prediction of a marker's new height."""
+        heights = self.heights
+        positions = self.positions
+        return heights[marker] + step / float(
+            positions[marker + 1] - positions[marker - 1]) * (
+                (positions[marker] - positions[marker - 1] + step) *
+                (heights[marker + 1] - heights[marker]) /
+                float(positions[marker + 1] - positions[marker]) +
+                (positions[marker + 1] - positions[marker] - step) *
+                (heights[marker] - heights[marker - 1]) /
+                float(positions[marker] - positions[marker - 1]))
+
+    def linear(self, marker, step):
+        """Linear prediction of a marker's new height."""
+        heights = self.heights
+        positions = self.positions
+        return heights[marker] + step * (
+            heights[marker + step] - heights[marker]) / float(
+                positions[marker + step] - positions[marker])
+
+    def value(self):
+        """Return the estimated quantile, or None if no values were seen."""
+        heights = self.heights
+        if not heights:
+            return None
+        if self.count:
+            return heights[2]
+
+        # Five values or fewer: interpolate between the sorted values
+        rank = self.fraction * (len(heights) - 1)
+        below = int(math.floor(rank))
+        above = min(below + 1, len(heights) - 1)
+        return heights[below] + (heights[above] - heights[below]) * (
+            rank - below)
+
+class Summary(object):
+    """Running count, mean, standard deviation, extremes and quantiles of a
+    stream of values.
+
+    The mean and variance are updated with Welford's algorithm, which stays
+    accurate over long streams.
+    """
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, quantiles=QUANTILES):
+        self.count = 0
+        self.mean = 0.0
+        self.sum_of_squares = 0.0
+        self.min = None
+        self.max = None
+        self.quantiles = [P2Quantile(fraction) for fraction in quantiles]
+
+    def add(self, value):
+        """Fold a value into the summary."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.sum_of_squares += delta * (value - self.mean)
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        for quantile in self.quantiles:
+            quantile.add(value)
+
+    def std(self):
+        """Return the sample standard deviation."""
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.sum_of_squares / (self.count - 1))
+
+    def to_dict(self):
+        """Return the summary, with quantiles keyed like 'p50', or None if no
+        values were seen."""
+        if self.count == 0:
+            return None
+
+        summary = {
+            'count': self.count,
+            'mean': self.mean,
+            'std': self.std(),
+            'min': self.min,
+            'max': self.max,
+        }
+        for quantile in self.quantiles:
+            summary['p%g' % (quantile.fraction * 100)] = quantile.value()
+        return summary
+
+def summarize_array(values, quantiles=Summary.QUANTILES):
+    """Return what `Summary.to_dict` would for a NumPy array of values, with
+    exact quantiles, or None if the array is empty."""
+    if not len(values):
+        return None
+
+    summary = {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'std': float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+        'min': values.min().item(),
+        'max': values.max().item(),
+    }
+    for quantile in quantiles:
+        summary['p%g' % (quantile * 100)] = float(
+            np.percentile(values, quantile * 100))
+    return summary
+
+class SummaryCollector(object):
+    """Fold departing entities into per-node and per-entity summaries.
+
+    Counts visits exactly as `Simulation.analyze_simulation` does, but keeps
+    a Summary of stay lengths and lifespans instead of every visit.
+    """
+    def __init__(self, raw_nodes, ids, pool=None):
+        self.raw_nodes = raw_nodes
+        self.ids = ids
+        self.pool = pool
+        self.visited_counts = {}
+        self.stay_lengths = {}
+        self.lifespans = Summary()
+
+    def add(self, entity):
+        """Fold a departed entity's statistics in, then hand the entity back
+        to the pool it came from, if any."""
+        visited_counts = self.visited_counts
+        for node_id in (entity.created_by, entity.departed_through):
+            visited_counts[node_id] = visited_counts.get(node_id, 0) + 1
+        ids = self.ids
+        for number in entity.visited:
+            node_id = ids[number]
+            visited_counts[node_id] = visited_counts.get(node_id, 0) + 1
+
+        self.lifespans.add(entity.departed_at - entity.created_at)
+
+        stay_lengths = self.stay_lengths
+        for number, arrived_at, departed_at in entity.iter_stays():
+            if number not in stay_lengths:
+                stay_lengths[number] = Summary()
+            stay_lengths[number].add(departed_at - arrived_at)
+
+        if self.pool is not None:
+            self.pool.release(entity)
+
+    def statistics(self):
+        """Return the summarized statistics of the run."""
+        node_stats = {}
+        for node_id, count in self.visited_counts.items():
+            node_stats[node_id] = {
+                'label': self.raw_nodes[node_id]['label'],
+                'type': self.raw_nodes[node_id]['type'],
+                'visited_count': count,
+            }
+        for number, stay_lengths in self.stay_lengths.items():
+            node_stats[self.ids[number]]['stay_length'] = stay_lengths.to_dict()
+
+        entity_stats = {'count': self.lifespans.count}
+        if self.lifespans.count:
+            entity_stats['lifespan'] = self.lifespans.to_dict()
+
+        return {
+            'nodes': node_stats,
+            'entities': entity_stats,
+        }
@@ -7,17 +7,40 @@ raises appropriate exceptions if the XML is not a valid simulation.
 
 import xml.etree.ElementTree as ET
 import re
+from collections import deque
 from simulator.errors import SimBuildError
+from simulator.ir import compile_ir
+from simulator.metrics import Metrics
 
-def parse_xml(xml_string):
-    """Attempt to parse the given XML."""
-    root = None
-    try:
-        root = ET.fromstring(xml_string)
-    except:
-        raise SimBuildError('Failed to parse XML into simulation.')
+# Arguments of the distributions added alongside min/mid/max/val. See
+# simulator.samplers for which distribution takes which.
+DISTRIBUTION_ARGS = ['mean', 'std', 'shape', 'scale', 'k', 'values', 'weights']
+
+# mxGraph styles are lists of "key=value;" entries, e.g.
+# "shape=process;whiteSpace=wrap;html=1;"
+STYLE_SHAPE = re.compile(r'shape=([^;]+);')
+STYLE_EXITS = re.compile(r'(exitX|exitY)=([^;]+);')
+
+# Number of characters of XML handed to the parser at a time
+CHUNK_SIZE = 64 * 1024
+
+def parse_style(style):
+    """Parse the entries of a cell's style which the simulation uses.
 
-    return root
+    Nodes have a 'shape', which is all we need from them; styles can be long
+    and the search stops as soon as it is found. Otherwise the cell is an edge,
+    and its style is scanned once for 'exitX' and 'exitY'. The first value of
+    a repeated key is kept.
+    """
+    match = STYLE_SHAPE.search(style)
+    if match:
+        return {'shape': match.group(1)}
+
+    entries = {}
+    for key, value in STYLE_EXITS.findall(style):
+        if key not in entries:
+            entries[key] = value
+    return entries
 
 def test_xml(root):
     """Perform basic tests on the parsed XML to ensure it adheres to expected
@@ -25,6 +48,56 @@ def test_xml(root):
     if root.tag != 'mxGraphModel':
         raise SimBuildError('Root must be <mxGraphModel>')
 
+def read_events(parser, chunk):
+    """Feed a chunk of XML to the parser, or close it if `chunk` is None, and
+    return the events which are ready."""
+    try:
+        if chunk is None:
+            parser.close()
+        else:
+            parser.feed(chunk)
+        return list(parser.read_events())
+    except ET.ParseError as error:
+        raise SimBuildError('Failed to parse XML into simulation.') from error
+
+def iter_chunks(xml_string):
+    """Yield the given XML in slices of CHUNK_SIZE, then None once it has
+    all been yielded, slicing each only when it's needed."""
+    for offset in range(0, len(xml_string), CHUNK_SIZE):
+        yield xml_string[offset:offset + CHUNK_SIZE]
+    yield None
+
+def iter_cells(xml_string):
+    """Parse the given XML incrementally, yielding each element directly
+    inside <mxGraphModel><root> as soon as it has been read in full.
+
+    Elements are freed once the caller resumes, so the whole document is
+    never held in memory.
+    """
+    if not isinstance(xml_string, (str, bytes)):
+        raise SimBuildError('Failed to parse XML into simulation.')
+
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    depth = 0
+    container = None
+    for chunk in iter_chunks(xml_string):
+        for event, element in read_events(parser, chunk):
+            if event == 'start':
+                if depth == 0:
+                    test_xml(element)
+                elif depth == 1 and element.tag == 'root':
+                    container = element
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth == 2 and container is not None:
+                yield element
+                container.remove(element)
+            elif depth == 1:
+                element.clear()
+                container = None
+
 def parse_metadata(metadata_object):
     """Parse metadata information from the wrapper object"""
     metadata = None
@@ -39,6 +112,10 @@ def parse_metadata(metadata_object):
         decision_value = metadata_object.get('decision')
         node_type = metadata_object.get('nodeType')
         resource_type = metadata_object.get('resource')
+        distribution_args = {}
+        for arg in DISTRIBUTION_ARGS:
+            if metadata_object.get(arg) is not None:
+                distribution_args[arg] = metadata_object.get(arg)
         delay_key = 'delay'
 
         if metadata_type is not None:
@@ -64,7 +141,8 @@ def parse_metadata(metadata_object):
                 mid_value is not None or
                 max_value is not None or
                 val_value is not None or
-                resource_type is not None):
+                resource_type is not None or
+                distribution_args):
             metadata[delay_key]['args'] = {}
 
         if min_value is not None:
@@ -82,6 +160,9 @@ def parse_metadata(metadata_object):
         if resource_type is not None:
             metadata[delay_key]['args']['resource'] = resource_type
 
+        if distribution_args:
+            metadata[delay_key]['args'].update(distribution_args)
+
     return metadata
 
 def parse_sim(xml_string):
@@ -293,9 +374,6 @@ def parse_sim(xml_string):
 
     """
 
-    root = parse_xml(xml_string)
-    test_xml(root)
-
     # Nodes and Edges are represented as <mxCell> tags and may be wrapped in
     # <object> tags which, for nodes, will contain important configuration
     # information.
@@ -307,9 +385,7 @@ def parse_sim(xml_string):
     #   <object>
     #       <mxCell></mxCell>
     #   </object>
-    bare_cells = root.findall('./root/mxCell')
-    wrapper_objects = root.findall('./root/object')
-
+    #
     # Nodes will have a style attribute in their <mxCell> tag which contains a
     # key-value pair of 'shape=?'. That shape is our indicator for which type of
     # node the <mxCell> represents.
@@ -323,74 +399,70 @@ def parse_sim(xml_string):
     #
     # Resources dictionary contains a collection of resources
     #
+    # Cells are handled as they are parsed. Wrapped nodes are only added once
+    # every bare cell has been, keeping the order in which nodes are listed
+    # independent of the order of the document.
     edges = {}
     nodes = {}
     node_ids = {}
     resources = {}
+    wrapped = []
+
+    for element in iter_cells(xml_string):
+        if element.tag == 'mxCell':
+            # Ensure this cell is a edge/node
+            if element.get('style') is None:
+                continue
 
-    for cell in bare_cells:
-        # Ensure this cell is a edge/node
-        if cell.get('style') is not None:
-            matches = re.search('shape=([^;]+);', cell.get('style'))
-            if matches:
+            style = parse_style(element.get('style'))
+            if 'shape' in style:
                 # This cell is a node
-                shape = matches.group(1)
-                nodes[cell.get('id')] = {
-                    'label': cell.get('value'),
+                shape = style['shape']
+                nodes[element.get('id')] = {
+                    'label': element.get('value'),
                     'type': shape}
 
                 if shape not in node_ids:
                     node_ids[shape] = []
-                node_ids[shape].append(cell.get('id'))
+                node_ids[shape].append(element.get('id'))
             else:
                 # This cell is an edge
-                exit_x = None
-                exit_y = None
-                exit_x_matches = re.search('exitX=([^;]+);', cell.get('style'))
-                exit_y_matches = re.search('exitY=([^;]+);', cell.get('style'))
-                if exit_x_matches:
-                    exit_x = exit_x_matches.group(1)
-                if exit_y_matches:
-                    exit_y = exit_y_matches.group(1)
-                edges[cell.get('id')] = {
-                    'target': cell.get('target'),
-                    'source': cell.get('source'),
-                    'exit_x': exit_x,
-                    'exit_y': exit_y}
-
-    for wrapper_object in wrapper_objects:
-        cell = wrapper_object.find('mxCell')
-        metadata = parse_metadata(wrapper_object)
-        wrapper_object_id = wrapper_object.get('id')
-        matches = re.search('shape=([^;]+);', cell.get('style'))
-        if matches:
-            shape = matches.group(1)
-            node_type = wrapper_object.get('nodeType')
-            # Get resource object
-            if node_type == 'resource':
-                resources[wrapper_object_id] = {'type': node_type}
-                if metadata is not None:
-                    resources[wrapper_object_id].update(metadata)
-            else: # just other shape object
-                nodes[wrapper_object_id] = {
-                    'type': shape,
-                    'label': wrapper_object.get('label')}
-                if metadata is not None:
-                    nodes[wrapper_object_id]['metadata'] = metadata
-
-                if shape not in node_ids:
-                    node_ids[shape] = []
-                node_ids[shape].append(wrapper_object_id)
-
-            # if nodes:
-            #     object_id = wrapper_object_id
-            #     if object_id in nodes:
-            #         print(nodes[wrapper_object_id])
-
-            # if resources:
-            #     resource_id = wrapper_object_id
-            #     if resource_id in resources:
-            #         print(resources[resource_id])
+                edges[element.get('id')] = {
+                    'target': element.get('target'),
+                    'source': element.get('source'),
+                    'exit_x': style.get('exitX'),
+                    'exit_y': style.get('exitY')}
+
+        elif element.tag == 'object':
+            cell = element.find('mxCell')
+            if cell is None or cell.get('style') is None:
+                continue
+
+            style = parse_style(cell.get('style'))
+            if 'shape' in style:
+                wrapped.append((
+                    element.get('id'),
+                    style['shape'],
+                    element.get('nodeType'),
+                    element.get('label'),
+                    parse_metadata(element)))
+
+    for wrapper_object_id, shape, node_type, label, metadata in wrapped:
+        # Get resource object
+        if node_type == 'resource':
+            resources[wrapper_object_id] = {'type': node_type}
+            if metadata is not None:
+                resources[wrapper_object_id].update(metadata)
+        else: # just other shape object
+            nodes[wrapper_object_id] = {
+                'type': shape,
+                'label': label}
+            if metadata is not None:
+                nodes[wrapper_object_id]['metadata'] = metadata
+
+            if shape not in node_ids:
+                node_ids[shape] = []
+            node_ids[shape].append(wrapper_object_id)
 
     decisions = {}
     for edge_id in edges:
@@ -426,73 +498,90 @@ def parse_sim(xml_string):
 
     return [nodes, node_ids, edges, resources]
 
-def test_sim_sources(nodes, edges, source_node_ids):
+def test_sim_sources(outbound, reaches_exit, source_node_ids):
     """Test all Sources in the simulation
 
     Tests:
         - Sources must have exactly one outbound edge.
         - Paths leading out from a Source must end at an Exit.
     """
+    errors = []
     for source_id in source_node_ids:
         # Sources in the simulation must not have more than one outbound edge
-        if len(get_outbound_edge_ids(source_id, edges)) > 1:
-            raise SimBuildError('Source %s has more than one \
-                            outbound edge.' % source_id)
+        if len(outbound[source_id]) > 1:
+            errors.append(SimBuildError(
+                'Source %s has more than one outbound edge.' % source_id,
+                'source', source_id))
 
         # Sources in the simulation must have at least one outbound edge
-        elif len(get_outbound_edge_ids(source_id, edges)) == 0:
-            raise SimBuildError('Source %s has no outbound \
-                            edge.' % source_id)
+        elif len(outbound[source_id]) == 0:
+            errors.append(SimBuildError(
+                'Source %s has no outbound edge.' % source_id,
+                'source', source_id))
 
         # Paths leading away from a Source must all end at an Exit
-        elif not paths_all_lead_to_an_exit(source_id, edges, nodes):
-            raise SimBuildError('Source %s has an outbound edge\
-                            which doesn\'t lead to an Exit.' % source_id)
+        elif source_id not in reaches_exit:
+            errors.append(SimBuildError(
+                'Source %s has an outbound edge which doesn\'t lead to an '
+                'Exit.' % source_id, 'source', source_id))
+    return errors
 
-def test_sim_exits(nodes, edges, exit_node_ids):
+def test_sim_exits(outbound, exit_node_ids):
     """Test all Exits in the simulation
 
     Tests:
         - Exits cannot have any outbound edges.
     """
+    errors = []
     for exit_id in exit_node_ids:
-        # Sources in the simulation must not have any outbound edges
-        if len(get_outbound_edge_ids(exit_id, edges)) > 0:
-            raise SimBuildError('Exit %s has outbound edge(s)'\
-                            % exit_id)
+        # Exits in the simulation must not have any outbound edges
+        if len(outbound[exit_id]) > 0:
+            errors.append(SimBuildError(
+                'Exit %s has outbound edge(s).' % exit_id, 'exit', exit_id))
+    return errors
 
-def test_sim_processes(nodes, edges, process_node_ids):
+def test_sim_processes(outbound, process_node_ids):
     """Test all Processes in the simulation
 
     Tests:
         - Processes must have exactly one outbound edge
     """
+    errors = []
     for process_id in process_node_ids:
         # Processes in the simulation must have one outbound edge
-        if len(get_outbound_edge_ids(process_id, edges)) > 1:
-            raise SimBuildError('Process %s has outbound \
-                            edge(s)' % process_id)
+        if len(outbound[process_id]) > 1:
+            errors.append(SimBuildError(
+                'Process %s has more than one outbound edge.' % process_id,
+                'process', process_id))
 
         # Processes in the simulation must have one outbound edge
-        if len(get_outbound_edge_ids(process_id, edges)) == 0:
-            raise SimBuildError('Process %s has no outbound \
-                            edge(s)' % process_id)
+        elif len(outbound[process_id]) == 0:
+            errors.append(SimBuildError(
+                'Process %s has no outbound edge.' % process_id,
+                'process', process_id))
+    return errors
 
-
-def test_sim_decisions(nodes, edges, decision_node_ids):
+def test_sim_decisions(outbound, decision_node_ids):
     """Test all Decisions in the simulation
 
     Tests:
         - Decisions must have at least one outbound edge.
     """
+    errors = []
     for decision_id in decision_node_ids:
-        # Processes in the simulation must have at least one outbound edge
-        if len(get_outbound_edge_ids(decision_id, edges)) == 0:
-            raise SimBuildError('Decision %s has no outbound \
-                            edges' % decision_id)
+        # Decisions in the simulation must have at least one outbound edge
+        if len(outbound[decision_id]) == 0:
+            errors.append(SimBuildError(
+                'Decision %s has no outbound edges.' % decision_id,
+                'decision', decision_id))
+    return errors
 
 def test_sim(nodes, node_ids, edges):
-    """Assert that the parsed simulation is valid."""
+    """Assert that the parsed simulation is valid.
+
+    Every invalid node is reported at once: the SimBuildError raised lists
+    one error per problem in its `errors`.
+    """
 
     # A simulation must have edges and nodes
     if not edges:
@@ -501,82 +590,77 @@ def test_sim(nodes, node_ids, edges):
         raise SimBuildError('There are no nodes.')
 
     # A simulation must have at least one exit
-    if len(node_ids['exit']) < 1:
+    if len(node_ids.get('exit', [])) < 1:
         raise SimBuildError('No Exit.')
 
     # A simulation must have at least one source
-    if len(node_ids['source']) < 1:
+    if len(node_ids.get('source', [])) < 1:
         raise SimBuildError('No Source.')
 
+    outbound = index_outbound_edges(nodes, edges)
+    reaches_exit = find_nodes_leading_to_an_exit(
+        nodes, edges, outbound, node_ids['exit'])
+
     # Required nodes
-    test_sim_sources(nodes, edges, node_ids['source'])
-    test_sim_exits(nodes, edges, node_ids['exit'])
+    errors = test_sim_sources(outbound, reaches_exit, node_ids['source'])
+    errors.extend(test_sim_exits(outbound, node_ids['exit']))
 
     # Optional nodes
     if 'process' in node_ids:
-        test_sim_processes(nodes, edges, node_ids['process'])
+        errors.extend(test_sim_processes(outbound, node_ids['process']))
     if 'decision' in node_ids:
-        test_sim_decisions(nodes, edges, node_ids['decision'])
-
-def get_outbound_edge_ids(node_id, edges):
-    """Return list of edge ids of outbound edges for a given node_id"""
-    outbound_edge_ids = []
-
-    for key in edges:
-        if edges[key]['source'] == node_id:
-            outbound_edge_ids.append(key)
-
-    return outbound_edge_ids
-
-def get_outbound_edge_target_ids(node_id, edges):
-    """Return list of target ids of outbound edges for a given node_id"""
-    outbound_edge_target_ids = []
-
-    for key in edges:
-        if edges[key]['source'] == node_id:
-            outbound_edge_target_ids.append(edges[key]['target'])
-
-    return outbound_edge_target_ids
-
-def search_for_exit(cur_id, nodes_seen, edges, nodes):
-    """Recursively traverse the simulation to find an Exit node"""
-    if nodes[cur_id]['type'] == 'exit':
-        return True
-
-    if cur_id in nodes_seen:
-        # Cycle detected
-        return False
-    else:
-        nodes_seen.append(cur_id)
-
+        errors.extend(test_sim_decisions(outbound, node_ids['decision']))
+
+    if errors:
+        raise SimBuildError(
+            ' '.join(error.message for error in errors), errors=errors)
+
+def index_outbound_edges(nodes, edges):
+    """Return the ids of each node's outbound edges, in document order."""
+    outbound = dict((node_id, []) for node_id in nodes)
+    for edge_id, edge in edges.items():
+        outbound.setdefault(edge['source'], []).append(edge_id)
+    return outbound
+
+def find_nodes_leading_to_an_exit(nodes, edges, outbound, exit_node_ids):
+    """Return the set of ids of nodes from which an entity reaches an Exit.
+
+    Searches backwards from the Exits, so each edge is followed at most once.
+    A branching node leads to an Exit if any of its branches does. Any other
+    node only leads to an Exit through its first outbound edge, the one
+    entities take.
+    """
     # TODO: Are there more node types that have multiple outbound edges?
     node_types_that_branch = ['decision', 'spread']
-    if nodes[cur_id]['type'] in node_types_that_branch:
-        outbound_edge_target_ids = get_outbound_edge_target_ids(cur_id, edges)
-        valid_path_found = False
-        index = 0
-        while index < len(outbound_edge_target_ids) and not valid_path_found:
-            target_id = outbound_edge_target_ids[index]
-            # Recurse with a cloned copy of nodes_seen so recursive calls don't
-            # interfere with each other.
-            valid_path_found = search_for_exit(
-                target_id, list(nodes_seen), edges, nodes)
-            index += 1
-        return valid_path_found
-    else:
-        outbound_edge_target_id = get_outbound_edge_target_ids(
-            cur_id, edges)[0]
-        return search_for_exit(
-            outbound_edge_target_id, nodes_seen, edges, nodes)
-
-def paths_all_lead_to_an_exit(source_id, edges, nodes):
-    """Test if all edges branching out from a given source node eventually end
-    at an Exit node"""
-    return search_for_exit(source_id, [], edges, nodes)
-
-def build_sim(xml_string):
-    """Build a representation of a given simulation which can be run in
-    SimPy."""
-    nodes, node_ids, edges, resources = parse_sim(xml_string)
-    test_sim(nodes, node_ids, edges)
-    return [nodes, edges, resources]
+
+    inbound = {}
+    for node_id, edge_ids in outbound.items():
+        if nodes[node_id]['type'] not in node_types_that_branch:
+            edge_ids = edge_ids[:1]
+        for edge_id in edge_ids:
+            inbound.setdefault(edges[edge_id]['target'], []).append(node_id)
+
+    reaches_exit = set(exit_node_ids)
+    queue = deque(exit_node_ids)
+    while queue:
+        for source_id in inbound.get(queue.popleft(), []):
+            if source_id not in reaches_exit:
+                reaches_exit.add(source_id)
+                queue.append(source_id)
+    return reaches_exit
+
+def build_sim(xml_string, metrics=None):
+    """Build a representation of a given simulation which can be run, as a
+    SimulationIR (see simulator.ir).
+
+    Given `metrics` (see simulator.metrics), the time spent parsing,
+    validating and compiling the simulation is added to them.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.phase('parse'):
+        nodes, node_ids, edges, resources = parse_sim(xml_string)
+    with metrics.phase('validate'):
+        test_sim(nodes, node_ids, edges)
+    with metrics.phase('compile'):
+        return compile_ir(nodes, edges, resources)
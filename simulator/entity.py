@@ -0,0 +1,87 @@
+"""The entities which move through a simulation"""
+
+from array import array
+
+class Entity(object):
+    """An actor moving through the simulation, with a record of its path.
+
+    Entities are created in large numbers, so each is kept small: its fields
+    are slots, and its visits are stored in typed arrays rather than as
+    lists of dicts.
+
+    Fields:
+        id: Number of the entity among those created by its Source
+        created_at / created_by: When and by which node it was created
+        departed_at / departed_through: When and through which Exit it left
+        visited: Numbers (see simulator.ir) of the Processes and Decisions it
+            visited, in order
+        stays: (node number, arrived at, departed at) for each visit to a
+            Process, flattened into a single array
+        resources: The requests for resources it holds, keyed by resource,
+            or None if it holds none
+        trace_id: Number of the entity in the run's trace, if it is traced
+    """
+    __slots__ = ('id', 'created_at', 'created_by', 'departed_at',
+                 'departed_through', 'visited', 'stays', 'resources',
+                 'trace_id')
+
+    def __init__(self, entity_id):
+        self.visited = array('l')
+        self.stays = array('d')
+        self.reset(entity_id)
+
+    def reset(self, entity_id):
+        """Clear the entity so it can be reused as a new one."""
+        self.id = entity_id
+        self.created_at = None
+        self.created_by = None
+        self.departed_at = None
+        self.departed_through = None
+        del self.visited[:]
+        del self.stays[:]
+        self.resources = None
+        self.trace_id = None
+
+    def record_stay(self, node, arrived_at, departed_at):
+        """Record a visit to the Process numbered `node`."""
+        self.stays.extend((node, arrived_at, departed_at))
+
+    def iter_stays(self):
+        """Yield (node number, arrived at, departed at) for each stay."""
+        stays = self.stays
+        for index in range(0, len(stays), 3):
+            yield int(stays[index]), stays[index + 1], stays[index + 2]
+
+    def hold_resource(self, resource, request):
+        """Remember the request through which a resource was seized."""
+        if self.resources is None:
+            self.resources = {}
+        self.resources[resource] = request
+
+    def release_resource(self, resource):
+        """Release a resource this entity holds."""
+        resource.release(self.resources[resource])
+        del self.resources[resource]
+        if not self.resources:
+            self.resources = None
+
+class EntityPool(object):
+    """A free list of entities to recycle once their statistics have been
+    collected, so long runs don't allocate a new entity for every arrival.
+
+    Calling the pool returns an entity, like calling `Entity`.
+    """
+    def __init__(self):
+        self.free = []
+
+    def __call__(self, entity_id):
+        """Return a fresh entity, reusing a released one if possible."""
+        if self.free:
+            entity = self.free.pop()
+            entity.reset(entity_id)
+            return entity
+        return Entity(entity_id)
+
+    def release(self, entity):
+        """Return an entity which is no longer referenced to the pool."""
+        self.free.append(entity)
@@ -1,9 +1,14 @@
 """Custom errors related to simulations"""
 
 class SimBuildError(Exception):
-    """Exception indicating the simulation couldn't be parsed."""
-    def __init__(self, message, node_type=None, node_id=None):
+    """Exception indicating the simulation couldn't be parsed.
+
+    When several problems are found at once, `errors` holds a SimBuildError
+    for each of them.
+    """
+    def __init__(self, message, node_type=None, node_id=None, errors=None):
         super(SimBuildError, self).__init__(message)
         self.message = message
         self.node_type = node_type
         self.node_id = node_id
+        self.errors = errors if errors is not None else []
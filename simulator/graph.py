@@ -1,28 +1,23 @@
-"""Store a globally accessible record of nodes and edges"""
+"""Store a record of the nodes of a running simulation"""
 
-EDGES = {}
-NODES = {}
+class Graph(object):
+    """The nodes of a single simulation run.
 
-def add_node(key, value):
-    """Add a single key-value pair to NODES."""
-    NODES[key] = value
+    Each run builds its own Graph and hands it to the nodes which need to
+    find their neighbours, so simulations running side by side in one process
+    never see each other's nodes, and nothing outlives the run.
+    """
+    def __init__(self):
+        self.nodes = {}
 
-def add_edge(key, value):
-    """Add a single key-value pair to EDGES."""
-    EDGES[key] = value
+    def add_node(self, key, value):
+        """Add a single key-value pair to the nodes."""
+        self.nodes[key] = value
 
-def get_node(key):
-    """Retrieve a single node."""
-    return NODES[key]
+    def get_node(self, key):
+        """Retrieve a single node."""
+        return self.nodes[key]
 
-def get_edge(key):
-    """Retrieve a single edge."""
-    return EDGES[key]
-
-def get_nodes():
-    """Retrieve all nodes."""
-    return NODES
-
-def get_edges():
-    """Retrieve all edges."""
-    return EDGES
+    def get_nodes(self):
+        """Retrieve all nodes."""
+        return self.nodes
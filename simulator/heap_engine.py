@@ -0,0 +1,341 @@
+"""Run a compiled simulation on a minimal event heap
+
+The 'heap' engine runs the same SimulationIR as the simpy engine without
+simpy's processes or events. Each event is a callback and its argument, kept
+in time order by `EventHeap`, every node is a handful of callbacks, and each
+resource is a count of its users and a FIFO queue of waiting requests.
+
+Events are ordered exactly as simpy orders them: an entity arriving at a
+Process is handled urgently, like the start of a simpy process, and
+everything else at normal priority, with ties broken by the order events were
+scheduled. Each node draws from the same random stream as in the simpy engine,
+in the same order, so both engines produce the same statistics for the same
+seed.
+"""
+
+import itertools
+from collections import deque
+from heapq import heappush, heappop
+from simulator.metrics import Metrics
+from simulator.ir import SOURCE, EXIT, PROCESS, DECISION, SEIZE, DELAY, RELEASE
+from simulator.samplers import build_sampler, ProbabilitySampler
+from simulator.trace import CREATED, ARRIVED, SEIZED, DEPARTED, VISITED, EXITED
+
+class EventHeap(object):
+    """The clock and the pending events of a run.
+
+    simpy orders events by time, then priority (urgent before normal), then
+    the order they were scheduled. Urgent events are only ever scheduled for
+    now, and so are normal events without a delay, so neither needs sorting:
+    each waits in a FIFO lane and only delayed events go on the heap. Events
+    on the heap which are due now were scheduled earlier than anything in
+    the lanes, so events due now are processed urgent lane first, then heap,
+    then the lane of normal events, exactly as simpy would.
+
+    `urgent` and `immediate` are the lanes, holding (callback, argument)
+    pairs, which nodes may append to directly. `processed` counts the events
+    processed so far.
+    """
+    def __init__(self):
+        self.now = 0
+        self.processed = 0
+        self.queue = []
+        self.sequence = itertools.count()
+        self.urgent = deque()
+        self.immediate = deque()
+
+    def schedule(self, delay, callback, arg):
+        """Call `callback(arg)` once `delay` has passed."""
+        if delay < 0:
+            raise ValueError('Negative delay %s' % delay)
+        time = self.now + delay
+        if time == self.now:
+            self.immediate.append((callback, arg))
+        else:
+            heappush(self.queue, (time, next(self.sequence), callback, arg))
+
+    def run(self, until):
+        """Process events until the clock reaches `until`. Like simpy, events
+        due at `until` itself are left unprocessed."""
+        queue = self.queue
+        urgent = self.urgent
+        immediate = self.immediate
+        next_urgent = urgent.popleft
+        next_immediate = immediate.popleft
+        processed = 0
+        while True:
+            if urgent:
+                callback, arg = next_urgent()
+            elif queue and queue[0][0] == self.now:
+                _, _, callback, arg = heappop(queue)
+            elif immediate:
+                callback, arg = next_immediate()
+            elif queue and queue[0][0] < until:
+                self.now, _, callback, arg = heappop(queue)
+            else:
+                break
+            callback(arg)
+            processed += 1
+        self.processed += processed
+        self.now = until
+
+class FifoResource(object):
+    """A resource with `capacity` users, granted in the order requested."""
+    def __init__(self, heap, capacity):
+        self.immediate = heap.immediate
+        self.capacity = capacity
+        self.users = 0
+        self.waiting = deque()
+
+    def request(self, callback, arg):
+        """Call `callback(arg)` once the resource has been seized."""
+        waiting = self.waiting
+        waiting.append((callback, arg))
+        if self.users < self.capacity:
+            self.users += 1
+            self.immediate.append(waiting.popleft())
+
+    def grant(self, _=None):
+        """Seize the resource for the longest waiting request, if there's
+        room. As in simpy, only that request is considered."""
+        if self.waiting and self.users < self.capacity:
+            self.users += 1
+            self.immediate.append(self.waiting.popleft())
+
+    def release(self, request=None):
+        """Give up one user's claim. Users are counted rather than tracked,
+        so `request` is ignored."""
+        self.users -= 1
+        self.immediate.append((self.grant, None))
+
+class HeapNode(object):
+    """Base for the nodes of the heap engine.
+
+    `arrive(entity)` is what the node sending an entity here calls. `link`
+    resolves the nodes entities move on to once every node is built.
+    """
+    trace = None
+
+    def __init__(self, heap, number, node_id):
+        self.heap = heap
+        self.schedule = heap.schedule
+        self.number = number
+        self.node_id = node_id
+
+    def link(self, nodes):
+        """Resolve neighbouring nodes once every node is built."""
+        pass
+
+class HeapSource(HeapNode):
+    """Creates an entity, sends it on, then waits for the next one."""
+    def __init__(self, heap, number, node_id, successor, new_entity, delay,
+                 rng):
+        super(HeapSource, self).__init__(heap, number, node_id)
+        self.successor = successor
+        self.new_entity = new_entity
+        self.sampler = build_sampler(delay, rng, node_id)
+        self.created_count = 0
+        # Set by link
+        self.forward = None
+
+    def link(self, nodes):
+        self.forward = nodes[self.successor].arrive
+
+    def create(self, _=None):
+        """Create an entity, send it on and wait to create the next."""
+        now = self.heap.now
+        entity = self.new_entity(self.created_count)
+        self.created_count += 1
+        entity.created_at = now
+        entity.created_by = self.node_id
+        if self.trace is not None:
+            self.trace(entity, self.number, CREATED, now)
+
+        self.forward(entity)
+
+        self.schedule(self.sampler(), self.create, None)
+
+class HeapProcess(HeapNode):
+    """Seizes, delays and releases in turn, as its actions say.
+
+    Each step is a callback given the entity and when it arrived.
+    """
+    def __init__(self, heap, number, node_id, successor, actions, delay,
+                 resource, rng, monitor=None):
+        super(HeapProcess, self).__init__(heap, number, node_id)
+        self.successor = successor
+        self.seized = resource if actions & SEIZE else None
+        self.released = resource if actions & RELEASE else None
+        self.monitor = monitor
+        # A resource seized and released by the same Process is never seen
+        # held by any other node, so the entity needn't keep track of it
+        self.holds_within = bool(actions & SEIZE and actions & RELEASE)
+        self.sampler = None
+        if actions & DELAY:
+            self.sampler = build_sampler(delay, rng, node_id)
+        # Set by link
+        self.forward = None
+
+    def link(self, nodes):
+        self.forward = nodes[self.successor].arrive
+
+    def arrive(self, entity):
+        """Start work on the entity, after work already due now."""
+        self.heap.urgent.append((self.start, entity))
+
+    def start(self, entity):
+        """Note the entity's arrival, then seize or delay."""
+        entity.visited.append(self.number)
+        arrival_time = self.heap.now
+        if self.trace is not None:
+            self.trace(entity, self.number, ARRIVED, arrival_time)
+
+        if self.seized is not None:
+            if self.monitor is not None:
+                self.monitor.requested(arrival_time)
+            self.seized.request(self.seize, (entity, arrival_time))
+        elif self.sampler is not None:
+            self.schedule(self.sampler(), self.depart, (entity, arrival_time))
+        else:
+            self.depart((entity, arrival_time))
+
+    def seize(self, visit):
+        """Hold the resource just granted, then delay."""
+        if not self.holds_within:
+            visit[0].hold_resource(self.seized, None)
+        if self.monitor is not None:
+            self.monitor.seized(self.heap.now, visit[1])
+        if self.trace is not None:
+            self.trace(visit[0], self.number, SEIZED, self.heap.now)
+
+        if self.sampler is not None:
+            self.schedule(self.sampler(), self.depart, visit)
+        else:
+            self.depart(visit)
+
+    def depart(self, visit):
+        """Release, then send the entity on."""
+        entity, arrival_time = visit
+        now = self.heap.now
+        if self.holds_within:
+            self.released.release()
+        elif self.released is not None:
+            entity.release_resource(self.released)
+        if self.released is not None and self.monitor is not None:
+            self.monitor.released(now)
+
+        entity.record_stay(self.number, arrival_time, now)
+        if self.trace is not None:
+            self.trace(entity, self.number, DEPARTED, now)
+
+        self.forward(entity)
+
+class HeapDecision(HeapNode):
+    """Sends each entity down one of two branches."""
+    def __init__(self, heap, number, node_id, successors, probability, rng):
+        super(HeapDecision, self).__init__(heap, number, node_id)
+        self.successors = successors
+        self.probability = probability
+        self.sampler = ProbabilitySampler(rng)
+        # Set by link
+        self.up_branch = None
+        self.down_branch = None
+
+    def link(self, nodes):
+        self.up_branch = nodes[self.successors[0]].arrive
+        self.down_branch = nodes[self.successors[1]].arrive
+
+    def arrive(self, entity):
+        entity.visited.append(self.number)
+        if self.trace is not None:
+            self.trace(entity, self.number, VISITED, self.heap.now)
+
+        if self.sampler() > self.probability:
+            self.up_branch(entity)
+        else:
+            self.down_branch(entity)
+
+class HeapExit(HeapNode):
+    """Records each entity's departure."""
+    def __init__(self, heap, number, node_id, collect=None):
+        super(HeapExit, self).__init__(heap, number, node_id)
+        self.departed_entities = []
+        self.collect = collect or self.departed_entities.append
+
+    def arrive(self, entity):
+        entity.departed_at = self.heap.now
+        entity.departed_through = self.node_id
+        if self.trace is not None:
+            self.trace(entity, self.number, EXITED, self.heap.now)
+        self.collect(entity)
+
+def run_heap(sim_ir, streams, horizon, new_entity, collect=None, trace=None,
+             monitors=None, metrics=None):
+    """Run one replication of the runnable SimulationIR `sim_ir` until
+    `horizon`.
+
+    Arguments are as for the simpy engine: `streams` is the replication's
+    family of random streams, `new_entity(id)` returns a fresh entity,
+    `collect(entity)`, if given, is called as each entity departs, and
+    `trace` is called for each event of a traced run, `monitors` are told of
+    each request, seize and release of the resources they monitor, and
+    `metrics` (see simulator.metrics) time the build and run and count the
+    entities created and events processed.
+
+    Returns the entities which departed, by Exit in node order, unless they
+    were collected.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.phase('build'):
+        heap = EventHeap()
+        resources = [FifoResource(heap, capacity)
+                     for capacity in sim_ir.capacities]
+
+        nodes = []
+        sources = []
+        exits = []
+        for number, node_id in enumerate(sim_ir.ids):
+            node_type = sim_ir.types[number]
+            successors = sim_ir.successors[number]
+            if node_type == SOURCE:
+                node = HeapSource(heap, number, node_id, successors[0],
+                                  new_entity, sim_ir.delays[number],
+                                  streams.stream(node_id))
+                sources.append(node)
+            elif node_type == EXIT:
+                node = HeapExit(heap, number, node_id, collect)
+                exits.append(node)
+            elif node_type == DECISION:
+                node = HeapDecision(heap, number, node_id, successors,
+                                    sim_ir.probabilities[number],
+                                    streams.stream(node_id))
+            elif node_type == PROCESS:
+                resource = None
+                monitor = None
+                if sim_ir.resources[number] is not None:
+                    resource = resources[sim_ir.resources[number]]
+                    if monitors is not None:
+                        monitor = monitors[sim_ir.resources[number]]
+                node = HeapProcess(heap, number, node_id, successors[0],
+                                   sim_ir.actions[number],
+                                   sim_ir.delays[number], resource,
+                                   streams.stream(node_id), monitor)
+            node.trace = trace
+            nodes.append(node)
+
+        for node in nodes:
+            node.link(nodes)
+
+        for source in sources:
+            heap.urgent.append((source.create, None))
+
+    with metrics.phase('run'):
+        heap.run(horizon)
+    metrics.count('entities', sum(source.created_count for source in sources))
+    metrics.count('events', heap.processed)
+
+    departed_entities = []
+    for exit in exits:
+        departed_entities.extend(exit.departed_entities)
+    return departed_entities
@@ -0,0 +1,207 @@
+"""Compile a parsed simulation into a compact, serializable form
+
+`compile_ir` turns the nodes, edges and resources parsed from a board into a
+`SimulationIR`, the single input to every execution engine. Nodes are numbered
+from 0 in the order they were parsed, and every per-node field is a list
+indexed by that number:
+
+    ids: The node's id on the board
+    labels: The node's label
+    types: A code from NODE_TYPES
+    successors: The numbers of the nodes an entity moves on to. A Decision
+        lists its up branch, then its down branch.
+    delays: The delay spec parsed from the board, e.g.
+        {'type': 'uniform', 'args': {'min': '1', 'max': '5'}}, for Sources
+        and delaying Processes
+    probabilities: A Decision's probability, from 0 to 1, of taking its down
+        branch
+    actions: A Process's combination of SEIZE, DELAY and RELEASE
+    resources: The number of the resource a Process seizes or releases
+
+Resources are numbered in the order their names first appear, with
+`resource_names` and `capacities` indexed by that number.
+
+Layout, and anything else the engines don't read, is left out, so boards
+which only differ in layout compile to the same IR.
+
+The IR doesn't check that each node's configuration is complete, since
+boards may be built without being run. The engines raise SimBuildError for
+incomplete nodes when a run starts.
+"""
+
+import hashlib
+import json
+from simulator.errors import SimBuildError
+
+# Bump whenever the IR changes, so IR compiled by older code isn't reused.
+IR_VERSION = 1
+
+SOURCE = 0
+EXIT = 1
+PROCESS = 2
+DECISION = 3
+NODE_TYPES = ['source', 'exit', 'process', 'decision']
+
+# What a Process does to each entity, as bit flags
+SEIZE = 1
+DELAY = 2
+RELEASE = 4
+PROCESS_ACTIONS = {
+    'delay': DELAY,
+    'sieze': SEIZE,
+    'release': RELEASE,
+    'siezeDelay': SEIZE | DELAY,
+    'siezeDelayRelease': SEIZE | DELAY | RELEASE,
+}
+
+FIELDS = [
+    'ids', 'labels', 'types', 'successors', 'delays', 'probabilities',
+    'actions', 'resources', 'resource_names', 'capacities']
+
+def ir_key(xml_string):
+    """Return the key under which the IR compiled from `xml_string` is
+    cached."""
+    if isinstance(xml_string, str):
+        xml_string = xml_string.encode('utf-8')
+    material = ('%d:' % IR_VERSION).encode('utf-8') + xml_string
+    return hashlib.sha256(material).hexdigest()
+
+class SimulationIR(object):
+    """A compiled simulation. See the module docstring for its fields."""
+    def __init__(self, **fields):
+        for field in FIELDS:
+            setattr(self, field, fields[field])
+        self.index = dict((node_id, number)
+                          for number, node_id in enumerate(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nodes_of_type(self, node_type):
+        """Return the numbers of every node with the given type code."""
+        return [number for number, code in enumerate(self.types)
+                if code == node_type]
+
+    def describe(self):
+        """Return the label and type name of each node, keyed by node id."""
+        return dict(
+            (node_id, {'label': label, 'type': NODE_TYPES[code]})
+            for node_id, label, code in zip(self.ids, self.labels, self.types))
+
+    def to_dict(self):
+        """Return the IR as a dict of JSON-serializable lists."""
+        fields = dict((field, getattr(self, field)) for field in FIELDS)
+        fields['version'] = IR_VERSION
+        return fields
+
+    def to_json(self):
+        """Serialize the IR to a canonical JSON string."""
+        return json.dumps(self.to_dict(), sort_keys=True, separators=(',', ':'))
+
+    def digest(self):
+        """Return a hash identifying what the IR simulates."""
+        return hashlib.sha256(self.to_json().encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_json(cls, encoded):
+        """Load an IR serialized by `to_json`, or return None if it was
+        compiled by a different version of the simulator."""
+        fields = json.loads(encoded)
+        if fields.pop('version', None) != IR_VERSION:
+            return None
+        return cls(**fields)
+
+def compile_ir(nodes, edges, resources):
+    """Compile the output of `parse_sim` into a SimulationIR."""
+    ids = list(nodes)
+    index = dict((node_id, number) for number, node_id in enumerate(ids))
+
+    resource_names = []
+    capacities = []
+    resource_index = {}
+    for resource in resources.values():
+        capacity = 1
+        try:
+            capacity = int(resource['count'])
+        except (KeyError, TypeError, ValueError):
+            # Use default value of 1
+            pass
+
+        # A later resource with the same name replaces an earlier one
+        name = resource.get('name')
+        if name not in resource_index:
+            resource_index[name] = len(resource_names)
+            resource_names.append(name)
+            capacities.append(capacity)
+        else:
+            capacities[resource_index[name]] = capacity
+
+    successors = [[] for _ in ids]
+    for edge_id, edge in edges.items():
+        if edge['target'] not in index:
+            raise SimBuildError(
+                'Edge %s leads to a node which doesn\'t exist.' % edge_id)
+        successors[index[edge['source']]].append(index[edge['target']])
+
+    types = []
+    labels = []
+    delays = []
+    probabilities = []
+    actions = []
+    resources_used = []
+    for number, node_id in enumerate(ids):
+        node = nodes[node_id]
+        if node['type'] not in NODE_TYPES:
+            raise SimBuildError(
+                'Node %s has an unsupported type, %s.' % (
+                    node_id, node['type']),
+                node_type=node['type'], node_id=node_id)
+        code = NODE_TYPES.index(node['type'])
+        metadata = node.get('metadata') or {}
+        delay = metadata.get('delay')
+
+        action = 0
+        resource = None
+        if code == PROCESS:
+            action = PROCESS_ACTIONS.get(metadata.get('processType'), 0)
+            if action & (SEIZE | RELEASE):
+                name = ((delay or {}).get('args') or {}).get('resource')
+                resource = resource_index.get(name)
+            if not action & DELAY:
+                delay = None
+
+        probability = None
+        if code == DECISION:
+            try:
+                probability = float(metadata['args']['probability'])
+            except (KeyError, TypeError, ValueError):
+                pass
+            # NaN fails the comparison too
+            if probability is not None and not 0 <= probability <= 1:
+                raise SimBuildError(
+                    'Decision %s has a probability outside 0 to 1.' % node_id,
+                    node_type=node['type'], node_id=node_id)
+            # Entities only choose between branches of a two-way Decision
+            if len(successors[number]) != 2:
+                successors[number] = []
+        elif code in (SOURCE, PROCESS):
+            successors[number] = successors[number][:1]
+
+        types.append(code)
+        labels.append(node.get('label'))
+        delays.append(delay if code in (SOURCE, PROCESS) else None)
+        probabilities.append(probability)
+        actions.append(action)
+        resources_used.append(resource)
+
+    return SimulationIR(
+        ids=ids,
+        labels=labels,
+        types=types,
+        successors=successors,
+        delays=delays,
+        probabilities=probabilities,
+        actions=actions,
+        resources=resources_used,
+        resource_names=resource_names,
+        capacities=capacities)
@@ -0,0 +1,194 @@
+"""Estimate a simulation's statistics without running it
+
+In the 'estimate' statistics mode the compiled board is treated as an
+absorbing Markov chain: an entity at a Source or Process moves on to its
+successor, an entity at a Decision takes its down branch with the Decision's
+probability, and Exits absorb entities. The expected number of visits to each
+node solves
+
+    visits = created + Q' visits
+
+where `created` is how many entities each Source is expected to create
+before the horizon and Q holds the probability of moving from one node to
+another. Q is as sparse as the board, so rather than inverting I - Q' the
+board is split into strongly connected components, which are solved one at a
+time in topological order. A component without loops is a single node whose
+visits are just its inflow; only loops need a (small, dense) linear solve.
+
+Waiting for resources isn't modelled, so stay lengths and lifespans are
+those of a board without contention.
+"""
+
+import numpy as np
+from simulator.errors import SimBuildError
+from simulator.ir import SOURCE, EXIT, PROCESS, DECISION, DELAY, NODE_TYPES
+from simulator.samplers import build_sampler
+
+def transitions(sim_ir, number):
+    """Return (successor, probability) pairs for moving on from a node."""
+    successors = sim_ir.successors[number]
+    if sim_ir.types[number] == DECISION:
+        probability = sim_ir.probabilities[number]
+        return [(successors[0], 1.0 - probability),
+                (successors[1], probability)]
+    if sim_ir.types[number] == EXIT:
+        return []
+    return [(successors[0], 1.0)]
+
+def strongly_connected_components(successors):
+    """Return the strongly connected components of a graph, given as a list
+    of each node's successors, in topological order.
+
+    Uses Tarjan's algorithm with an explicit stack, so long chains of nodes
+    don't exhaust Python's recursion limit.
+    """
+    count = len(successors)
+    index = [None] * count
+    lowlink = [0] * count
+    on_stack = [False] * count
+    stack = []
+    components = []
+    counter = 0
+
+    for root in range(count):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child = work.pop()
+            if child == 0:
+                index[node] = lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+
+            # Visit the next unvisited successor, coming back here after
+            descended = False
+            targets = successors[node]
+            for position in range(child, len(targets)):
+                target = targets[position]
+                if index[target] is None:
+                    work.append((node, position + 1))
+                    work.append((target, 0))
+                    descended = True
+                    break
+                elif on_stack[target]:
+                    lowlink[node] = min(lowlink[node], index[target])
+            if descended:
+                continue
+
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+    # Tarjan's algorithm finds components in reverse topological order
+    components.reverse()
+    return components
+
+def expected_visits(sim_ir, created):
+    """Return the expected number of visits to each node, given the number
+    of entities created at each node."""
+    moves = [transitions(sim_ir, number) for number in range(len(sim_ir))]
+    inflow = list(created)
+    visits = [0.0] * len(sim_ir)
+
+    for component in strongly_connected_components(sim_ir.successors):
+        if len(component) == 1 and component[0] not in sim_ir.successors[
+                component[0]]:
+            number = component[0]
+            visits[number] = inflow[number]
+            for target, probability in moves[number]:
+                inflow[target] += visits[number] * probability
+            continue
+
+        # A loop: solve (I - Q') v = inflow within the component
+        local = dict((number, position)
+                     for position, number in enumerate(component))
+        matrix = np.identity(len(component))
+        for number in component:
+            for target, probability in moves[number]:
+                if target in local:
+                    matrix[local[target], local[number]] -= probability
+        try:
+            solved = np.linalg.solve(
+                matrix, [inflow[number] for number in component])
+        except np.linalg.LinAlgError:
+            solved = None
+        if solved is None or not np.isfinite(solved).all():
+            node_id = sim_ir.ids[component[0]]
+            raise SimBuildError(
+                'Entities can never leave the loop through node %s.' % node_id,
+                node_id=node_id)
+
+        for number in component:
+            visits[number] = float(solved[local[number]])
+            for target, probability in moves[number]:
+                if target not in local:
+                    inflow[target] += visits[number] * probability
+
+    return visits
+
+def estimate(sim_ir, horizon):
+    """Return the expected statistics of a run of the runnable SimulationIR
+    `sim_ir` until `horizon`.
+
+    The result has the form of the 'summary' statistics mode, with expected
+    counts and mean lengths only, plus the probability of leaving through
+    each Exit under 'exits'.
+    """
+    created = [0.0] * len(sim_ir)
+    stays = [0.0] * len(sim_ir)
+    for number, node_id in enumerate(sim_ir.ids):
+        node_type = sim_ir.types[number]
+        if node_type == SOURCE:
+            # One entity at the start, then one after each delay
+            mean = build_sampler(sim_ir.delays[number], None, node_id).mean()
+            if mean <= 0:
+                raise SimBuildError(
+                    'Source %s creates entities without any delay.' % node_id,
+                    node_type='source', node_id=node_id)
+            created[number] = 1 + horizon / float(mean)
+        elif node_type == PROCESS and sim_ir.actions[number] & DELAY:
+            stays[number] = build_sampler(
+                sim_ir.delays[number], None, node_id).mean()
+
+    visits = expected_visits(sim_ir, created)
+    total = sum(created)
+
+    node_stats = {}
+    exits = {}
+    for number, node_id in enumerate(sim_ir.ids):
+        if not visits[number]:
+            continue
+        node_stats[node_id] = {
+            'label': sim_ir.labels[number],
+            'type': NODE_TYPES[sim_ir.types[number]],
+            'visited_count': visits[number],
+        }
+        if sim_ir.types[number] == PROCESS:
+            node_stats[node_id]['stay_length'] = {'mean': stays[number]}
+        elif sim_ir.types[number] == EXIT:
+            exits[node_id] = visits[number] / total
+
+    entity_stats = {'count': total}
+    if total:
+        entity_stats['lifespan'] = {
+            'mean': sum(count * stay for count, stay in zip(visits, stays)) /
+                    total,
+        }
+
+    return {
+        'nodes': node_stats,
+        'entities': entity_stats,
+        'exits': exits,
+    }
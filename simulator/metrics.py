@@ -0,0 +1,82 @@
+"""Time the phases of a job and count what it did
+
+A `Metrics` collects the wall time spent in each named phase of a job, read
+from a monotonic clock so changes to the system time don't skew it, along
+with counts such as the number of entities created and events processed. The
+phases of a job are
+
+    parse, validate, compile    building the IR (see build_sim)
+    build                       constructing the nodes of each replication
+    run                         executing each replication
+    analyze                     turning each replication into statistics
+    estimate                    computing estimated statistics
+    serialize, deliver          encoding and posting the results (sim_worker)
+
+and its counts are `entities` created, `events` processed and simpy
+`processes` spawned. Phases and counts are summed over replications, so with
+several processes they add up to more than the job's wall time.
+"""
+
+import time
+from contextlib import contextmanager
+import simpy
+
+class Metrics(object):
+    """Seconds spent in each phase of a job, and counts of what it did."""
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the `with` block to the phase `name`."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + \
+                time.monotonic() - started
+
+    def count(self, name, amount=1):
+        """Add `amount` to the count `name`."""
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def merge(self, other):
+        """Add the phases and counts of the Metrics `other` to these."""
+        for name, seconds in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        for name, amount in other.counts.items():
+            self.count(name, amount)
+
+    def to_dict(self):
+        """Return the phases and counts, and how many events were processed
+        per second of running, as a JSON-serializable dict."""
+        metrics = {
+            'phases': dict(self.phases),
+            'counts': dict(self.counts),
+        }
+        if self.counts.get('events') and self.phases.get('run'):
+            metrics['events_per_second'] = \
+                self.counts['events'] / self.phases['run']
+        return metrics
+
+class CountingEnvironment(simpy.Environment):
+    """A simpy Environment which counts the processes it spawns.
+
+    Events aren't counted as they are processed, which would slow down every
+    step of the run. simpy numbers each event it schedules, so the number
+    processed is read off at the end instead.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CountingEnvironment, self).__init__(*args, **kwargs)
+        self.processes = 0
+
+    def process(self, generator):
+        self.processes += 1
+        return super(CountingEnvironment, self).process(generator)
+
+    def processed_events(self):
+        """Return the number of events processed, once the run is over."""
+        # Every scheduled event took the next id, and is processed unless
+        # it's still queued
+        return next(self._eid) - len(self._queue)
@@ -1,24 +1,20 @@
 """Delay mixin"""
-import random
+from simulator.samplers import build_sampler
 
 class Delay(object):
-    """Mixin which provides `calculate_delay`."""
-    def calculate_delay(self, delay_type, **kwargs):
-        """Delay the progress of the simulation"""
-        duration = 0
-        if delay_type == 'constant':
-            duration = int(kwargs['val'])
+    """Mixin which provides `calculate_delay`.
 
-        elif delay_type == 'uniform':
-            duration = random.randint(
-                int(kwargs['min']), int(kwargs['max']))
+    A node's delay is compiled into `self.sampler` once, when the node is
+    built, and drawn from the node's own random stream.
+    """
 
-        elif delay_type == 'triangular':
-            duration = random.triangular(
-                int(kwargs['min']), int(kwargs['max']), int(kwargs['mid']))
+    # Set by compile_delay
+    sampler = None
 
-        elif delay_type == 'exponential':
-            duration = random.expovariate(
-                int(kwargs['val']))
+    def compile_delay(self, delay, rng):
+        """Compile the delay spec parsed from the simulation into a sampler."""
+        self.sampler = build_sampler(delay, rng, self.node_id)
 
-        return duration
+    def calculate_delay(self):
+        """Return how long to delay the progress of the simulation."""
+        return self.sampler()
@@ -1,13 +1,23 @@
 """Proceed mixin"""
-from simulator.graph import get_node, get_edge
 
 class Proceed(object):
-    """Mixin which provides `proceed`."""
-    def proceed(self, edge, entity):
-        """Move the simulation along to the next node."""
-        target = get_edge(edge)['target']
-        node = get_node(target)
-        if type(node).__name__ in ['Exit', 'Decision']:
-            node.run(entity)
-        else:
-            self.env.process(node.run(entity))
+    """Mixin which provides `route` and `proceed`.
+
+    Nodes using it look up their neighbours in `self.graph`. Once every node
+    has been added to the graph, `link` resolves each node an entity may move
+    on to with `route`, so moving an entity along is a single call with no
+    lookups.
+    """
+    def route(self, target):
+        """Return the function which sends an entity to the node `target`."""
+        node = self.graph.get_node(target)
+        if node.runs_inline:
+            return node.run
+
+        process = self.env.process
+        run = node.run
+        return lambda entity: process(run(entity))
+
+    def proceed(self, target, entity):
+        """Move the simulation along to the node `target`."""
+        self.route(target)(entity)
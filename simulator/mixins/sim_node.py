@@ -3,6 +3,17 @@
 class SimNode(object):
     """Mixin to expose some data about the node in the simulation."""
 
+    # Nodes which never wait are run directly by the node sending an entity
+    # to them, rather than in a new simpy process.
+    runs_inline = False
+
+    # Number of the node in the simulation's IR, set when the node is built
+    number = None
+
+    # Called as trace(entity, number, kind, time) for each event at the node
+    # when the run is traced (see simulator.trace)
+    trace = None
+
     def get_node_id(self):
         """Return the node's id."""
         return self.node_id
@@ -10,3 +21,7 @@ class SimNode(object):
     def get_node_type(self):
         """Return the class name for this node."""
         return self.__class__.__name__
+
+    def link(self):
+        """Resolve neighbouring nodes once every node is in the graph."""
+        pass
@@ -1,41 +1,51 @@
-"""Random"""
-import random
 """Define the nodes which make up a simulation"""
 from simulator.mixins.delay import Delay
 from simulator.mixins.proceed import Proceed
 from simulator.mixins.sim_node import SimNode
 from simulator.mixins.statistics import Statistics
+from simulator.samplers import ProbabilitySampler
+from simulator.trace import CREATED, ARRIVED, SEIZED, DEPARTED, VISITED, EXITED
 
 class Source(Proceed, Delay, Statistics, SimNode, object):
     """Generates entities, at some interval, which move through the simulation.
     These entities represent various actors as defined by the user when they
     build the simulation."""
-    def __init__(self, env, node_id, Model, model_args, outbound_edge, delay):
+    def __init__(self, env, graph, node_id, Model, model_args, successor,
+                 delay, rng):
         self.env = env
+        self.graph = graph
         self.node_id = node_id
         self.Model = Model
-        self.outbound_edge = outbound_edge
+        self.successor = successor
         self.delay = delay
         self.model_args = model_args
+        self.compile_delay(delay, rng)
+        # Set by link
+        self.forward = None
 
         self.created_count = 0
 
         self.statistics = {}
 
+    def link(self):
+        """Resolve the node entities move on to."""
+        self.forward = self.route(self.successor)
+
     def run(self):
         """Perform the actions associated with this node."""
         while True:
             # Create entity which will move through the simulation
             entity = self.Model(self.created_count)
 
-            entity.record_statistic('created_at', self.env.now)
-            entity.record_statistic('created_by', self.node_id)
+            entity.created_at = self.env.now
+            entity.created_by = self.node_id
+            if self.trace is not None:
+                self.trace(entity, self.number, CREATED, self.env.now)
 
-            self.proceed(self.outbound_edge, entity)
+            self.forward(entity)
 
             # Delay before creating another entity
-            yield self.env.timeout(
-                self.calculate_delay(self.delay['type'], **self.delay['args']))
+            yield self.env.timeout(self.sampler())
             self.created_count += 1
 
 class Process(Proceed, Delay, Statistics, SimNode, object):
@@ -50,10 +60,11 @@ class Process(Proceed, Delay, Statistics, SimNode, object):
     Release:
         Renounce the current entity's claim on some quantity of a resource
     """
-    def __init__(self, env, node_id, outbound_edge, **kwargs):
+    def __init__(self, env, graph, node_id, successor, **kwargs):
         self.env = env
+        self.graph = graph
         self.node_id = node_id
-        self.outbound_edge = outbound_edge
+        self.successor = successor
 
         self.will_seize = kwargs['will_seize']
         self.to_be_seized = kwargs['to_be_seized']
@@ -64,68 +75,110 @@ class Process(Proceed, Delay, Statistics, SimNode, object):
         self.will_release = kwargs['will_release']
         self.to_be_released = kwargs['to_be_released']
 
+        # Told of each request, seize and release of the resource, if given
+        self.monitor = kwargs.get('monitor')
+
+        self.sampler = None
+        if self.will_delay:
+            self.compile_delay(self.delay, kwargs['rng'])
+        # Set by link
+        self.forward = None
+
         self.statistics = {}
 
+    def link(self):
+        """Resolve the node entities move on to."""
+        self.forward = self.route(self.successor)
+
     def run(self, entity):
         """Perform the actions associated with this node."""
-        entity.record_statistic('visited', self.node_id)
+        entity.visited.append(self.number)
         arrival_time = self.env.now
+        trace = self.trace
+        if trace is not None:
+            trace(entity, self.number, ARRIVED, arrival_time)
 
         request = None
 
         if self.will_seize:
+            if self.monitor is not None:
+                self.monitor.requested(arrival_time)
             request = self.to_be_seized.request()
             yield request
             entity.hold_resource(self.to_be_seized, request)
+            if self.monitor is not None:
+                self.monitor.seized(self.env.now, arrival_time)
+            if trace is not None:
+                trace(entity, self.number, SEIZED, self.env.now)
 
         if self.will_delay:
-            yield self.env.timeout(
-                self.calculate_delay(self.delay['type'], **self.delay['args']))
+            yield self.env.timeout(self.sampler())
 
         if self.will_release:
             entity.release_resource(self.to_be_released)
+            if self.monitor is not None:
+                self.monitor.released(self.env.now)
 
-        entity.record_statistic('process_visits', {
-            'node_id': self.node_id,
-            'arrived_at': arrival_time,
-            'departed_at': self.env.now
-        })
+        entity.record_stay(self.number, arrival_time, self.env.now)
+        if trace is not None:
+            trace(entity, self.number, DEPARTED, self.env.now)
 
-        self.proceed(self.outbound_edge, entity)
+        self.forward(entity)
 
 class Decision(Proceed, Statistics, SimNode, object):
     """A node which branches the simulation off in one of two directions based
     on some condition."""
-    def __init__(self, env, node_id, branches, probability):
+    runs_inline = True
+
+    def __init__(self, env, graph, node_id, branches, probability, rng):
         self.env = env
+        self.graph = graph
         self.node_id = node_id
         self.branches = branches
         self.probability = probability
+        self.sampler = ProbabilitySampler(rng)
+        # Set by link
+        self.up_branch = None
+        self.down_branch = None
         self.statistics = {}
 
+    def link(self):
+        """Resolve the nodes both branches lead to."""
+        self.up_branch = self.route(self.branches['up'])
+        self.down_branch = self.route(self.branches['down'])
+
     def run(self, entity):
         """Perform the actions associated with this node."""
-        entity.record_statistic('visited', self.node_id)
+        entity.visited.append(self.number)
+        if self.trace is not None:
+            self.trace(entity, self.number, VISITED, self.env.now)
 
-        if random.uniform(0, 1) > self.probability:
-            self.proceed(self.branches['up'], entity)
+        if self.sampler() > self.probability:
+            self.up_branch(entity)
         else:
-            self.proceed(self.branches['down'], entity)
+            self.down_branch(entity)
 
 class Exit(Statistics, SimNode, object):
     """A node representing the end-of-the-line in a simulation."""
-    def __init__(self, env, node_id):
+    runs_inline = True
+
+    def __init__(self, env, node_id, collect=None):
         self.env = env
         self.node_id = node_id
         self.departed_entities = []
 
+        # Departed entities are kept unless something else collects them
+        self.collect = collect or self.departed_entities.append
+
         self.statistics = {}
 
     def run(self, entity):
         """Perform the actions associated with this node."""
-        entity.record_statistic('departed_at', self.env.now)
-        entity.record_statistic('departed_through', self.node_id)
-        self.departed_entities.append(entity)
+        entity.departed_at = self.env.now
+        entity.departed_through = self.node_id
+        if self.trace is not None:
+            self.trace(entity, self.number, EXITED, self.env.now)
+        self.collect(entity)
 
     def get_departed_entities(self):
         """Get departed from entities"""
@@ -0,0 +1,37 @@
+"""Independent, reproducible random number streams
+
+Every simulation owns a `RandomStreams` created from its seed. Each node which
+draws random numbers is given its own stream, and each replication its own
+family of streams, so results depend only on the seed and not on how many
+simulations or replications share a process.
+"""
+
+import hashlib
+import numpy as np
+
+class RandomStreams(object):
+    """A tree of random number streams derived from one seed.
+
+    The seed of each stream is a SHA-256 hash of the root seed and the path of
+    keys leading to the stream, in the spirit of NumPy's `SeedSequence.spawn`
+    (which the NumPy version we depend on predates). Streams with different
+    paths are statistically independent, and the same path always yields the
+    same stream.
+    """
+    def __init__(self, seed, path=()):
+        self.seed = seed
+        self.path = tuple(path)
+
+    def spawn(self, *keys):
+        """Return the family of streams found under `keys`."""
+        return RandomStreams(self.seed, self.path + keys)
+
+    def stream(self, *keys):
+        """Return a new `numpy.random.RandomState` for the stream at `keys`."""
+        return np.random.RandomState(self.derive_seed(self.path + keys))
+
+    def derive_seed(self, path):
+        """Hash the root seed and a path into a seed for `RandomState`."""
+        material = repr((self.seed,) + tuple(str(key) for key in path))
+        digest = hashlib.sha256(material.encode('utf-8')).digest()
+        return np.frombuffer(digest, dtype=np.uint32)
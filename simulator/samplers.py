@@ -0,0 +1,284 @@
+"""Compile delay specifications into fast, buffered samplers
+
+A delay parsed from a simulation looks like:
+
+    {'type': 'uniform', 'args': {'min': '1', 'max': '5'}}
+
+`build_sampler` turns it into a sampler whose arguments have already been
+parsed and checked. Calling the sampler returns the next delay. Random delays
+are drawn from the node's stream in NumPy batches of `BUFFER_SIZE` and handed
+out one at a time, so each draw costs about as much as advancing an iterator.
+
+Distributions (all arguments are strings in the simulation's XML):
+    constant: val
+    uniform: min, max
+        An integer delay from min to max, inclusive
+    triangular: min, mid, max
+    exponential: val
+        `val` is the rate, so the mean delay is 1 / val
+    normal: mean, std
+        Negative draws are truncated to 0
+    lognormal: mean, std
+        The mean and standard deviation of the underlying normal distribution
+    gamma: shape, scale
+    erlang: k, val
+        The sum of `k` exponential delays with rate `val`
+    empirical: values[, weights]
+        Comma-separated values, drawn with the given relative weights or
+        uniformly
+
+New distributions are added by subclassing `Sampler` and registering the
+class in `SAMPLERS`.
+"""
+
+import math
+import numpy as np
+from simulator.errors import SimBuildError
+
+BUFFER_SIZE = 1024
+
+def parse_number(value, name):
+    """Parse a finite numeric argument, keeping integers as integers."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError('"%s" must be a number' % name) from error
+    if not math.isfinite(number):
+        raise ValueError('"%s" must be a number' % name)
+    if number.is_integer() and '.' not in str(value):
+        return int(number)
+    return number
+
+def parse_list(value, name):
+    """Parse a comma-separated list of numbers."""
+    if value is None:
+        raise ValueError('"%s" is required' % name)
+    return [parse_number(item.strip(), name) for item in str(value).split(',')]
+
+def require(args, name):
+    """Return a required argument, parsed as a number."""
+    if name not in args or args[name] is None:
+        raise ValueError('"%s" is required' % name)
+    return parse_number(args[name], name)
+
+class Sampler(object):
+    """Hand out delays drawn in batches from a random stream.
+
+    Subclasses parse their arguments in `__init__` and implement `draw`.
+    """
+    def __init__(self, rng, args):
+        self.rng = rng
+        self.next_delay = iter(()).__next__
+
+    def draw(self, size):
+        """Return a NumPy array of `size` delays."""
+        raise NotImplementedError()
+
+    def mean(self):
+        """Return the expected delay."""
+        raise NotImplementedError()
+
+    def __call__(self):
+        """Return the next delay."""
+        try:
+            return self.next_delay()
+        except StopIteration:
+            self.next_delay = iter(self.draw(BUFFER_SIZE).tolist()).__next__
+            return self.next_delay()
+
+class ConstantSampler(Sampler):
+    """The same delay every time."""
+    def __init__(self, rng, args):
+        super(ConstantSampler, self).__init__(rng, args)
+        self.value = require(args, 'val')
+        if self.value < 0:
+            raise ValueError('"val" must not be negative')
+
+    def draw(self, size):
+        return np.full(size, self.value)
+
+    def mean(self):
+        return self.value
+
+    def __call__(self):
+        return self.value
+
+class UniformSampler(Sampler):
+    """An integer delay from `min` to `max`, inclusive."""
+    def __init__(self, rng, args):
+        super(UniformSampler, self).__init__(rng, args)
+        self.low = int(require(args, 'min'))
+        self.high = int(require(args, 'max'))
+        if not 0 <= self.low <= self.high:
+            raise ValueError('"min" and "max" must satisfy 0 <= min <= max')
+
+    def draw(self, size):
+        return self.rng.randint(self.low, self.high + 1, size)
+
+    def mean(self):
+        return (self.low + self.high) / 2.0
+
+class TriangularSampler(Sampler):
+    """A delay from the triangular distribution between `min` and `max`
+    which peaks at `mid`."""
+    def __init__(self, rng, args):
+        super(TriangularSampler, self).__init__(rng, args)
+        self.low = require(args, 'min')
+        self.mode = require(args, 'mid')
+        self.high = require(args, 'max')
+        if not 0 <= self.low <= self.mode <= self.high:
+            raise ValueError(
+                '"min", "mid" and "max" must satisfy 0 <= min <= mid <= max')
+
+    def draw(self, size):
+        if self.low == self.high:
+            return np.full(size, self.low)
+        return self.rng.triangular(self.low, self.mode, self.high, size)
+
+    def mean(self):
+        return (self.low + self.mode + self.high) / 3.0
+
+class ExponentialSampler(Sampler):
+    """A delay from the exponential distribution with rate `val`."""
+    def __init__(self, rng, args):
+        super(ExponentialSampler, self).__init__(rng, args)
+        self.rate = require(args, 'val')
+        if self.rate <= 0:
+            raise ValueError('"val" must be positive')
+
+    def draw(self, size):
+        return self.rng.exponential(1.0 / self.rate, size)
+
+    def mean(self):
+        return 1.0 / self.rate
+
+class NormalSampler(Sampler):
+    """A delay from the normal distribution, truncated at 0."""
+    def __init__(self, rng, args):
+        super(NormalSampler, self).__init__(rng, args)
+        self.loc = require(args, 'mean')
+        self.sigma = require(args, 'std')
+        if self.sigma < 0:
+            raise ValueError('"std" must not be negative')
+
+    def draw(self, size):
+        return self.rng.normal(self.loc, self.sigma, size).clip(min=0)
+
+    def mean(self):
+        # Draws below 0 count as 0, so this is E[max(X, 0)]
+        if self.sigma == 0:
+            return max(self.loc, 0)
+        score = self.loc / float(self.sigma)
+        cdf = 0.5 * (1 + math.erf(score / math.sqrt(2)))
+        pdf = math.exp(-score * score / 2) / math.sqrt(2 * math.pi)
+        return self.loc * cdf + self.sigma * pdf
+
+class LognormalSampler(Sampler):
+    """A delay whose logarithm is normally distributed."""
+    def __init__(self, rng, args):
+        super(LognormalSampler, self).__init__(rng, args)
+        self.loc = require(args, 'mean')
+        self.sigma = require(args, 'std')
+        if self.sigma < 0:
+            raise ValueError('"std" must not be negative')
+
+    def draw(self, size):
+        return self.rng.lognormal(self.loc, self.sigma, size)
+
+    def mean(self):
+        return math.exp(self.loc + self.sigma ** 2 / 2.0)
+
+class GammaSampler(Sampler):
+    """A delay from the gamma distribution."""
+    def __init__(self, rng, args):
+        super(GammaSampler, self).__init__(rng, args)
+        self.shape = require(args, 'shape')
+        self.scale = require(args, 'scale')
+        if self.shape <= 0 or self.scale <= 0:
+            raise ValueError('"shape" and "scale" must be positive')
+
+    def draw(self, size):
+        return self.rng.gamma(self.shape, self.scale, size)
+
+    def mean(self):
+        return self.shape * self.scale
+
+class ErlangSampler(GammaSampler):
+    """The sum of `k` exponential delays, each with rate `val`."""
+    def __init__(self, rng, args):
+        k = require(args, 'k')
+        rate = require(args, 'val')
+        if not isinstance(k, int) or k < 1:
+            raise ValueError('"k" must be a positive integer')
+        if rate <= 0:
+            raise ValueError('"val" must be positive')
+        super(ErlangSampler, self).__init__(
+            rng, {'shape': k, 'scale': 1.0 / rate})
+
+class EmpiricalSampler(Sampler):
+    """A delay picked from a list of observed values."""
+    def __init__(self, rng, args):
+        super(EmpiricalSampler, self).__init__(rng, args)
+        self.values = parse_list(args.get('values'), 'values')
+        if min(self.values) < 0:
+            raise ValueError('"values" must not be negative')
+
+        self.weights = None
+        if args.get('weights') is not None:
+            weights = parse_list(args['weights'], 'weights')
+            if len(weights) != len(self.values) or min(weights) < 0 or \
+                    sum(weights) <= 0:
+                raise ValueError('"weights" must be one non-negative weight '
+                                 'per value')
+            total = float(sum(weights))
+            self.weights = [weight / total for weight in weights]
+
+    def draw(self, size):
+        return self.rng.choice(self.values, size, p=self.weights)
+
+    def mean(self):
+        if self.weights is None:
+            return sum(self.values) / float(len(self.values))
+        return sum(value * weight
+                   for value, weight in zip(self.values, self.weights))
+
+class ProbabilitySampler(Sampler):
+    """A number uniformly distributed on [0, 1), used to pick branches."""
+    def __init__(self, rng, args=None):
+        super(ProbabilitySampler, self).__init__(rng, args)
+
+    def draw(self, size):
+        return self.rng.random_sample(size)
+
+    def mean(self):
+        return 0.5
+
+SAMPLERS = {
+    'constant': ConstantSampler,
+    'uniform': UniformSampler,
+    'triangular': TriangularSampler,
+    'exponential': ExponentialSampler,
+    'normal': NormalSampler,
+    'lognormal': LognormalSampler,
+    'gamma': GammaSampler,
+    'erlang': ErlangSampler,
+    'empirical': EmpiricalSampler,
+}
+
+def build_sampler(delay, rng, node_id=None):
+    """Compile a parsed delay into a sampler drawing from `rng`.
+
+    Raises SimBuildError if the delay's type is unknown or its arguments are
+    missing or invalid.
+    """
+    if not delay or delay.get('type') not in SAMPLERS:
+        raise SimBuildError(
+            'Node %s has an unknown delay type.' % node_id, node_id=node_id)
+
+    try:
+        return SAMPLERS[delay['type']](rng, delay.get('args', {}))
+    except ValueError as error:
+        raise SimBuildError(
+            'Node %s has an invalid %s delay: %s.' % (
+                node_id, delay['type'], error),
+            node_id=node_id) from error
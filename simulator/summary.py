@@ -0,0 +1,46 @@
+"""Summarize a statistic measured across independent replications"""
+
+import math
+
+# Two-sided 95% critical values of Student's t distribution, indexed by
+# degrees of freedom. Larger samples use the normal approximation.
+T_95 = [
+    None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+    2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093,
+    2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045,
+    2.042]
+Z_95 = 1.960
+
+def t_critical(degrees_of_freedom):
+    """Return the two-sided 95% critical value for a t distribution."""
+    if degrees_of_freedom < len(T_95):
+        return T_95[degrees_of_freedom]
+    return Z_95
+
+def summarize(values):
+    """Return the mean, sample standard deviation and 95% confidence interval
+    of the mean of `values`."""
+    count = len(values)
+    if count == 0:
+        return None
+
+    mean = sum(values) / float(count)
+    if count == 1:
+        return {
+            'mean': mean,
+            'std': 0.0,
+            'ci_low': mean,
+            'ci_high': mean,
+            'n': 1,
+        }
+
+    variance = sum((value - mean) ** 2 for value in values) / (count - 1)
+    std = math.sqrt(variance)
+    half_width = t_critical(count - 1) * std / math.sqrt(count)
+    return {
+        'mean': mean,
+        'std': std,
+        'ci_low': mean - half_width,
+        'ci_high': mean + half_width,
+        'n': count,
+    }
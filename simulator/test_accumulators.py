@@ -0,0 +1,51 @@
+"""Test constant-memory statistics"""
+
+import unittest
+import numpy as np
+from .accumulators import P2Quantile, Summary, summarize_array
+
+class AccumulatorTestCase(unittest.TestCase):
+    """Tests for running summaries."""
+
+    def test_summary(self):
+        """Should match the statistics of the values seen."""
+        values = np.random.RandomState(0).exponential(4.0, 5000)
+        summary = Summary()
+        for value in values:
+            summary.add(value)
+
+        stats = summary.to_dict()
+        assert stats['count'] == 5000
+        self.assertAlmostEqual(stats['mean'], values.mean())
+        self.assertAlmostEqual(stats['std'], values.std(ddof=1))
+        assert stats['min'] == values.min()
+        assert stats['max'] == values.max()
+        for percent in (50, 90, 99):
+            expected = np.percentile(values, percent)
+            assert abs(stats['p%d' % percent] - expected) < 0.05 * expected
+
+    def test_few_values(self):
+        """Should compute quantiles of a handful of values exactly."""
+        quantile = P2Quantile(0.5)
+        assert quantile.value() is None
+        for value in [4, 1, 3, 2]:
+            quantile.add(value)
+        assert quantile.value() == 2.5
+        assert Summary().to_dict() is None
+
+    def test_summarize_array(self):
+        """Should summarize an array as a Summary of its values would."""
+        values = np.array([4.0, 1.0, 3.0, 2.0])
+        summary = Summary()
+        for value in values:
+            summary.add(value)
+
+        expected = summary.to_dict()
+        stats = summarize_array(values)
+        assert sorted(stats) == sorted(expected)
+        for key in expected:
+            self.assertAlmostEqual(stats[key], expected[key])
+        assert summarize_array(np.zeros(0)) is None
+
+if __name__ == '__main__':
+    unittest.main()
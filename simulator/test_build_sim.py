@@ -4,7 +4,7 @@ import unittest
 import os
 import re
 from .errors import SimBuildError
-from .build_sim import build_sim
+from .build_sim import build_sim, parse_sim, CHUNK_SIZE
 
 class BuildSimTestCase(unittest.TestCase):
     """Tests for simulation builder."""
@@ -15,6 +15,57 @@ class BuildSimTestCase(unittest.TestCase):
         """Run after every test."""
         pass
 
+    def test_every_invalid_node_is_reported(self):
+        """Should report all invalid nodes, not just the first."""
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        path = '%s/test_simulations/invalid/several-invalid-nodes.xml' % \
+            dir_path
+        with open(path, 'r') as xml_file:
+            with self.assertRaises(SimBuildError) as context:
+                build_sim(xml_file.read())
+
+        errors = context.exception.errors
+        assert sorted((error.node_type, error.node_id) for error in errors) \
+            == [('exit', '4'), ('source', '3')]
+
+    def test_decision_chain_without_exit(self):
+        """Should reject long chains of decisions in linear time."""
+        with self.assertRaises(SimBuildError) as context:
+            build_sim(decision_chain_xml(100))
+
+        assert [error.node_id for error in context.exception.errors] == ['s']
+
+    def test_large_boards_are_chunked(self):
+        """Should parse boards spanning many chunks of XML."""
+        xml = decision_chain_xml(1000)
+        assert len(xml) > 3 * CHUNK_SIZE
+
+        nodes, node_ids, edges, _ = parse_sim(xml)
+        assert len(nodes) == 1003
+        assert len(node_ids['decision']) == 1000
+        assert edges['e999-down'] == {
+            'source': 'd999', 'target': 'p', 'exit_x': None, 'exit_y': '1'}
+        assert nodes['d0']['outbound_edges'] == ['e0-up', 'e0-down']
+
+def decision_chain_xml(length):
+    """Return a board where a Source feeds `length` Decisions, each of whose
+    branches both lead to the next, and the last Decision to a dead end."""
+    cells = ['<mxCell id="0"/>', '<mxCell id="1" parent="0"/>']
+    node = '<mxCell id="%s" style="shape=%s;" vertex="1" parent="1"/>'
+    edge = '<mxCell id="%s" style="exitY=%s;" edge="1" parent="1" ' \
+        'source="%s" target="%s"/>'
+    cells.append(node % ('s', 'source'))
+    cells.append(node % ('x', 'exit'))
+    cells.append(node % ('p', 'process'))
+    cells.append(edge % ('e-s', 0.5, 's', 'd0'))
+    cells.append(edge % ('e-p', 0.5, 'p', 'p'))
+    for index in range(length):
+        target = 'd%d' % (index + 1) if index + 1 < length else 'p'
+        cells.append(node % ('d%d' % index, 'decision'))
+        cells.append(edge % ('e%d-up' % index, 0, 'd%d' % index, target))
+        cells.append(edge % ('e%d-down' % index, 1, 'd%d' % index, target))
+    return '<mxGraphModel><root>%s</root></mxGraphModel>' % ''.join(cells)
+
 def assert_build_fails(xml):
     """Assert that parsing a given XML string fails."""
     build_failed = False
@@ -0,0 +1,142 @@
+"""Test that every execution engine produces the same results"""
+
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from . import Simulation
+from .errors import SimBuildError
+from .ir import SimulationIR, SOURCE, EXIT, PROCESS, DECISION, SEIZE, DELAY, \
+    RELEASE
+from .trace import read_trace
+from .test_simulation import load_sim
+
+def uniform(low, high):
+    """Return the delay spec of an integer uniform delay."""
+    return {'type': 'uniform', 'args': {'min': str(low), 'max': str(high)}}
+
+def contended_ir():
+    """Return an IR whose entities contend for two resources, holding one
+    across several Processes and looping back through a Decision. Integer
+    delays, some of them 0, make many events fall due at the same time."""
+    return SimulationIR(
+        ids=['source', 'seize', 'decision', 'release', 'rework', 'exit'],
+        labels=['Source', 'Seize', 'Decision', 'Release', 'Rework', 'Exit'],
+        types=[SOURCE, PROCESS, DECISION, PROCESS, PROCESS, EXIT],
+        successors=[[1], [2], [3, 4], [5], [2], []],
+        delays=[uniform(1, 3), uniform(1, 4), None, None, uniform(0, 2), None],
+        probabilities=[None, None, 0.3, None, None, None],
+        actions=[0, SEIZE | DELAY, 0, RELEASE, SEIZE | DELAY | RELEASE, 0],
+        resources=[None, 0, None, 0, 1, None],
+        resource_names=['Desk', 'Tools'],
+        capacities=[2, 1])
+
+def independent_ir():
+    """Return an IR without resources whose entities never reach a node at
+    the same time."""
+    return SimulationIR(
+        ids=['source', 'prepare', 'decision', 'inspect', 'done', 'rejected'],
+        labels=['Source', 'Prepare', 'Decision', 'Inspect', 'Done', 'Rejected'],
+        types=[SOURCE, PROCESS, DECISION, PROCESS, EXIT, EXIT],
+        successors=[[1], [2], [4, 3], [5], [], []],
+        delays=[{'type': 'constant', 'args': {'val': '2'}},
+                {'type': 'triangular',
+                 'args': {'min': '1', 'mid': '3', 'max': '8'}},
+                None,
+                {'type': 'exponential', 'args': {'val': '0.5'}},
+                None,
+                None],
+        probabilities=[None, None, 0.4, None, None, None],
+        actions=[0, DELAY, 0, DELAY, 0, 0],
+        resources=[None] * 6,
+        resource_names=[],
+        capacities=[])
+
+class EnginesTestCase(unittest.TestCase):
+    """Tests comparing the execution engines."""
+
+    def assert_conforms(self, sim_ir, params, engines=('simpy', 'heap')):
+        """Assert the engines produce the same statistics."""
+        results = []
+        for engine in engines:
+            params = dict(params, engine=engine)
+            results.append(Simulation(sim_ir, params).run_replication())
+        assert results[0] == results[1]
+
+    def test_fixtures_conform(self):
+        """Should produce the same statistics for the test simulations."""
+        for name in ['source-to-seize-delay-release-to-exit',
+                     'source-to-process-to-decision-to-exits']:
+            sim_ir = load_sim(name)
+            for seed in range(3):
+                for statistics in ['full', 'summary']:
+                    self.assert_conforms(sim_ir, {
+                        'horizon': 2000,
+                        'seed': seed,
+                        'statistics': statistics,
+                    })
+
+    def test_contention_conforms(self):
+        """Should seize and release resources in the same order."""
+        sim_ir = contended_ir()
+        for seed in range(5):
+            self.assert_conforms(sim_ir, {'horizon': 500, 'seed': seed})
+
+    def test_traces_conform(self):
+        """Should record the same events in the same order."""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            traces = []
+            for engine in ['simpy', 'heap']:
+                path = '%s/%s' % (tmp_dir, engine)
+                Simulation(contended_ir(), {'horizon': 200, 'engine': engine},
+                           trace=path).run()
+                traces.append(read_trace('%s/replication-0' % path))
+
+            assert len(traces[0]) > 0
+            for column in ['entity', 'node', 'kind', 'time']:
+                assert np.array_equal(getattr(traces[0], column),
+                                      getattr(traces[1], column))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_vector_conforms(self):
+        """Should produce the same statistics without events when entities
+        never arrive together."""
+        self.assert_conforms(independent_ir(), {'horizon': 2000},
+                             engines=('heap', 'vector'))
+
+        # Summaries differ only in their quantiles, which are exact
+        params = {'horizon': 2000, 'statistics': 'summary'}
+        heap = Simulation(independent_ir(), dict(params, engine='heap'))
+        vector = Simulation(independent_ir(), dict(params, engine='vector'))
+        heap, vector = heap.run_replication(), vector.run_replication()
+        assert heap['entities']['count'] == vector['entities']['count']
+        for key in ['mean', 'std', 'min', 'max']:
+            self.assertAlmostEqual(heap['entities']['lifespan'][key],
+                                   vector['entities']['lifespan'][key])
+
+    def test_vector_statistics(self):
+        """Should agree with the event engines on average."""
+        sim_ir = load_sim('source-to-process-to-decision-to-exits')
+        params = {'horizon': 100000, 'statistics': 'summary'}
+        heap = Simulation(
+            sim_ir, dict(params, engine='heap')).run_replication()
+        vector = Simulation(
+            sim_ir, dict(params, engine='vector')).run_replication()
+        for node_id, node_stats in heap['nodes'].items():
+            visits = node_stats['visited_count']
+            assert abs(vector['nodes'][node_id]['visited_count'] - visits) \
+                <= 0.05 * visits
+        self.assertAlmostEqual(heap['entities']['lifespan']['mean'],
+                               vector['entities']['lifespan']['mean'], 1)
+
+    def test_auto_engine(self):
+        """Should only pick the vector engine for boards without resources."""
+        for sim_ir, engine in [(contended_ir(), 'simpy'),
+                           (independent_ir(), 'vector')]:
+            self.assert_conforms(sim_ir, {'horizon': 500},
+                                 engines=('auto', engine))
+
+        with self.assertRaises(SimBuildError):
+            Simulation(contended_ir(), {'engine': 'vector'}).run_replication()
@@ -0,0 +1,34 @@
+"""Test the entities which move through a simulation"""
+
+import unittest
+from .entity import Entity, EntityPool
+
+class EntityTestCase(unittest.TestCase):
+    """Tests for entities and their pool."""
+
+    def test_stays(self):
+        """Should record stays in order."""
+        entity = Entity(0)
+        entity.record_stay(3, 1, 2.5)
+        entity.record_stay(5, 2.5, 4)
+        assert list(entity.iter_stays()) == [(3, 1, 2.5), (5, 2.5, 4)]
+
+    def test_pool_recycles_entities(self):
+        """Should hand out released entities again, reset."""
+        pool = EntityPool()
+        entity = pool(0)
+        entity.created_by = '2'
+        entity.visited.append(3)
+        entity.record_stay(3, 0, 1)
+        pool.release(entity)
+
+        recycled = pool(1)
+        assert recycled is entity
+        assert recycled.id == 1
+        assert recycled.created_by is None
+        assert len(recycled.visited) == 0
+        assert list(recycled.iter_stays()) == []
+        assert pool(2) is not entity
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Test compiling simulations into IR"""
+
+import os
+import unittest
+from .build_sim import build_sim
+from .errors import SimBuildError
+from .ir import (SimulationIR, SOURCE, EXIT, PROCESS, DECISION, SEIZE, DELAY,
+                 RELEASE)
+from .test_simulation import load_sim
+
+class IRTestCase(unittest.TestCase):
+    """Tests for the compiled simulation IR."""
+
+    def test_compile(self):
+        """Should number nodes and resolve successors and resources."""
+        sim_ir = load_sim('source-to-seize-delay-release-to-exit')
+        number = sim_ir.index
+
+        assert sim_ir.types[number['2']] == SOURCE
+        assert sim_ir.types[number['4']] == EXIT
+        assert sim_ir.types[number['3']] == PROCESS
+        assert sim_ir.successors[number['2']] == [number['3']]
+        assert sim_ir.actions[number['3']] == SEIZE | DELAY | RELEASE
+        assert sim_ir.resource_names[sim_ir.resources[number['3']]] == 'Cashier'
+        assert sim_ir.capacities == [1]
+
+    def test_decision_branches(self):
+        """Should list a Decision's up branch before its down branch."""
+        sim_ir = load_sim('source-to-process-to-decision-to-exits')
+        number = sim_ir.index
+        assert sim_ir.types[number['4']] == DECISION
+        assert sim_ir.successors[number['4']] == [number['5'], number['6']]
+        assert sim_ir.probabilities[number['4']] == 0.4
+
+    def test_invalid_probabilities(self):
+        """Should reject Decision probabilities outside 0 to 1."""
+        path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            'test_simulations/valid/source-to-process-to-decision-to-exits.xml')
+        with open(path, 'r') as xml_file:
+            xml = xml_file.read()
+
+        for probability in ['-0.1', '1.5', 'nan', 'inf']:
+            with self.assertRaises(SimBuildError):
+                build_sim(xml.replace(
+                    'decision="0.4"', 'decision="%s"' % probability))
+
+    def test_round_trip(self):
+        """Should serialize to JSON and back without changes."""
+        sim_ir = load_sim('source-to-process-to-decision-to-exits')
+        loaded = SimulationIR.from_json(sim_ir.to_json())
+        assert loaded.to_dict() == sim_ir.to_dict()
+        assert loaded.digest() == sim_ir.digest()
+
+        encoded = sim_ir.to_json().replace('"version":1', '"version":0')
+        assert SimulationIR.from_json(encoded) is None
+
+if __name__ == '__main__':
+    unittest.main()
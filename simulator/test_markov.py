@@ -0,0 +1,59 @@
+"""Test estimating statistics from the Markov chain of a simulation"""
+
+import unittest
+from . import Simulation
+from .errors import SimBuildError
+from .markov import strongly_connected_components, estimate
+from .test_engines import contended_ir
+from .test_simulation import load_sim
+
+class MarkovTestCase(unittest.TestCase):
+    """Tests for the estimate statistics mode."""
+
+    def test_components(self):
+        """Should group loops together and order components topologically."""
+        components = strongly_connected_components(
+            [[1], [2], [1, 3], [], [0]])
+        assert [sorted(component) for component in components] == \
+            [[4], [0], [1, 2], [3]]
+
+    def test_long_chain(self):
+        """Should not recurse once per node."""
+        count = 50000
+        successors = [[number + 1] for number in range(count - 1)] + [[]]
+        assert len(strongly_connected_components(successors)) == count
+
+    def test_estimate(self):
+        """Should compute expected visits, exit split and lifespan."""
+        sim_ir = load_sim('source-to-process-to-decision-to-exits')
+        statistics = Simulation(
+            sim_ir, {'horizon': 1000, 'statistics': 'estimate'}).run()
+
+        # Uniform delays of 5 to 15 between entities, then a 40% chance of a
+        # 5 second inspection after a triangular(1, 3, 8) preparation
+        created = 1 + 1000 / 10.0
+        self.assertAlmostEqual(statistics['entities']['count'], created)
+        self.assertAlmostEqual(statistics['exits']['7'], 0.4)
+        self.assertAlmostEqual(statistics['nodes']['6']['visited_count'],
+                               0.4 * created)
+        self.assertAlmostEqual(statistics['entities']['lifespan']['mean'],
+                               4 + 0.4 * 5)
+
+    def test_loops(self):
+        """Should count every pass around a loop."""
+        statistics = estimate(contended_ir(), 1000)
+        created = statistics['entities']['count']
+        # Entities return to the Decision with probability 0.3
+        self.assertAlmostEqual(
+            statistics['nodes']['decision']['visited_count'], created / 0.7)
+        self.assertAlmostEqual(statistics['exits']['exit'], 1)
+
+    def test_inescapable_loop(self):
+        """Should reject loops entities never leave."""
+        sim_ir = contended_ir()
+        sim_ir.probabilities[sim_ir.index['decision']] = 1.0
+        with self.assertRaises(SimBuildError):
+            estimate(sim_ir, 1000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Test timing the phases of a run and counting its events"""
+
+import unittest
+import os
+from . import Simulation
+from .build_sim import build_sim
+from .metrics import Metrics
+from .test_engines import contended_ir, independent_ir
+
+SIM_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    'test_simulations/valid/source-to-process-to-decision-to-exits.xml')
+
+class MetricsTestCase(unittest.TestCase):
+    """Tests for Metrics."""
+
+    def test_phases_add_up(self):
+        """Should add up the time spent in each phase, and merge."""
+        metrics = Metrics()
+        for _ in range(2):
+            with metrics.phase('run'):
+                pass
+        metrics.count('events', 10)
+        other = Metrics()
+        with other.phase('build'):
+            pass
+        other.count('events', 5)
+        metrics.merge(other)
+
+        assert sorted(metrics.phases) == ['build', 'run']
+        assert metrics.counts == {'events': 15}
+
+        metrics.phases['run'] = 0.5
+        assert metrics.to_dict()['events_per_second'] == 30
+
+    def test_build_phases(self):
+        """Should time parsing, validating and compiling a board."""
+        metrics = Metrics()
+        with open(SIM_PATH, 'r') as sim_file:
+            build_sim(sim_file.read(), metrics)
+        assert sorted(metrics.phases) == ['compile', 'parse', 'validate']
+
+    def test_engines_count_entities(self):
+        """Should count the same entities whichever engine runs."""
+        for sim_ir, engines in [(contended_ir(), ['simpy', 'heap']),
+                            (independent_ir(), ['simpy', 'heap', 'vector'])]:
+            counts = []
+            for engine in engines:
+                sim = Simulation(sim_ir, {'horizon': 500, 'engine': engine})
+                sim.run()
+                assert sorted(sim.metrics.phases) == ['analyze', 'build', 'run']
+                assert sim.metrics.counts['events'] > 0
+                counts.append(sim.metrics.counts['entities'])
+            assert len(set(counts)) == 1
+
+    def test_replications_are_merged(self):
+        """Should add up the metrics of every replication."""
+        one = Simulation(contended_ir(), {'horizon': 500, 'engine': 'simpy'})
+        one.run()
+        three = Simulation(contended_ir(), {
+            'horizon': 500, 'engine': 'simpy', 'replications': 3}, processes=1)
+        three.run()
+        assert three.metrics.counts['processes'] > \
+            2 * one.metrics.counts['processes']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Test resource monitors"""
+
+import unittest
+from . import Simulation
+from .monitors import ResourceMonitor
+from .test_simulation import load_sim
+
+class MonitorTestCase(unittest.TestCase):
+    """Tests for resource monitors."""
+
+    def test_time_weighted(self):
+        """Should weight busy users and queue length by time."""
+        monitor = ResourceMonitor(1)
+        monitor.requested(0)
+        monitor.seized(0, 0)
+        monitor.requested(2)
+        monitor.released(6)
+        monitor.seized(6, 2)
+        monitor.released(8)
+
+        statistics = monitor.statistics(10)
+        self.assertAlmostEqual(statistics['utilization'], 0.8)
+        self.assertAlmostEqual(statistics['average_queue'], 0.4)
+        assert statistics['max_queue'] == 1
+        assert statistics['seized_count'] == 2
+        self.assertAlmostEqual(statistics['mean_wait'], 2)
+
+    def test_idle_resource(self):
+        """Should report a resource nobody used."""
+        statistics = ResourceMonitor(2).statistics(10)
+        assert statistics['utilization'] == 0
+        assert statistics['mean_wait'] is None
+
+    def test_simulation_resources(self):
+        """Should report each resource of a run."""
+        sim_ir = load_sim('source-to-seize-delay-release-to-exit')
+        statistics = Simulation(sim_ir, {'horizon': 5000}).run()
+
+        cashier = statistics['resources']['Cashier']
+        stays = statistics['nodes']['3']['stay_durations']
+        assert cashier['seized_count'] >= len(stays)
+        assert 0 < cashier['utilization'] <= 1
+
+        # Little's law: queue length = arrival rate * wait
+        self.assertAlmostEqual(
+            cashier['average_queue'],
+            cashier['seized_count'] / 5000.0 * cashier['mean_wait'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Test compiling delays into samplers"""
+
+import unittest
+import numpy as np
+from .errors import SimBuildError
+from .samplers import build_sampler, ProbabilitySampler, BUFFER_SIZE
+
+def draw(delay, count=BUFFER_SIZE * 2 + 1, seed=0):
+    """Draw `count` delays from a freshly compiled sampler."""
+    sampler = build_sampler(delay, np.random.RandomState(seed), '1')
+    return [sampler() for _ in range(count)]
+
+class SamplerTestCase(unittest.TestCase):
+    """Tests for delay samplers."""
+
+    def test_existing_distributions(self):
+        """Should keep the meaning of the original delay types."""
+        assert set(draw({'type': 'constant', 'args': {'val': '5'}})) == {5}
+
+        delays = draw({'type': 'uniform', 'args': {'min': '1', 'max': '4'}})
+        assert set(delays) == {1, 2, 3, 4}
+        assert all(isinstance(delay, int) for delay in delays)
+
+        delays = draw({'type': 'triangular',
+                       'args': {'min': '1', 'mid': '3', 'max': '8'}})
+        assert all(1 <= delay <= 8 for delay in delays)
+
+        delays = draw({'type': 'exponential', 'args': {'val': '4'}}, 10000)
+        self.assertAlmostEqual(np.mean(delays), 0.25, places=1)
+
+    def test_new_distributions(self):
+        """Should draw from distributions added to the registry."""
+        delays = draw({'type': 'normal', 'args': {'mean': '10', 'std': '20'}})
+        assert min(delays) == 0
+
+        delays = draw({'type': 'erlang', 'args': {'k': '3', 'val': '0.5'}},
+                      10000)
+        self.assertAlmostEqual(np.mean(delays), 6, places=0)
+
+        delays = draw({'type': 'empirical',
+                       'args': {'values': '2, 7', 'weights': '0, 1'}})
+        assert set(delays) == {7}
+
+    def test_buffered_draws_are_reproducible(self):
+        """Should hand out the same delays for the same stream."""
+        delay = {'type': 'lognormal', 'args': {'mean': '0', 'std': '1.5'}}
+        assert draw(delay, seed=3) == draw(delay, seed=3)
+        assert draw(delay, seed=3) != draw(delay, seed=4)
+
+    def test_means(self):
+        """Should know the mean of every distribution."""
+        for delay in [{'type': 'constant', 'args': {'val': '3'}},
+                      {'type': 'uniform', 'args': {'min': '1', 'max': '4'}},
+                      {'type': 'triangular',
+                       'args': {'min': '1', 'mid': '2', 'max': '6'}},
+                      {'type': 'exponential', 'args': {'val': '0.5'}},
+                      {'type': 'normal', 'args': {'mean': '1', 'std': '2'}},
+                      {'type': 'lognormal',
+                       'args': {'mean': '0', 'std': '0.5'}},
+                      {'type': 'erlang', 'args': {'k': '3', 'val': '2'}},
+                      {'type': 'empirical',
+                       'args': {'values': '2, 7', 'weights': '3, 1'}}]:
+            sampler = build_sampler(delay, np.random.RandomState(0), '1')
+            self.assertAlmostEqual(
+                sampler.draw(100000).mean(), sampler.mean(), places=1)
+
+        sampler = ProbabilitySampler(np.random.RandomState(0))
+        self.assertAlmostEqual(
+            sampler.draw(100000).mean(), sampler.mean(), places=1)
+
+    def test_invalid_delays(self):
+        """Should reject unknown delay types and bad arguments up front."""
+        for delay in [None,
+                      {'type': 'weibull', 'args': {}},
+                      {'type': 'uniform', 'args': {'min': '1'}},
+                      {'type': 'uniform', 'args': {'min': '5', 'max': '1'}},
+                      {'type': 'exponential', 'args': {'val': '0'}},
+                      {'type': 'constant', 'args': {'val': 'soon'}},
+                      {'type': 'constant', 'args': {'val': 'nan'}},
+                      {'type': 'exponential', 'args': {'val': 'inf'}},
+                      {'type': 'normal', 'args': {'mean': '-inf', 'std': '1'}},
+                      {'type': 'empirical', 'args': {'values': '1, nan'}},
+                      {'type': 'erlang', 'args': {'k': '1.5', 'val': '1'}},
+                      {'type': 'empirical',
+                       'args': {'values': '1, 2', 'weights': '1'}}]:
+            with self.assertRaises(SimBuildError):
+                build_sampler(delay, np.random.RandomState(0), '1')
@@ -0,0 +1,119 @@
+"""Test running simulations"""
+
+import unittest
+import os
+import threading
+from .errors import SimBuildError
+from .build_sim import build_sim
+from .summary import summarize
+from . import Simulation, run_params
+
+def load_sim(name):
+    """Build one of the valid test simulations by name."""
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    path = '%s/test_simulations/valid/%s.xml' % (dir_path, name)
+    with open(path, 'r') as xml_file:
+        return build_sim(xml_file.read())
+
+class SimulationTestCase(unittest.TestCase):
+    """Tests for running simulations."""
+
+    def test_run_params_defaults(self):
+        """Should fill in defaults for missing run parameters."""
+        params = run_params({'horizon': 100})
+        assert params['horizon'] == 100
+        assert params['replications'] == 1
+
+    def test_run_params_are_checked(self):
+        """Should reject unknown or invalid run parameters."""
+        for params in [{'unknown': 1}, {'horizon': -1},
+                       {'horizon': 'inf'}, {'horizon': float('nan')},
+                       {'horizon': 1e300},
+                       {'replications': 0}, {'replications': 1.5},
+                       {'seed': -1}, {'seed': 'abc'},
+                       {'statistics': 'everything'}, {'engine': 'fast'}]:
+            with self.assertRaises(SimBuildError):
+                run_params(params)
+
+    def test_replications_are_summarized(self):
+        """Should combine replications into confidence intervals."""
+        sim_ir = load_sim('source-to-process-to-decision-to-exits')
+        params = {'horizon': 600, 'replications': 3}
+        statistics = Simulation(sim_ir, params, processes=2).run()
+
+        assert statistics['replications'] == 3
+        visits = statistics['nodes']['3']['visited_count']
+        assert visits['n'] == 3
+        assert visits['ci_low'] <= visits['mean'] <= visits['ci_high']
+        self.assertAlmostEqual(
+            statistics['nodes']['6']['stay_length']['mean'], 5)
+        assert statistics['entities']['count']['mean'] > 0
+
+    def test_runs_are_reproducible(self):
+        """Should produce identical statistics from the same seed, and
+        different statistics from different seeds."""
+        sim_ir = load_sim('source-to-seize-delay-release-to-exit')
+
+        def run(seed):
+            """Run the simulation with the given seed."""
+            params = {'horizon': 600, 'seed': seed}
+            return Simulation(sim_ir, params).run()
+
+        assert run(1) == run(1)
+        assert run(1) != run(2)
+
+    def test_summary_statistics(self):
+        """Should report the same counts and means in summary mode as
+        computed from every entity."""
+        sim_ir = load_sim('source-to-process-to-decision-to-exits')
+        full = Simulation(sim_ir, {'horizon': 2000}).run()
+        summary = Simulation(
+            sim_ir, {'horizon': 2000, 'statistics': 'summary'}).run()
+
+        lifespans = [lifespan['length']
+                     for lifespan in full['entities']['lifespans']]
+        assert summary['entities']['count'] == len(lifespans)
+        self.assertAlmostEqual(summary['entities']['lifespan']['mean'],
+                               sum(lifespans) / len(lifespans))
+        assert summary['entities']['lifespan']['max'] == max(lifespans)
+
+        for node_id, node_stats in full['nodes'].items():
+            assert summary['nodes'][node_id]['visited_count'] == \
+                node_stats['visited_count']
+        stays = [stay['length']
+                 for stay in full['nodes']['3']['stay_durations']]
+        assert summary['nodes']['3']['stay_length']['count'] == len(stays)
+
+    def test_concurrent_runs_are_isolated(self):
+        """Should give the same results when simulations with overlapping
+        node ids run concurrently in one process."""
+        sims = [
+            Simulation(load_sim('source-to-seize-delay-release-to-exit'),
+                       params={'horizon': 2000}),
+            Simulation(load_sim('source-to-process-to-decision-to-exits'),
+                       params={'horizon': 2000}),
+        ]
+        expected = [sim.run() for sim in sims]
+
+        results = [None] * len(sims)
+        def run(index):
+            """Run one of the simulations and keep its results."""
+            results[index] = sims[index].run()
+        threads = [threading.Thread(target=run, args=(index,))
+                   for index in range(len(sims))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == expected
+
+    def test_summarize(self):
+        """Should compute the mean, sample deviation and t interval."""
+        summary = summarize([1, 2, 3])
+        assert summary['mean'] == 2
+        assert summary['std'] == 1
+        assert abs(summary['ci_high'] - (2 + 4.303 / 3 ** 0.5)) < 1e-9
+
+if __name__ == '__main__':
+    unittest.main()
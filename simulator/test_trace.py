@@ -0,0 +1,66 @@
+"""Test columnar event traces"""
+
+import unittest
+import mmap
+import shutil
+import tempfile
+import numpy as np
+from . import Simulation
+from .entity import Entity
+from .trace import (TraceWriter, read_trace, CREATED, ARRIVED, DEPARTED,
+                    EXITED)
+from .test_simulation import load_sim
+
+class TraceTestCase(unittest.TestCase):
+    """Tests for writing and reading traces."""
+
+    def setUp(self):
+        """Run before every test."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Run after every test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_trace_matches_statistics(self):
+        """Should record an event for every creation, visit and departure."""
+        sim_ir = load_sim('source-to-process-to-decision-to-exits')
+        statistics = Simulation(
+            sim_ir, {'horizon': 2000}, trace=self.tmp_dir).run()
+        trace = read_trace('%s/replication-0' % self.tmp_dir)
+
+        assert isinstance(trace.time, np.memmap)
+        assert trace.nodes == sim_ir.ids
+        exited = trace.entity[trace.kind == EXITED]
+        assert len(exited) == len(statistics['entities']['lifespans'])
+        assert len(np.unique(exited)) == len(exited)
+
+        # Stays at the Process match the statistics
+        prepare = sim_ir.index['3']
+        at_prepare = trace.node == prepare
+        arrivals = trace.time[at_prepare & (trace.kind == ARRIVED)]
+        departures = trace.time[at_prepare & (trace.kind == DEPARTED)]
+        stays = statistics['nodes']['3']['stay_durations']
+        assert len(departures) >= len(stays)
+        assert (np.diff(trace.time) >= 0).all()
+        assert len(arrivals) >= len(departures)
+
+    def test_records_span_chunks(self):
+        """Should write and read back records across many chunks."""
+        count = 3 * mmap.ALLOCATIONGRANULARITY + 5
+        writer = TraceWriter(self.tmp_dir, ['2', '3'],
+                             chunk_records=mmap.ALLOCATIONGRANULARITY)
+        entity = Entity(0)
+        writer.record(entity, 0, CREATED, 0.0)
+        for index in range(1, count):
+            writer.record(entity, 1, ARRIVED, index * 0.5)
+        writer.close()
+
+        trace = read_trace(self.tmp_dir)
+        assert len(trace) == count
+        assert trace.time[-1] == (count - 1) * 0.5
+        assert (trace.entity == 0).all()
+        assert trace.kind[0] == CREATED and (trace.kind[1:] == ARRIVED).all()
+
+if __name__ == '__main__':
+    unittest.main()
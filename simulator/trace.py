@@ -0,0 +1,150 @@
+"""Record every event of a run to a columnar trace on disk
+
+A trace is a directory holding one raw binary file per column and a
+`meta.json` describing them:
+
+    entity.bin: int64 number of the entity, unique within the run
+    node.bin: int32 number of the node (see simulator.ir)
+    kind.bin: uint8 index of the event's kind in KINDS
+    time.bin: float64 simulation time of the event
+
+Records are buffered in memory only `chunk_records` at a time, then written
+through a memory-mapped window onto the end of each column. Traces can
+therefore be far larger than the process's heap. `read_trace` maps the
+columns back in without copying them, ready for vectorized analysis with
+NumPy.
+"""
+
+import json
+import mmap
+import os
+import numpy as np
+
+# Kinds of events
+CREATED = 0
+ARRIVED = 1
+SEIZED = 2
+DEPARTED = 3
+VISITED = 4
+EXITED = 5
+KINDS = ['created', 'arrived', 'seized', 'departed', 'visited', 'exited']
+
+COLUMNS = [
+    ('entity', '<i8'),
+    ('node', '<i4'),
+    ('kind', '|u1'),
+    ('time', '<f8'),
+]
+
+TRACE_VERSION = 1
+
+# A multiple of the mmap allocation granularity on every platform, so each
+# chunk's window starts on a valid offset
+DEFAULT_CHUNK_RECORDS = 64 * 1024
+
+class TraceWriter(object):
+    """Append events to a trace in `path`, which is created if needed.
+
+    `record` is given to each node of the run. Call `close` once the run is
+    over to write the last records and the metadata.
+    """
+    def __init__(self, path, node_ids, chunk_records=DEFAULT_CHUNK_RECORDS):
+        if chunk_records % mmap.ALLOCATIONGRANULARITY:
+            raise ValueError('chunk_records must be a multiple of %d' %
+                             mmap.ALLOCATIONGRANULARITY)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.node_ids = list(node_ids)
+        self.chunk_records = chunk_records
+        self.files = [open(os.path.join(path, '%s.bin' % name), 'w+b')
+                      for name, _ in COLUMNS]
+        self.buffers = [[] for _ in COLUMNS]
+        self.count = 0
+        self.entities = 0
+
+    def record(self, entity, node, kind, time):
+        """Append an event. Entities are numbered as they are created."""
+        if kind == CREATED:
+            entity.trace_id = self.entities
+            self.entities += 1
+
+        entities, nodes, kinds, times = self.buffers
+        entities.append(entity.trace_id)
+        nodes.append(node)
+        kinds.append(kind)
+        times.append(time)
+        if len(times) == self.chunk_records:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the end of each column."""
+        records = len(self.buffers[0])
+        if not records:
+            return
+
+        for trace_file, (_, dtype), buffer in zip(
+                self.files, COLUMNS, self.buffers):
+            itemsize = np.dtype(dtype).itemsize
+            offset = self.count * itemsize
+            length = records * itemsize
+            trace_file.truncate(offset + length)
+            window = mmap.mmap(trace_file.fileno(), length, offset=offset)
+            try:
+                column = np.frombuffer(window, dtype=dtype)
+                column[:] = buffer
+                del column
+                window.flush()
+            finally:
+                window.close()
+            del buffer[:]
+
+        self.count += records
+
+    def close(self):
+        """Write any remaining records and the trace's metadata."""
+        self.flush()
+        for trace_file in self.files:
+            trace_file.close()
+
+        meta = {
+            'version': TRACE_VERSION,
+            'count': self.count,
+            'columns': dict(COLUMNS),
+            'kinds': KINDS,
+            'nodes': self.node_ids,
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+class Trace(object):
+    """A trace loaded by `read_trace`.
+
+    `entity`, `node`, `kind` and `time` are read-only arrays mapped from the
+    trace's files. `nodes` lists node ids by number and `kinds` event kinds by
+    index.
+    """
+    def __init__(self, columns, nodes, kinds):
+        for name, column in columns.items():
+            setattr(self, name, column)
+        self.nodes = nodes
+        self.kinds = kinds
+
+    def __len__(self):
+        return len(self.time)
+
+def read_trace(path):
+    """Map the columns of the trace in `path` into memory."""
+    with open(os.path.join(path, 'meta.json'), 'r') as meta_file:
+        meta = json.load(meta_file)
+    if meta['version'] != TRACE_VERSION:
+        raise ValueError('Unsupported trace version %r' % meta['version'])
+
+    columns = {}
+    for name, dtype in meta['columns'].items():
+        if meta['count'] == 0:
+            columns[name] = np.zeros(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(
+                os.path.join(path, '%s.bin' % name), dtype=dtype, mode='r',
+                shape=(meta['count'],))
+    return Trace(columns, meta['nodes'], meta['kinds'])
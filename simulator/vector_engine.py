@@ -0,0 +1,269 @@
+"""Run a compiled simulation of independent entities with NumPy arrays
+
+When no Process seizes or releases a resource, entities never wait for one
+another, so each entity's path and timings depend only on its own draws. The
+'vector' engine takes advantage of this: rather than stepping through events
+it moves every entity waiting at a node through it at once.
+
+Each Source's creation times are the running sum of a batch of its delays,
+cut off at the horizon. Each Process draws a delay for every entity in its
+batch, each Decision draws every entity's branch, and entities which would
+move on at or after the horizon are dropped, since the event engines never
+see them leave. Boards with loops just take a few more rounds.
+
+Each node draws from the same random stream as in the event engines and
+hands out its draws in the order entities arrive, so boards whose entities
+never arrive at a node at the same time, or overtake one another on a loop,
+give the same results as the event engines for the same seed. Others give
+statistically equivalent ones.
+
+Statistics are computed from arrays too, in the same form as
+`Simulation.analyze_simulation` and `SummaryCollector.statistics` return.
+
+Without events to count, each entity created or moved through a node counts
+as an event in the run's metrics.
+"""
+
+import numpy as np
+from simulator.accumulators import summarize_array
+from simulator.errors import SimBuildError
+from simulator.metrics import Metrics
+from simulator.ir import (SOURCE, EXIT, PROCESS, DECISION, SEIZE, DELAY,
+                          RELEASE, NODE_TYPES)
+from simulator.samplers import build_sampler, ProbabilitySampler
+
+# How many delays a Source draws at first, before it knows roughly how many
+# it needs
+FIRST_BATCH = 1024
+
+def is_vectorizable(sim_ir):
+    """Return whether the vector engine can run `sim_ir`, i.e. whether no
+    Process seizes or releases a resource."""
+    return not any(code == PROCESS and action & (SEIZE | RELEASE)
+                   for code, action in zip(sim_ir.types, sim_ir.actions))
+
+def creation_times(sampler, horizon, node_id):
+    """Return the times before `horizon` at which a Source creates entities.
+
+    Times are summed one delay at a time, as the event engines add them.
+    """
+    batches = [np.zeros(1)]
+    last = 0.0
+    size = FIRST_BATCH
+    while last < horizon:
+        delays = sampler.draw(size)
+        if not delays.any():
+            raise SimBuildError(
+                'Source %s creates entities without any delay.' % node_id,
+                node_type='source', node_id=node_id)
+
+        times = np.cumsum(np.concatenate(([last], delays)))[1:]
+        mean_delay = (times[-1] - last) / len(delays)
+        batches.append(times)
+        last = times[-1]
+
+        # Next, draw about as many delays as are left before the horizon
+        size = max(int((horizon - last) / mean_delay * 1.1), FIRST_BATCH)
+
+    times = np.concatenate(batches)
+    return times[times < horizon]
+
+def run_vector(sim_ir, streams, horizon, statistics='full', metrics=None):
+    """Run one replication of the runnable, vectorizable SimulationIR `sim_ir`
+    until `horizon`, drawing from the replication's family of random
+    `streams`, and return its statistics in the given statistics mode.
+
+    Given `metrics` (see simulator.metrics), the time spent building,
+    running and analyzing the replication is added to them.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.phase('build'):
+        samplers = build_samplers(sim_ir, streams)
+    with metrics.phase('run'):
+        moves, moved = move_entities(sim_ir, samplers, horizon)
+    metrics.count('entities', len(moves[0]))
+    metrics.count('events', moved)
+    with metrics.phase('analyze'):
+        return analyze_moves(sim_ir, statistics, *moves)
+
+def build_samplers(sim_ir, streams):
+    """Return the sampler of each node which draws delays or branches."""
+    count = len(sim_ir)
+    samplers = [None] * count
+    for number, node_id in enumerate(sim_ir.ids):
+        node_type = sim_ir.types[number]
+        if node_type == SOURCE or (
+                node_type == PROCESS and sim_ir.actions[number] & DELAY):
+            samplers[number] = build_sampler(
+                sim_ir.delays[number], streams.stream(node_id), node_id)
+        elif node_type == DECISION:
+            samplers[number] = ProbabilitySampler(streams.stream(node_id))
+    return samplers
+
+def move_entities(sim_ir, samplers, horizon):
+    """Move every entity through the board until `horizon`.
+
+    Returns when and by which node each entity was created, when and through
+    which Exit it departed (-1 if it didn't), and its visits and stays as
+    described below, along with the number of moves made.
+    """
+    count = len(sim_ir)
+    # Entities are numbered across all Sources. Batches of (entity numbers,
+    # arrival times) wait at each node until its next round.
+    waiting = [[] for _ in range(count)]
+    created_at = []
+    created_by = []
+    entities = 0
+    for number in sim_ir.nodes_of_type(SOURCE):
+        times = creation_times(samplers[number], horizon, sim_ir.ids[number])
+        created = np.arange(entities, entities + len(times))
+        created_at.append(times)
+        created_by.append(np.full(len(times), number, dtype=int))
+        waiting[sim_ir.successors[number][0]].append((created, times))
+        entities += len(times)
+    moved = entities
+
+    created_at = np.concatenate(created_at) if created_at else np.zeros(0)
+    created_by = np.concatenate(created_by) if created_by else \
+        np.zeros(0, dtype=int)
+    departed_at = np.zeros(entities)
+    departed_through = np.full(entities, -1, dtype=int)
+
+    # (node number, entity numbers) for visits to Processes and Decisions, and
+    # (node number, entity numbers, arrived at, departed at) for stays
+    visits = []
+    stays = []
+
+    def send(number, moving, times):
+        """Send entities on to the node `number`, if they get there in time."""
+        in_time = times < horizon
+        if in_time.any():
+            waiting[number].append((moving[in_time], times[in_time]))
+
+    while any(waiting):
+        for number in range(count):
+            if not waiting[number]:
+                continue
+            batches, waiting[number] = waiting[number], []
+            moving = np.concatenate([batch[0] for batch in batches])
+            times = np.concatenate([batch[1] for batch in batches])
+
+            # Hand out draws in the order entities arrive
+            order = np.argsort(times, kind='mergesort')
+            moving = moving[order]
+            times = times[order]
+            moved += len(moving)
+
+            node_type = sim_ir.types[number]
+            successors = sim_ir.successors[number]
+            if node_type == EXIT:
+                departed_at[moving] = times
+                departed_through[moving] = number
+            elif node_type == DECISION:
+                visits.append((number, moving))
+                going_up = samplers[number].draw(len(moving)) > \
+                    sim_ir.probabilities[number]
+                send(successors[0], moving[going_up], times[going_up])
+                send(successors[1], moving[~going_up], times[~going_up])
+            elif node_type == PROCESS:
+                visits.append((number, moving))
+                departures = times
+                if samplers[number] is not None:
+                    departures = times + samplers[number].draw(len(moving))
+                stays.append((number, moving, times, departures))
+                send(successors[0], moving, departures)
+
+    return (created_at, created_by, departed_at, departed_through, visits,
+            stays), moved
+
+def analyze_moves(sim_ir, statistics, created_at, created_by, departed_at,
+                  departed_through, visits, stays):
+    """Return the statistics of the moves made by `move_entities` in the
+    given statistics mode."""
+    count = len(sim_ir)
+    departed = departed_through >= 0
+
+    # Only entities which departed are counted, as in the event engines
+    visited_counts = np.bincount(created_by[departed], minlength=count) + \
+        np.bincount(departed_through[departed], minlength=count)
+    for number, moving in visits:
+        visited_counts[number] += np.count_nonzero(departed[moving])
+
+    node_stats = {}
+    for number, node_id in enumerate(sim_ir.ids):
+        if visited_counts[number]:
+            node_stats[node_id] = {
+                'label': sim_ir.labels[number],
+                'type': NODE_TYPES[sim_ir.types[number]],
+                'visited_count': int(visited_counts[number]),
+            }
+
+    if statistics == 'summary':
+        return summary_statistics(
+            sim_ir, node_stats, departed, created_at, departed_at, stays)
+    return full_statistics(
+        sim_ir, node_stats, departed, created_at, departed_at, departed_through,
+        stays)
+
+def summary_statistics(sim_ir, node_stats, departed, created_at, departed_at,
+                       stays):
+    """Return statistics in the form `SummaryCollector.statistics` does."""
+    stay_lengths = {}
+    for number, moving, arrived, departures in stays:
+        counted = departed[moving]
+        stay_lengths.setdefault(number, []).append(
+            departures[counted] - arrived[counted])
+    for number, lengths in stay_lengths.items():
+        lengths = np.concatenate(lengths)
+        if len(lengths):
+            node_stats[sim_ir.ids[number]]['stay_length'] = \
+                summarize_array(lengths)
+
+    lifespans = departed_at[departed] - created_at[departed]
+    entity_stats = {'count': len(lifespans)}
+    if len(lifespans):
+        entity_stats['lifespan'] = summarize_array(lifespans)
+
+    return {
+        'nodes': node_stats,
+        'entities': entity_stats,
+    }
+
+def full_statistics(sim_ir, node_stats, departed, created_at, departed_at,
+                    departed_through, stays):
+    """Return statistics in the form `Simulation.analyze_simulation` does,
+    listing entities by Exit, then in the order they departed."""
+    counted = np.flatnonzero(departed)
+    counted = counted[np.lexsort((
+        counted, departed_at[counted], departed_through[counted]))]
+    rank = np.zeros(len(departed), dtype=int)
+    rank[counted] = np.arange(len(counted))
+
+    stay_durations = {}
+    for number, moving, arrived, departures in stays:
+        kept = departed[moving]
+        stay_durations.setdefault(number, []).append(
+            (rank[moving[kept]], arrived[kept], departures[kept]))
+    for number, batches in stay_durations.items():
+        ranks, arrived, departures = [
+            np.concatenate(column) for column in zip(*batches)]
+        if not len(ranks):
+            continue
+        order = np.lexsort((arrived, ranks))
+        node_stats[sim_ir.ids[number]]['stay_durations'] = [
+            {'from': start, 'to': end, 'length': end - start}
+            for start, end in zip(arrived[order].tolist(),
+                                  departures[order].tolist())]
+
+    entity_stats = {}
+    if len(counted):
+        entity_stats['lifespans'] = [
+            {'created_at': start, 'departed_at': end, 'length': end - start}
+            for start, end in zip(created_at[counted].tolist(),
+                                  departed_at[counted].tolist())]
+
+    return {
+        'nodes': node_stats,
+        'entities': entity_stats,
+    }
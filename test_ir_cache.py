@@ -0,0 +1,57 @@
+"""Test the compiled simulation cache."""
+
+import unittest
+import os
+import shutil
+import tempfile
+import setup_db
+from counters import get_counters
+from ir_cache import IRCache, HITS, MISSES
+
+SIM_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    'simulator/test_simulations/valid',
+    'source-to-seize-delay-release-to-exit.xml')
+
+class IRCacheTestCase(unittest.TestCase):
+    """Tests for the IR cache."""
+
+    def setUp(self):
+        """Run before every test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.tmp_dir, 'simulations.db')
+        setup_db.init_db(db_path)
+        self.conn = setup_db.connect_db(db_path, autocommit=True)
+        with open(SIM_PATH, 'r') as xml_file:
+            self.xml = xml_file.read()
+
+    def tearDown(self):
+        """Run after every test."""
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_boards_are_compiled_once(self):
+        """Should serve a board built before from the cache."""
+        cache = IRCache(self.conn)
+        first = cache.build(self.xml)
+        second = cache.build(self.xml)
+
+        assert first.to_dict() == second.to_dict()
+        assert get_counters(self.conn, [HITS, MISSES]) == {
+            HITS: 1, MISSES: 1}
+
+    def test_least_recently_used_are_evicted(self):
+        """Should keep only the most recently used boards."""
+        cache = IRCache(self.conn, max_entries=2)
+        boards = [self.xml.replace('label="Source"', 'label="Source %d"' % i)
+                  for i in range(3)]
+        for board in boards:
+            cache.build(board)
+
+        count = self.conn.execute('SELECT COUNT(*) FROM ir_cache').fetchone()
+        assert count[0] == 2
+        assert cache.build(boards[0]).labels != cache.build(boards[2]).labels
+        assert get_counters(self.conn, [MISSES])[MISSES] == 4
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Test the metrics stored for each job."""
+
+import unittest
+import os
+import shutil
+import tempfile
+import setup_db
+import job_metrics
+from simulator.metrics import Metrics
+
+class JobMetricsTestCase(unittest.TestCase):
+    """Tests for job metrics and their Prometheus exposition."""
+
+    def setUp(self):
+        """Run before every test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.tmp_dir, 'simulations.db')
+        setup_db.init_db(db_path)
+        self.conn = setup_db.connect_db(db_path)
+
+    def tearDown(self):
+        """Run after every test."""
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def samples(self):
+        """Return the reported value of each metric."""
+        samples = {}
+        for line in job_metrics.prometheus_metrics(self.conn).splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_histograms_are_cumulative(self):
+        """Should count each job in its bucket and every bucket above it."""
+        for job_id, runtime in enumerate([0.2, 0.3, 7, 1000]):
+            job_metrics.record_job(
+                self.conn, job_id, 'user', job_id != 3, runtime, Metrics())
+
+        samples = self.samples()
+        assert samples['sim_jobs_completed_total'] == 3
+        assert samples['sim_jobs_failed_total'] == 1
+        name = 'sim_job_runtime_seconds_bucket{le="%s"}'
+        assert samples[name % 0.1] == 0
+        assert samples[name % 0.5] == 2
+        assert samples[name % 10] == 3
+        assert samples[name % 300] == 3
+        assert samples[name % '+Inf'] == 4
+        assert samples['sim_job_runtime_seconds_count'] == 4
+        self.assertAlmostEqual(samples['sim_job_runtime_seconds_sum'], 1007.5)
+
+    def test_old_jobs_are_pruned(self):
+        """Should delete the metrics of jobs past their retention, through
+        the index on finished_at, but keep counting them."""
+        job_metrics.record_job(self.conn, 1, 'user', True, 1, Metrics())
+        self.conn.execute(
+            'UPDATE job_metrics SET finished_at = finished_at - 100')
+
+        traced = []
+        self.conn.set_trace_callback(traced.append)
+        job_metrics.record_job(
+            self.conn, 2, 'user', True, 1, Metrics(), retention=50)
+        self.conn.set_trace_callback(None)
+
+        assert job_metrics.get_job_metrics(self.conn, 1) is None
+        assert job_metrics.get_job_metrics(self.conn, 2) is not None
+        assert self.samples()['sim_jobs_completed_total'] == 2
+        plan = self.conn.execute(
+            'EXPLAIN QUERY PLAN ' + traced[0]).fetchall()
+        assert 'job_metrics_finished_at' in plan[0][-1]
+
+    def test_queue_is_read_from_indexes(self):
+        """Should never scan the simulations table."""
+        self.conn.execute(
+            'INSERT INTO simulations(simulation, user_id) VALUES (?, ?)',
+            ('<xml/>', 'user'))
+        queue = job_metrics.queue_statistics(self.conn)
+        assert queue['queued'] == 1 and queue['running'] == 0
+
+        traced = []
+        self.conn.set_trace_callback(traced.append)
+        job_metrics.prometheus_metrics(self.conn)
+        self.conn.set_trace_callback(None)
+        for statement in traced:
+            plan = self.conn.execute(
+                'EXPLAIN QUERY PLAN ' + statement).fetchall()
+            for row in plan:
+                assert 'INDEX' in row[-1], row[-1]
+
+if __name__ == '__main__':
+    unittest.main()
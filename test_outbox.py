@@ -0,0 +1,146 @@
+"""Test delivery of results from the outbox."""
+
+import unittest
+import configparser
+import os
+import shutil
+import tempfile
+import requests
+import outbox
+import setup_db
+from job_metrics import record_job, get_job_metrics
+from simulator.metrics import Metrics
+
+class FakeResponse(object):
+    """Stand-in for a `requests` response."""
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        """Return the decoded body."""
+        if self.body is None:
+            raise ValueError('No JSON body')
+        return self.body
+
+class FakeSession(object):
+    """Stand-in for a `requests.Session` which replays canned outcomes."""
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.posted = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        """Record the post and return (or raise) the next outcome."""
+        self.posted.append((url, data, timeout))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if isinstance(outcome, FakeResponse):
+            return outcome
+        return FakeResponse(outcome)
+
+class OutboxTestCase(unittest.TestCase):
+    """Tests for the outbox."""
+
+    def setUp(self):
+        """Run before every test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.tmp_dir, 'simulations.db')
+        setup_db.init_db(db_path)
+        self.conn = setup_db.connect_db(db_path)
+        self.settings = outbox.load_settings(configparser.ConfigParser())
+
+    def tearDown(self):
+        """Run after every test."""
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def pending(self):
+        """Return (status, attempts) of every result in the outbox."""
+        return self.conn.execute(
+            'SELECT status, attempts FROM outbox ORDER BY id').fetchall()
+
+    def test_delivered_results_are_removed(self):
+        """Should remove a result once it has been delivered."""
+        outbox.enqueue_result(self.conn, 'url', '{}')
+        session = FakeSession([200])
+
+        delivered = outbox.deliver_due_results(
+            self.conn, session, self.settings)
+
+        assert delivered == 1
+        assert session.posted[0][:2] == ('url', '{}')
+        assert self.pending() == []
+
+    def test_deliveries_are_recorded(self):
+        """Should record when a job's result was delivered."""
+        record_job(self.conn, 7, 'user', True, 1.0, Metrics())
+        outbox.enqueue_result(self.conn, 'url', '{}', job_id=7)
+        outbox.enqueue_result(self.conn, 'url', '{}')
+
+        outbox.deliver_due_results(self.conn, FakeSession([200, 200]),
+                                   self.settings)
+
+        job = get_job_metrics(self.conn, 7)
+        assert job['delivered_at'] is not None
+        assert job['delivery_seconds'] >= 0
+
+    def test_failures_are_retried(self):
+        """Should keep a failed result and back off before retrying it."""
+        outbox.enqueue_result(self.conn, 'url', '{}')
+        session = FakeSession([requests.ConnectionError('down')])
+
+        outbox.deliver_due_results(self.conn, session, self.settings)
+
+        assert self.pending() == [('pending', 1)]
+        assert outbox.get_due_results(self.conn, 10) == []
+
+    def test_results_fail_after_max_attempts(self):
+        """Should give up on a result after the maximum number of attempts."""
+        self.settings['max_attempts'] = 1
+        outbox.enqueue_result(self.conn, 'url', '{}')
+
+        outbox.deliver_due_results(self.conn, FakeSession([500]), self.settings)
+
+        assert self.pending() == [('failed', 1)]
+
+    def test_backoff_is_capped(self):
+        """Should double the delay after each failure up to a maximum."""
+        delays = [outbox.backoff_delay(attempts, 1, 10)
+                  for attempts in range(1, 6)]
+        assert delays == [1, 2, 4, 8, 10]
+
+    def test_batches_report_each_status(self):
+        """Should post due results together and retry only those which
+        failed."""
+        self.settings['batch_size'] = 3
+        for index in range(3):
+            outbox.enqueue_result(self.conn, 'url', '{"n": %d}' % index)
+        session = FakeSession([FakeResponse(200, [200, {'status': 500}, 201])])
+
+        delivered = outbox.deliver_due_batches(
+            self.conn, session, self.settings)
+
+        assert delivered == 2
+        assert len(session.posted) == 1
+        assert session.posted[0][1] == '[{"n": 0},{"n": 1},{"n": 2}]'
+        assert self.pending() == [('pending', 1)]
+
+    def test_partial_batches_wait_for_window(self):
+        """Should hold back a partial batch until its window has passed."""
+        self.settings['batch_size'] = 3
+        self.settings['batch_window'] = 60
+        outbox.enqueue_result(self.conn, 'url', '{}')
+        session = FakeSession([])
+
+        assert outbox.deliver_due_batches(
+            self.conn, session, self.settings) == 0
+        assert session.posted == []
+
+        self.settings['batch_window'] = 0
+        session.outcomes.append(FakeResponse(200, [200]))
+        assert outbox.deliver_due_batches(
+            self.conn, session, self.settings) == 1
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Test the simulation result cache."""
+
+import unittest
+import os
+import re
+import shutil
+import tempfile
+import setup_db
+from result_cache import ResultCache, cache_key
+from simulator.build_sim import build_sim
+
+SIM_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    'simulator/test_simulations/valid/source-to-process-with-resources.xml')
+
+class ResultCacheTestCase(unittest.TestCase):
+    """Tests for the result cache."""
+
+    def setUp(self):
+        """Run before every test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.tmp_dir, 'simulations.db')
+        setup_db.init_db(db_path)
+        self.conn = setup_db.connect_db(db_path, autocommit=True)
+
+    def tearDown(self):
+        """Run after every test."""
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hits_and_misses_are_counted(self):
+        """Should serve stored statistics and count hits and misses."""
+        cache = ResultCache(self.conn)
+        assert cache.get('key') is None
+
+        cache.put('key', {'nodes': {}})
+        assert cache.get('key') == {'nodes': {}}
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['entries'] == 1
+
+    def test_expired_entries_are_not_served(self):
+        """Should treat entries older than max_age as misses."""
+        cache = ResultCache(self.conn, max_age=-1)
+        cache.put('key', {})
+        assert cache.get('key') is None
+
+    def test_lru_entries_are_evicted(self):
+        """Should evict the least recently used entries when over max_size."""
+        cache = ResultCache(self.conn, max_size=40)
+        cache.put('old', {'value': 'x' * 10})
+        cache.put('new', {'value': 'y' * 10})
+
+        assert cache.get('old') is None
+        assert cache.get('new') is not None
+
+    def test_size_is_kept_as_a_total(self):
+        """Should keep a running total of the size of every entry."""
+        cache = ResultCache(self.conn, max_size=60)
+        cache.put('first', {'value': 'x' * 10})
+        cache.put('second', {'value': 'y' * 20})
+        cache.put('first', {'value': 'x'})
+        cache.put('third', {'value': 'z' * 30})
+
+        size = self.conn.execute(
+            'SELECT SUM(size) FROM result_cache').fetchone()[0]
+        assert cache.stats()['size'] == size
+        assert size <= 60
+
+    def test_key_ignores_layout(self):
+        """Should give the same key to boards which only differ in layout."""
+        with open(SIM_PATH, 'r') as xml_file:
+            xml = xml_file.read()
+        moved = re.sub(r' x="\d+"', ' x="999"', xml)
+        assert moved != xml
+
+        params = {'horizon': 10}
+        assert cache_key(build_sim(xml), params) == \
+            cache_key(build_sim(moved), params)
+        assert cache_key(build_sim(xml), params) != \
+            cache_key(build_sim(xml), {'horizon': 20})
+
+if __name__ == '__main__':
+    unittest.main()
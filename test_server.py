@@ -2,18 +2,38 @@
 
 import unittest
 import json
+import os
+import shutil
+import tempfile
 import main
+import setup_db
 
 class ServerTestCase(unittest.TestCase):
     """Tests for the server."""
 
     def setUp(self):
         """Run before every test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'simulations.db')
+        setup_db.init_db(self.db_path)
+        main.app.config['DATABASE'] = self.db_path
         self.app = main.app.test_client()
 
     def tearDown(self):
         """Run after every test."""
-        pass
+        main.get_db().close()
+        main.app.config['DATABASE'] = setup_db.DB_PATH
+        shutil.rmtree(self.tmp_dir)
+
+    def queued_simulations(self):
+        """Return (simulation, user_id, board_name) of queued simulations."""
+        conn = setup_db.connect_db(self.db_path)
+        rows = conn.execute('''
+                            SELECT simulation, user_id, board_name
+                            FROM simulations
+                            ORDER BY id''').fetchall()
+        conn.close()
+        return rows
 
     def test_no_post_body(self):
         """Should respond with 400 if the POST has no body."""
@@ -33,5 +53,52 @@ class ServerTestCase(unittest.TestCase):
                                  content_type='application/json')
         assert response.status_code == 400
 
+    def test_store_simulation(self):
+        """Should queue a valid simulation."""
+        data = json.dumps({'simulation': '<xml/>', 'user_id': 'user'})
+        response = self.app.post('/',
+                                 data=data,
+                                 content_type='application/json')
+        assert response.status_code == 200
+        assert self.queued_simulations() == [('<xml/>', 'user', None)]
+
+    def test_store_simulations_in_bulk(self):
+        """Should queue every simulation in a bulk submission."""
+        data = json.dumps([
+            {'simulation': '<a/>', 'user_id': 'user'},
+            {'simulation': '<b/>', 'user_id': 'user', 'board_name': 'board'}])
+        response = self.app.post('/bulk',
+                                 data=data,
+                                 content_type='application/json')
+        assert response.status_code == 200
+        assert json.loads(response.data.decode())['count'] == 2
+        assert self.queued_simulations() == [
+            ('<a/>', 'user', None),
+            ('<b/>', 'user', 'board')]
+
+    def test_invalid_bulk_stores_nothing(self):
+        """Should respond with 400 and queue nothing if any simulation in a
+        bulk submission is invalid."""
+        data = json.dumps([
+            {'simulation': '<a/>', 'user_id': 'user'},
+            {'simulation': '<b/>'}])
+        response = self.app.post('/bulk',
+                                 data=data,
+                                 content_type='application/json')
+        assert response.status_code == 400
+        assert self.queued_simulations() == []
+
+    def test_metrics(self):
+        """Should report the queue in the Prometheus text format."""
+        data = json.dumps([{'simulation': '<a/>', 'user_id': 'user'}] * 2)
+        self.app.post('/bulk', data=data, content_type='application/json')
+
+        response = self.app.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        lines = response.data.decode().splitlines()
+        assert 'sim_queue_depth 2' in lines
+        assert 'sim_jobs_completed_total 0' in lines
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,253 @@
+"""Test the worker's simulation queue."""
+
+import unittest
+import configparser
+import json
+import os
+import shutil
+import tempfile
+import time
+import setup_db
+import sim_worker
+from simulator.metrics import Metrics
+from job_metrics import get_job_metrics
+
+SIM_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    'simulator/test_simulations/valid',
+    'source-to-process-to-decision-to-exits.xml')
+
+class ShutdownDuringJob(sim_worker.Shutdown):
+    """Shutdown requested just as the worker starts its first job."""
+    def requested(self):
+        requested = super(ShutdownDuringJob, self).requested()
+        self.request()
+        return requested
+
+class ShutdownAfterPolls(sim_worker.Shutdown):
+    """Shutdown requested once the worker has slept `polls` times."""
+    def __init__(self, polls):
+        super(ShutdownAfterPolls, self).__init__()
+        self.polls = polls
+        self.waits = []
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+        if len(self.waits) == self.polls:
+            self.request()
+        return self.requested()
+
+class SimQueueTestCase(unittest.TestCase):
+    """Tests for claiming simulations from the queue."""
+
+    def setUp(self):
+        """Run before every test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'simulations.db')
+        setup_db.init_db(self.db_path)
+        self.conn = setup_db.connect_db(self.db_path, autocommit=True)
+
+    def tearDown(self):
+        """Run after every test."""
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def enqueue(self, simulation):
+        """Add a simulation to the queue."""
+        self.conn.execute(
+            'INSERT INTO simulations(simulation, user_id) VALUES (?, ?)',
+            (simulation, 'user'))
+
+    def count(self, table):
+        """Count the rows in a table."""
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+
+    def test_empty_queue(self):
+        """Should claim nothing when the queue is empty."""
+        assert sim_worker.claim_next_sim(self.conn, 'a', 60) is None
+
+    def test_claims_are_exclusive(self):
+        """Should never hand the same simulation to two workers."""
+        self.enqueue('first')
+        self.enqueue('second')
+
+        claimed_a = sim_worker.claim_next_sim(self.conn, 'a', 60)
+        claimed_b = sim_worker.claim_next_sim(self.conn, 'b', 60)
+
+        assert claimed_a is not None and claimed_b is not None
+        assert claimed_a[0] != claimed_b[0]
+        assert sim_worker.claim_next_sim(self.conn, 'c', 60) is None
+
+    def test_claims_are_fifo(self):
+        """Should claim the oldest queued simulation first."""
+        self.enqueue('first')
+        self.enqueue('second')
+
+        assert sim_worker.claim_next_sim(self.conn, 'a', 60)[1] == 'first'
+        assert sim_worker.claim_next_sim(self.conn, 'a', 60)[1] == 'second'
+
+    def test_expired_lease_is_requeued(self):
+        """Should hand out a simulation again once its lease has expired."""
+        self.enqueue('simulation')
+
+        claimed_a = sim_worker.claim_next_sim(self.conn, 'a', -1)
+        claimed_b = sim_worker.claim_next_sim(self.conn, 'b', 60)
+
+        assert claimed_b is not None
+        assert claimed_a[0] == claimed_b[0]
+
+    def test_complete_requires_current_claim(self):
+        """Should only let the worker holding a simulation store its result."""
+        self.enqueue('simulation')
+        sim_id = sim_worker.claim_next_sim(self.conn, 'a', 60)[0]
+
+        sim_worker.complete_sim(self.conn, sim_id, 'b', 'url', '{}')
+        assert self.count('simulations') == 1
+        assert self.count('outbox') == 0
+
+        sim_worker.complete_sim(self.conn, sim_id, 'a', 'url', '{}')
+        assert self.count('simulations') == 0
+        assert self.count('outbox') == 1
+
+    def worker_config(self):
+        """Return the configuration the worker tests run with."""
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'Respond': {'url': 'url'},
+            'Worker': {'poll_interval': '0.01'},
+            'Cache': {'enabled': 'false'},
+        })
+        return config
+
+    def test_renew_lease_requires_claim(self):
+        """Should only extend the lease of the worker holding it."""
+        self.enqueue('simulation')
+        sim_id = sim_worker.claim_next_sim(self.conn, 'a', 1)[0]
+
+        def lease():
+            """Return when the simulation's lease expires."""
+            return self.conn.execute(
+                'SELECT lease_expires_at FROM simulations WHERE id = ?',
+                (sim_id,)).fetchone()[0]
+        claimed = lease()
+
+        sim_worker.renew_lease(self.conn, sim_id, 'b', 60)
+        assert lease() == claimed
+        sim_worker.renew_lease(self.conn, sim_id, 'a', 60)
+        assert lease() > claimed
+
+    def test_lease_is_kept_while_running(self):
+        """Should keep extending the lease while a job runs."""
+        self.enqueue('simulation')
+        sim_id = sim_worker.claim_next_sim(self.conn, 'a', 0.3)[0]
+        query = 'SELECT lease_expires_at FROM simulations WHERE id = ?'
+        claimed = self.conn.execute(query, (sim_id,)).fetchone()[0]
+
+        with sim_worker.LeaseKeeper(self.db_path, sim_id, 'a', 0.3):
+            time.sleep(0.5)
+        renewed = self.conn.execute(query, (sim_id,)).fetchone()[0]
+        assert renewed > claimed
+
+    def test_shutdown_finishes_the_job(self):
+        """Should complete the job in hand when asked to stop, then stop."""
+        with open(SIM_PATH, 'r') as sim_file:
+            simulation = sim_file.read()
+        self.enqueue(simulation)
+        self.enqueue(simulation)
+
+        sim_worker.run_worker(
+            self.worker_config(), ShutdownDuringJob(), self.db_path)
+        assert self.count('outbox') == 1
+        assert self.conn.execute(
+            'SELECT status, claimed_by FROM simulations').fetchall() == [
+                ('queued', None)]
+
+    def test_empty_queue_is_polled(self):
+        """Should sleep and poll again, rather than exit, when the queue is
+        empty."""
+        shutdown = ShutdownAfterPolls(3)
+        sim_worker.run_worker(self.worker_config(), shutdown, self.db_path)
+        assert shutdown.waits == [0.01, 0.01, 0.01]
+        assert self.count('outbox') == 0
+
+    def test_replications_use_processes(self):
+        """Should run a job's replications in the worker's own process when
+        given one process."""
+        with open(SIM_PATH, 'r') as sim_file:
+            self.conn.execute(
+                'INSERT INTO simulations(simulation, user_id, params) '
+                'VALUES (?, ?, ?)',
+                (sim_file.read(), 'user', json.dumps({'replications': 2})))
+
+        assert sim_worker.run_oldest_sim(
+            self.conn, self.worker_config(), 'a', self.db_path, processes=1)
+        payload = json.loads(self.conn.execute(
+            'SELECT payload FROM outbox').fetchone()[0])
+        assert payload['data']['statistics']['replications'] == 2
+
+    def test_estimates_are_sent_first(self):
+        """Should deliver estimated statistics ahead of the results."""
+        with open(SIM_PATH, 'r') as sim_file:
+            self.enqueue(sim_file.read())
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'Respond': {'url': 'url', 'send_estimates': 'true'},
+            'Cache': {'enabled': 'false'},
+        })
+
+        assert sim_worker.run_oldest_sim(
+            self.conn, config, 'a', db_path=self.db_path)
+        payloads = [json.loads(row[0])['data'] for row in self.conn.execute(
+            'SELECT payload FROM outbox ORDER BY id')]
+        assert len(payloads) == 2
+        assert payloads[0]['estimate'] is True
+        exits = payloads[0]['statistics']['exits']
+        self.assertAlmostEqual(exits['7'], 0.4)
+        assert 'estimate' not in payloads[1]
+
+    def test_failed_estimates_are_skipped(self):
+        """Should still run the simulation if the estimate can't be
+        delivered, without timing the estimate as part of the job."""
+        def on_estimate(estimate):
+            """Fail to deliver the estimate."""
+            raise ValueError('unreachable')
+
+        metrics = Metrics()
+        with open(SIM_PATH, 'r') as sim_file:
+            statistics, error_message = sim_worker.run_sim(
+                sim_file.read(), on_estimate=on_estimate, metrics=metrics)
+        assert error_message is None
+        assert statistics['nodes']['5']['visited_count'] > 0
+        assert 'estimate' not in metrics.phases
+
+    def test_job_metrics_are_stored(self):
+        """Should return and store the time spent in each phase of a job."""
+        with open(SIM_PATH, 'r') as sim_file:
+            self.enqueue(sim_file.read())
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'Respond': {'url': 'url'},
+            'Cache': {'enabled': 'false', 'ir_max_entries': '0'},
+        })
+
+        assert sim_worker.run_oldest_sim(
+            self.conn, config, 'a', db_path=self.db_path)
+        sim_id, payload = self.conn.execute(
+            'SELECT job_id, payload FROM outbox').fetchone()
+        metrics = json.loads(payload)['data']['metrics']
+        for phase in ['parse', 'validate', 'compile', 'build', 'run',
+                      'analyze']:
+            assert metrics['phases'][phase] >= 0
+        assert metrics['counts']['entities'] > 0
+        assert metrics['events_per_second'] > 0
+
+        job = get_job_metrics(self.conn, sim_id)
+        assert job['status'] == 'completed'
+        assert job['counts'] == metrics['counts']
+        assert 'serialize' in job['phases']
+        assert job['runtime'] >= sum(metrics['phases'].values())
+        assert job['delivered_at'] is None
+
+if __name__ == '__main__':
+    unittest.main()